@@ -1 +1,10 @@
-from .db import CrystalStructure
\ No newline at end of file
+__all__ = ["CrystalStructure"]
+
+
+def __getattr__(name):
+    # imported on first access, so that importing a submodule, e.g. by
+    # `lam-opt`, does not import pymatgen
+    if name == "CrystalStructure":
+        from .db import CrystalStructure
+        return CrystalStructure
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,163 @@
+"""Batched energy/force/stress evaluation for several ``ase.Atoms`` at once.
+
+DP and MACE models are evaluated with one model call per batch, any other
+ASE calculator falls back to evaluating the structures one after another.
+"""
+from typing import Dict, List, Optional
+
+import ase
+import numpy as np
+
+from lam_optimize.metrics import METRICS
+
+
+def _is_dp_calculator(calculator) -> bool:
+    return type(calculator).__module__.startswith("deepmd") and hasattr(calculator, "dp")
+
+
+def _is_mace_calculator(calculator) -> bool:
+    return type(calculator).__module__.startswith("mace") and hasattr(calculator, "models")
+
+
+def _virial_to_stress(virial: np.ndarray, volume: float) -> np.ndarray:
+    stress = -0.5 * (virial + virial.T) / volume
+    return stress.flat[[0, 4, 8, 5, 2, 1]]
+
+
+def _calculate_serial(calculator, atoms_list: List[ase.Atoms], compute_stress: bool) -> List[Dict]:
+    results = []
+    for atoms in atoms_list:
+        atoms = atoms.copy()
+        atoms.calc = calculator
+        res = {
+            "energy": atoms.get_potential_energy(),
+            "forces": atoms.get_forces(),
+        }
+        if compute_stress:
+            res["stress"] = atoms.get_stress()
+        results.append(res)
+    return results
+
+
+def _calculate_dp(calculator, atoms_list: List[ase.Atoms], compute_stress: bool) -> List[Dict]:
+    # DeepPot.eval takes several frames in one call as long as they share
+    # the same atom types, so the atoms of every frame are sorted by type and
+    # frames are grouped by their sorted type sequence, i.e. their composition
+    results = [None] * len(atoms_list)
+    groups = {}
+    orders = []
+    for i, atoms in enumerate(atoms_list):
+        atype = np.array([calculator.type_dict[k] for k in atoms.get_chemical_symbols()], dtype=int)
+        order = np.argsort(atype, kind="stable")
+        orders.append(order)
+        periodic = bool(sum(atoms.get_pbc()) > 0)
+        groups.setdefault((tuple(atype[order]), periodic), []).append(i)
+
+    for (atype, periodic), indices in groups.items():
+        coords = np.stack([atoms_list[i].get_positions()[orders[i]].reshape(-1) for i in indices])
+        if periodic:
+            cells = np.stack([atoms_list[i].get_cell()[:].reshape(-1) for i in indices])
+        else:
+            cells = None
+        e, f, v = calculator.dp.eval(coords=coords, cells=cells, atom_types=list(atype))[:3]
+        for j, i in enumerate(indices):
+            # forces back in the order of the input atoms
+            forces = np.empty((len(atype), 3))
+            forces[orders[i]] = f[j].reshape(-1, 3)
+            res = {
+                "energy": float(e[j][0]),
+                "forces": forces,
+            }
+            if compute_stress and periodic:
+                res["stress"] = _virial_to_stress(v[j].reshape(3, 3), atoms_list[i].get_volume())
+            results[i] = res
+    return results
+
+
+def _calculate_mace(calculator, atoms_list: List[ase.Atoms], compute_stress: bool) -> List[Dict]:
+    # all graphs are concatenated into one torch_geometric batch
+    import torch
+    from ase.stress import full_3x3_to_voigt_6_stress
+    from mace import data
+    from mace.tools import torch_geometric
+
+    dataset = [
+        data.AtomicData.from_config(data.config_from_atoms(atoms), z_table=calculator.z_table, cutoff=calculator.r_max)
+        for atoms in atoms_list
+    ]
+    data_loader = torch_geometric.dataloader.DataLoader(
+        dataset=dataset,
+        batch_size=len(dataset),
+        shuffle=False,
+        drop_last=False,
+    )
+    batch_base = next(iter(data_loader)).to(calculator.device)
+    energy_units = getattr(calculator, "energy_units_to_eV", 1.0)
+    length_units = getattr(calculator, "length_units_to_A", 1.0)
+
+    energies, forces, stresses = [], [], []
+    for model in calculator.models:
+        batch = batch_base.clone()
+        out = model(batch.to_dict(), compute_stress=compute_stress)
+        energies.append(out["energy"].detach())
+        forces.append(out["forces"].detach())
+        if compute_stress and out.get("stress") is not None:
+            stresses.append(out["stress"].detach())
+    energies = torch.mean(torch.stack(energies), dim=0).cpu().numpy() * energy_units
+    forces = torch.mean(torch.stack(forces), dim=0).cpu().numpy() * energy_units / length_units
+    if stresses:
+        stresses = torch.mean(torch.stack(stresses), dim=0).cpu().numpy() * energy_units / length_units**3
+
+    ptr = batch_base.ptr.cpu().numpy()
+    results = []
+    for i in range(len(atoms_list)):
+        res = {
+            "energy": float(energies[i]),
+            "forces": forces[ptr[i]:ptr[i + 1]],
+        }
+        if len(stresses) > 0:
+            res["stress"] = full_3x3_to_voigt_6_stress(stresses[i])
+        results.append(res)
+    return results
+
+
+def calculate_batch(
+    calculator,
+    atoms_list: List[ase.Atoms],
+    compute_stress: bool = True,
+    batch_size: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Evaluate energies, forces and (optionally) stresses of many structures
+
+    Parameters:
+    ----------
+    calculator: ase.calculators.calculator.Calculator
+        DP or MACE calculator, other calculators are evaluated serially.
+    atoms_list: List[ase.Atoms]
+        Structures to evaluate.
+    compute_stress: bool
+        Whether to compute stress in Voigt order, in eV/A^3.
+    batch_size: int
+        Max number of structures evaluated in one model call, `None` for all.
+
+    Returns:
+    ----------
+    A list of dicts with keys `energy`, `forces` and `stress`, in input order.
+    """
+    if _is_dp_calculator(calculator):
+        func = _calculate_dp
+    elif _is_mace_calculator(calculator):
+        func = _calculate_mace
+    else:
+        func = _calculate_serial
+    if batch_size is None or batch_size <= 0:
+        batch_size = max(len(atoms_list), 1)
+    results = []
+    for i in range(0, len(atoms_list), batch_size):
+        with METRICS.timer("model"):
+            results += func(calculator, atoms_list[i:i + batch_size], compute_stress)
+        # serial evaluations are counted by the calculator of a `Relaxer`
+        if func is not _calculate_serial:
+            METRICS.count("force_calls", len(atoms_list[i:i + batch_size]))
+    return results
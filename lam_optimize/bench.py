@@ -0,0 +1,397 @@
+"""Throughput benchmarks of relaxation, single point evaluation and post-processing.
+
+Structures are synthetic FCC supercells of the elements supported by the ASE
+EMT calculator, substituted, strained and rattled with a fixed seed, so that
+the benchmarks run offline on a CPU with the `emt` stand-in model as well as
+with DP and MACE models. The duplicate check queries a local structure
+database filled with part of the structures, and energies above hull use
+phase diagrams built locally, so that no request leaves the machine.
+
+Every case reports structures/s, model force calls/s and the peak RSS of the
+process it ran in, as JSON records for regression tracking.
+
+`check_startup` guards the startup of `lam-opt`, which must parse its
+arguments without importing the scientific stack.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from pymatgen.analysis.phase_diagram import PDEntry, PhaseDiagram
+from pymatgen.core import Composition, Lattice, Structure
+
+from lam_optimize.local_db import LocalStructureStore
+from lam_optimize.metrics import METRICS, peak_rss_mb
+from lam_optimize.options import BENCH_CASES, CELL_FILTER_NAMES, OPTIMIZER_NAMES
+from lam_optimize.relaxer import CELL_FILTERS, OPTIMIZERS, Relaxer
+
+# lattice constants of the FCC elements supported by EMT, in A
+FCC_LATTICE = {
+    "Al": 4.05,
+    "Cu": 3.61,
+    "Ni": 3.52,
+    "Pd": 3.89,
+    "Ag": 4.09,
+    "Pt": 3.92,
+    "Au": 4.08,
+}
+
+
+def make_structures(n: int, natoms: int = 32, seed: int = 0, duplicate_fraction: float = 0.25) -> List[Structure]:
+    """
+    Generate synthetic crystals of about `natoms` atoms
+
+    Each structure is an FCC supercell of `4 * k ** 3` atoms, with `k` chosen
+    to come closest to `natoms`, of one element with part of its sites
+    substituted by a second element, strained and rattled. A fraction of the
+    structures are copies of earlier ones with shuffled sites, for the
+    duplicate check to find.
+
+    Parameters:
+    ----------
+    n: int
+        Number of structures.
+    natoms: int
+        Approximate number of atoms per structure.
+    seed: int
+        Seed of the random generator, the same seed gives the same structures.
+    duplicate_fraction: float
+        Fraction of the structures copied from earlier ones.
+    """
+    rng = np.random.default_rng(seed)
+    k = max(int(round((natoms / 4) ** (1 / 3))), 1)
+    elements = list(FCC_LATTICE)
+    structures = []
+    for i in range(n):
+        if i > 0 and rng.random() < duplicate_fraction:
+            original = structures[rng.integers(len(structures))]
+            sites = [original[int(j)] for j in rng.permutation(len(original))]
+            structures.append(Structure.from_sites(sites))
+            continue
+        host, guest = rng.choice(elements, size=2, replace=False)
+        structure = Structure.from_spacegroup("Fm-3m", Lattice.cubic(FCC_LATTICE[host]), [host], [[0, 0, 0]])
+        structure.make_supercell([k, k, k])
+        nguest = rng.integers(0, len(structure) // 2 + 1)
+        for j in rng.choice(len(structure), size=nguest, replace=False):
+            structure.replace(int(j), guest)
+        strain = np.eye(3) + rng.uniform(-0.02, 0.02, size=(3, 3))
+        lattice = Lattice(structure.lattice.matrix @ (strain + strain.T) / 2)
+        coords = structure.cart_coords @ np.linalg.solve(structure.lattice.matrix, lattice.matrix)
+        coords += rng.normal(scale=0.05, size=coords.shape)
+        structures.append(Structure(lattice, structure.species, coords, coords_are_cartesian=True))
+    return structures
+
+
+def write_structures(structures: Sequence[Structure], folder: Union[str, Path]) -> List[Path]:
+    """Write structures to `<folder>/<index>.cif`"""
+    folder = Path(folder)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i, structure in enumerate(structures):
+        path = folder / f"{i:06d}.cif"
+        structure.to(filename=str(path))
+        paths.append(path)
+    return paths
+
+
+def make_structure_store(path: Union[str, Path], structures: Sequence[Structure], energies: Sequence[float]) -> LocalStructureStore:
+    """Local stand-in of the OpenLAM structure database holding `structures`"""
+    store = LocalStructureStore(path)
+    now = datetime.now()
+    store.insert_items([
+        {
+            "formula": structure.composition.reduced_formula,
+            "energy": float(energy),
+            "submissionTime": now.replace(microsecond=i % 1000000).isoformat(),
+            "structure": json.dumps(structure.as_dict()),
+        }
+        for i, (structure, energy) in enumerate(zip(structures, energies))
+    ])
+    return store
+
+
+def make_hull_query(seed: int = 0, nentries: int = 8) -> Callable[[List[str]], PhaseDiagram]:
+    """
+    Local stand-in of `utils.query_hull_by_composition`, building a phase
+    diagram of formation energies per chemical system with the elements at 0
+    and `nentries` random compounds below
+    """
+    hulls = {}
+
+    def query_hull(elements: List[str]) -> PhaseDiagram:
+        chemsys = tuple(sorted(elements))
+        if chemsys not in hulls:
+            rng = np.random.default_rng([seed] + [Composition(el).elements[0].Z for el in chemsys])
+            entries = [PDEntry(Composition(el), 0.0) for el in chemsys]
+            if len(chemsys) > 1:
+                for _ in range(nentries):
+                    amounts = rng.integers(1, 4, size=len(chemsys))
+                    comp = Composition(dict(zip(chemsys, amounts.tolist())))
+                    entries.append(PDEntry(comp, rng.uniform(-0.3, 0.0) * comp.num_atoms))
+            hulls[chemsys] = PhaseDiagram(entries)
+        return hulls[chemsys]
+
+    return query_hull
+
+
+@contextmanager
+def _working_dir(path: Union[str, Path], environ: Optional[Dict[str, str]] = None):
+    # `relax_run` writes to the working directory and reads the structure
+    # database from the environment
+    cwd = os.getcwd()
+    saved = {key: os.environ.get(key) for key in (environ or {})}
+    os.chdir(path)
+    os.environ.update(environ or {})
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _energies(relaxer: Relaxer, structures: List[Structure]) -> np.ndarray:
+    atoms_list = [relaxer.ase_adaptor.get_atoms(structure) for structure in structures]
+    return np.array([res["energy"] for res in relaxer.evaluate(atoms_list)])
+
+
+def _bench_relax(relaxer: Relaxer, structures: List[Structure], workdir: Path, fmax: float, steps: int) -> dict:
+    METRICS.reset()
+    start = time.perf_counter()
+    results = [relaxer.relax(structure, fmax=fmax, steps=steps, traj_interval=0) for structure in structures]
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "converged": sum(res["converged"] for res in results)}
+
+
+def _bench_relax_run(relaxer: Relaxer, structures: List[Structure], workdir: Path, fmax: float, steps: int) -> dict:
+    from lam_optimize.main import iter_relax_run
+
+    cifs = workdir / "cifs"
+    write_structures(structures, cifs)
+    store = workdir / "structures.db"
+    make_structure_store(store, structures[::2], _energies(relaxer, structures[::2]))
+    with _working_dir(workdir, {"OPENLAM_STRUCTURE_DB": str(store)}):
+        METRICS.reset()
+        start = time.perf_counter()
+        records = list(iter_relax_run(cifs, relaxer, fmax=fmax, steps=steps, check_duplicate=True, journal=None))
+        elapsed = time.perf_counter() - start
+    relaxed = [record for record in records if record["status"] == "relaxed"]
+    return {"seconds": elapsed, "converged": sum(bool(record["optimizer_converged"]) for record in relaxed)}
+
+
+def _bench_single_point(relaxer: Relaxer, structures: List[Structure], workdir: Path, fmax: float, steps: int) -> dict:
+    from lam_optimize.main import single_point
+
+    cifs = workdir / "cifs"
+    write_structures(structures, cifs)
+    METRICS.reset()
+    start = time.perf_counter()
+    single_point(cifs, relaxer)
+    return {"seconds": time.perf_counter() - start}
+
+
+def _bench_dedup(relaxer: Relaxer, structures: List[Structure], workdir: Path, fmax: float, steps: int) -> dict:
+    from lam_optimize.dedup import DuplicateFinder
+
+    energies = _energies(relaxer, structures)
+    store = make_structure_store(workdir / "structures.db", structures[::2], energies[::2])
+    METRICS.reset()
+    start = time.perf_counter()
+    finder = DuplicateFinder(query_known=store.iter_query)
+    duplicates = [finder.check(structure, energy, str(i)) for i, (structure, energy) in enumerate(zip(structures, energies))]
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "duplicates": sum(d is not None for d in duplicates),
+            "fits": finder.known.nfits + finder.seen.nfits}
+
+
+def _bench_thermo(relaxer: Relaxer, structures: List[Structure], workdir: Path, fmax: float, steps: int) -> dict:
+    from lam_optimize.thermo import get_e_above_hull_batch, get_e_form_per_atom_batch
+
+    energies = _energies(relaxer, structures)
+    query_hull = make_hull_query()
+    METRICS.reset()
+    start = time.perf_counter()
+    e_form = get_e_form_per_atom_batch(structures, energies)
+    get_e_above_hull_batch(structures, e_form, query_hull=query_hull, on_error="ignore")
+    return {"seconds": time.perf_counter() - start}
+
+
+CASES = {
+    "relax": _bench_relax,
+    "relax_run": _bench_relax_run,
+    "single_point": _bench_single_point,
+    "dedup": _bench_dedup,
+    "thermo": _bench_thermo,
+}
+
+
+def _run_case(case: str, relaxer: Relaxer, n: int, natoms: int, fmax: float, steps: int, seed: int) -> dict:
+    METRICS.enable()
+    structures = make_structures(n, natoms=natoms, seed=seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        result = CASES[case](relaxer, structures, Path(workdir), fmax, steps)
+    seconds = result["seconds"]
+    # counted by `METRICS` since the timing of the case started
+    result["force_calls"] = int(METRICS.counters["force_calls"])
+    result["stages"] = METRICS.snapshot(structures=False)["stages"]
+    return {
+        "case": case,
+        "model": str(relaxer.model),
+        "structures": n,
+        "natoms": sum(len(structure) for structure in structures) / max(n, 1),
+        **result,
+        "structures_per_s": n / seconds if seconds > 0 else None,
+        "force_calls_per_s": result["force_calls"] / seconds if seconds > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_benchmarks(
+    relaxer: Relaxer,
+    cases: Optional[List[str]] = None,
+    sizes: Sequence[int] = (8, 32, 108),
+    n: int = 16,
+    fmax: float = 0.05,
+    steps: int = 100,
+    seed: int = 0,
+    isolate: bool = True,
+) -> List[dict]:
+    """
+    Run benchmark cases on synthetic structures
+
+    Parameters:
+    ----------
+    relaxer: Relaxer
+        The relaxer benchmarked, e.g. `Relaxer("emt")`.
+    cases: List[str]
+        Cases to run among `CASES`, all by default.
+    sizes: Sequence[int]
+        Approximate numbers of atoms per structure, each size is run separately.
+    n: int
+        Number of structures per case and size.
+    fmax: float
+        Force convergence criteria of the relaxations, in eV/A.
+    steps: int
+        Max steps of the relaxations.
+    seed: int
+        Seed of the synthetic structures.
+    isolate: bool
+        Run each case in a fresh process, so that its peak RSS is its own.
+        The model is loaded in that process before the timing starts.
+
+    Returns:
+    ----------
+    One record per case and size with the wall time `seconds`,
+    `structures_per_s`, `force_calls_per_s`, `peak_rss_mb` and the time of each
+    stage of `lam_optimize.metrics`.
+    """
+    cases = list(CASES) if cases is None else cases
+    for case in cases:
+        if case not in CASES:
+            raise ValueError(f"Unknown benchmark case {case}, should be one of {list(CASES)}")
+    results = []
+    for natoms in sizes:
+        for case in cases:
+            args = (case, relaxer, n, natoms, fmax, steps, seed)
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    result = executor.submit(_run_case, *args).result()
+            else:
+                result = _run_case(*args)
+            logging.info(f"{case} ({natoms} atoms): {result['structures']} structures in {result['seconds']:.3g} s")
+            results.append(result)
+    return results
+
+
+# modules a subcommand of `lam-opt` imports only when it runs
+HEAVY_MODULES = ["ase", "deepmd", "dflow", "mace", "pandas", "pymatgen", "torch", "tqdm"]
+STARTUP_CHECKS = {
+    # parsing the arguments of any subcommand
+    "parse": ("from lam_optimize.entrypoint import main_parser; main_parser().parse_args(['download', 'ID'])",
+              HEAVY_MODULES),
+    # relaxations need neither dflow nor a model before it is loaded
+    "relax": ("import lam_optimize.main", ["deepmd", "dflow", "mace", "torch"]),
+}
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+{code}
+print(json.dumps({{"seconds": time.perf_counter() - start, "modules": list(sys.modules)}}))
+"""
+
+
+def check_startup(max_seconds: Optional[float] = None, repeat: int = 3) -> List[dict]:
+    """
+    Check that the startup of `lam-opt` imports none of `HEAVY_MODULES`, each
+    check of `STARTUP_CHECKS` running in a fresh interpreter
+
+    Parameters:
+    ----------
+    max_seconds: float
+        If set, a check whose best time exceeds it also fails.
+    repeat: int
+        Number of times each check is timed.
+
+    Returns:
+    ----------
+    One record per check with the best time `seconds` and the heavy modules imported.
+    Raises `RuntimeError` on a regression.
+    """
+    failures = []
+    if OPTIMIZER_NAMES != list(OPTIMIZERS) or CELL_FILTER_NAMES != list(CELL_FILTERS) or BENCH_CASES != list(CASES):
+        failures.append("the choices of `lam_optimize.options` are out of date")
+    records = []
+    for name, (code, forbidden) in STARTUP_CHECKS.items():
+        times = []
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT.format(code=code)],
+                                  capture_output=True, text=True, check=True)
+            data = json.loads(proc.stdout.splitlines()[-1])
+            times.append(data["seconds"])
+        imported = sorted({module.split(".")[0] for module in data["modules"]} & set(forbidden))
+        record = {"check": name, "seconds": min(times), "heavy_modules": imported}
+        if imported:
+            failures.append(f"{name} imports {imported}")
+        if max_seconds is not None and record["seconds"] > max_seconds:
+            failures.append(f"{name} takes {record['seconds']:.3g} s")
+        records.append(record)
+    if failures:
+        raise RuntimeError("Startup regression: " + "; ".join(failures))
+    return records
+
+
+def get_environment() -> dict:
+    """Versions of Python and the dependencies the timings depend on"""
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+    for name in ["numpy", "ase", "pymatgen", "torch", "deepmd", "mace"]:
+        try:
+            module = __import__(name)
+        except ImportError:
+            continue
+        env[name] = getattr(module, "__version__", None)
+    return env
+
+
+def save_results(results: List[dict], path: Union[str, Path]):
+    """Save benchmark records with the environment to a JSON file"""
+    with open(path, "w") as f:
+        json.dump({"environment": get_environment(), "results": results}, f, indent=2)
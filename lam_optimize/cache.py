@@ -0,0 +1,157 @@
+"""In-memory and on-disk caches for data downloaded from OpenLAM.
+
+The on-disk cache lives in `OPENLAM_CACHE_DIR` (default `~/.cache/openlam`).
+Files are written to a unique temporary name and renamed into place, so
+readers never see a partial file, and a lock file per key lets concurrent
+processes share one download.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, only threads are synchronized
+    fcntl = None
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("OPENLAM_CACHE_DIR", Path.home() / ".cache" / "openlam"))
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache
+
+    Parameters:
+    ----------
+    maxsize: int
+        Max number of items kept.
+    """
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class KeyedLock:
+    """One lock per key, so that callers of different keys do not block each other"""
+    def __init__(self):
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, key) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+
+class DiskCache:
+    """Directory of cached files with size-based eviction and a max age
+
+    Parameters:
+    ----------
+    directory: Union[str, Path]
+        Directory of the cached files.
+    max_size: int
+        Max total size in bytes, the least recently used files are evicted
+        beyond it.
+    max_age: float
+        Age in seconds after which a file is stale, `None` to never expire.
+    """
+    def __init__(self, directory: Union[str, Path], max_size: int = 1 << 30, max_age: Optional[float] = None):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.locks = KeyedLock()
+
+    def path(self, key: str) -> Path:
+        return self.directory / key
+
+    def is_stale(self, path: Path) -> bool:
+        return self.max_age is not None and time.time() - path.stat().st_mtime > self.max_age
+
+    @contextmanager
+    def lock(self, key: str):
+        """Lock `key` against other threads and processes"""
+        with self.locks(key):
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.directory / f".{key}.lock", "w") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, key: str, fetch: Callable[[Path], None]) -> Path:
+        """
+        Get the path of the cached file of `key`, calling `fetch(tmp_path)` to
+        write it if it is missing or stale. If fetching a stale file fails, the
+        stale copy is used.
+        """
+        path = self.path(key)
+        with self.lock(key):
+            if path.is_file() and not self.is_stale(path):
+                # access time orders eviction, modification time is the download time
+                os.utime(path, (time.time(), path.stat().st_mtime))
+                return path
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{key}.", suffix=".tmp")
+            os.close(fd)
+            try:
+                fetch(Path(tmp_path))
+                os.replace(tmp_path, path)
+            except Exception as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                if not path.is_file():
+                    raise
+                logging.warn(f"Failed to refresh {key}, use the stale cache: {e}")
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Optional[Path] = None):
+        """Remove the least recently used files except `keep` until the total size fits `max_size`"""
+        files = []
+        for path in self.directory.iterdir():
+            if path.name.startswith(".") or path == keep:
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_atime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        if keep is not None and keep.is_file():
+            total += keep.stat().st_size
+        for _, size, path in sorted(files, key=lambda x: x[0]):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
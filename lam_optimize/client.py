@@ -0,0 +1,70 @@
+"""Shared HTTP client for the OpenLAM open APIs.
+
+All requests go through one pooled `requests.Session` per process, with a
+timeout and retries with exponential backoff on connection errors and
+transient server responses.
+"""
+import json
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeout in seconds
+DEFAULT_TIMEOUT = (
+    float(os.environ.get("OPENLAM_CONNECT_TIMEOUT", 10)),
+    float(os.environ.get("OPENLAM_READ_TIMEOUT", 60)),
+)
+DEFAULT_RETRIES = int(os.environ.get("OPENLAM_MAX_RETRIES", 5))
+DEFAULT_POOL_SIZE = 16
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Get the pooled session of the current process"""
+    global _session, _session_pid
+    with _session_lock:
+        # connections must not be shared with a forked parent
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(
+                total=DEFAULT_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"],
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=DEFAULT_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"Content-type": "application/json"})
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def request_json(url: str, params: Optional[dict] = None, timeout=DEFAULT_TIMEOUT) -> dict:
+    """
+    Send a GET request and decode the JSON response
+
+    Parameters:
+    ----------
+    url: str
+        Request URL.
+    params: dict
+        Query parameters, the access key from `BOHRIUM_ACCESS_KEY` is added.
+    timeout: Union[float, Tuple[float, float]]
+        Timeout in seconds, or a (connect, read) tuple.
+    """
+    params = dict(params) if params is not None else {}
+    params["accessKey"] = os.environ.get("BOHRIUM_ACCESS_KEY")
+    rsp = get_session().get(url, params=params, timeout=timeout)
+    if rsp.status_code != 200:
+        raise RuntimeError("Response code %s: %s" % (rsp.status_code, rsp.text))
+    return json.loads(rsp.text)
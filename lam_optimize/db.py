@@ -1,10 +1,13 @@
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional
 
-import requests
+from lam_optimize.client import request_json
+from lam_optimize.local_db import get_local_store
+from lam_optimize.metrics import METRICS
 from pymatgen.core import Structure
 
 
@@ -13,24 +16,39 @@ class CrystalStructure:
     structure: Structure
     energy: float
     submission_time: datetime
-    def __init__(self, formula: str, structure: Structure, energy: float, submission_time: datetime):
+    def __init__(self, formula: str, structure: Optional[Structure], energy: float, submission_time: datetime,
+                 raw_structure: Optional[str] = None):
         self.formula = formula
-        self.structure = structure
+        self._structure = structure
+        self.raw_structure = raw_structure
         self.energy = energy
         self.submission_time = submission_time
 
+    @property
+    def structure(self) -> Structure:
+        # structures from queries keep their raw JSON and are parsed on first access
+        if self._structure is None and self.raw_structure is not None:
+            with METRICS.timer("db_parse"):
+                self._structure = Structure.from_dict(json.loads(self.raw_structure))
+        return self._structure
+
+    @property
+    def natoms(self) -> int:
+        # counted from the raw JSON, so that the structure is not parsed
+        if self._structure is None and self.raw_structure is not None:
+            return len(json.loads(self.raw_structure)["sites"])
+        return len(self.structure)
+
+    @structure.setter
+    def structure(self, structure: Structure):
+        self._structure = structure
+
     @staticmethod
     def request(params: dict) -> dict:
-        access_key = os.environ.get("BOHRIUM_ACCESS_KEY")
         query_url = os.environ.get("OPENLAM_STRUCTURE_QUERY_URL", "http://openapi.dp.tech/openapi/v1/structures/query")
-        headers = {
-            "Content-type": "application/json",
-        }
-        params["accessKey"] = access_key
-        rsp = requests.get(query_url, headers=headers, params=params)
-        if rsp.status_code != 200:
-            raise RuntimeError("Response code %s: %s" % (rsp.status_code, rsp.text))
-        res = json.loads(rsp.text)
+        METRICS.count("db_requests")
+        with METRICS.timer("db_query"):
+            res = request_json(query_url, params)
         if res["code"] != 0:
             raise RuntimeError("Query error code %s: %s" % (res["code"], res["error"]["msg"]))
         data = res["data"]
@@ -38,34 +56,40 @@ class CrystalStructure:
 
     @staticmethod
     def request_iterate(params: dict) -> dict:
-        access_key = os.environ.get("BOHRIUM_ACCESS_KEY")
         query_url = os.environ.get("OPENLAM_STRUCTURE_QUERY_URL", "http://openapi.dp.tech/openapi/v1/structures/iterate")
-        headers = {
-            "Content-type": "application/json",
-        }
-        params["accessKey"] = access_key
-        rsp = requests.get(query_url, headers=headers, params=params)
-        if rsp.status_code != 200:
-            raise RuntimeError("Response code %s: %s" % (rsp.status_code, rsp.text))
-        res = json.loads(rsp.text)
+        METRICS.count("db_requests")
+        with METRICS.timer("db_query"):
+            res = request_json(query_url, params)
         if res["code"] != 0:
             raise RuntimeError("Query error code %s: %s" % (res["code"], res["error"]["msg"]))
         data = res["data"]
         return data
 
     @classmethod
-    def query_by_page(
-        cls,
+    def _parse_items(cls, items: List[dict]) -> List["CrystalStructure"]:
+        structures = []
+        for item in items:
+            structure = cls(formula=item["formula"],
+                            structure=None,
+                            energy=item["energy"],
+                            submission_time=datetime.fromisoformat(item["submissionTime"]),
+                            raw_structure=item["structure"])
+            structures.append(structure)
+        return structures
+
+    @staticmethod
+    def _offset_params(
         formula: Optional[str] = None,
         min_energy: Optional[float] = None,
         max_energy: Optional[float] = None,
         min_submission_time: Optional[datetime] = None,
         max_submission_time: Optional[datetime] = None,
-        page: int = 1,
+        offset: int = 0,
+        limit: int = 10,
     ) -> dict:
-        logging.warn("The method `query_by_page` is deprecated! Please use `query_by_offset` instead.")
         params = {
-            "page": page,
+            "startId": offset,
+            "limit": limit,
         }
         if formula is not None:
             params["formula"] = formula
@@ -77,32 +101,21 @@ class CrystalStructure:
             params["minSubmissionTime"] = min_submission_time.isoformat()
         if max_submission_time is not None:
             params["maxSubmissionTime"] = max_submission_time.isoformat()
-
-        data = cls.request(params)
-        structures = []
-        for item in data["items"]:
-            structure = cls(formula=item["formula"],
-                            structure=Structure.from_dict(json.loads(item["structure"])),
-                            energy=item["energy"],
-                            submission_time=datetime.fromisoformat(item["submissionTime"]))
-            structures.append(structure)
-        data["items"] = structures
-        return data
+        return params
 
     @classmethod
-    def query_by_offset(
+    def query_by_page(
         cls,
         formula: Optional[str] = None,
         min_energy: Optional[float] = None,
         max_energy: Optional[float] = None,
         min_submission_time: Optional[datetime] = None,
         max_submission_time: Optional[datetime] = None,
-        offset: int = 0,
-        limit: int = 10,
+        page: int = 1,
     ) -> dict:
+        logging.warn("The method `query_by_page` is deprecated! Please use `query_by_offset` instead.")
         params = {
-            "startId": offset,
-            "limit": limit,
+            "page": page,
         }
         if formula is not None:
             params["formula"] = formula
@@ -115,18 +128,68 @@ class CrystalStructure:
         if max_submission_time is not None:
             params["maxSubmissionTime"] = max_submission_time.isoformat()
 
+        data = cls.request(params)
+        data["items"] = cls._parse_items(data["items"])
+        return data
+
+    @classmethod
+    def query_by_offset(
+        cls,
+        formula: Optional[str] = None,
+        min_energy: Optional[float] = None,
+        max_energy: Optional[float] = None,
+        min_submission_time: Optional[datetime] = None,
+        max_submission_time: Optional[datetime] = None,
+        offset: int = 0,
+        limit: int = 10,
+    ) -> dict:
+        params = cls._offset_params(formula=formula, min_energy=min_energy, max_energy=max_energy,
+                                    min_submission_time=min_submission_time, max_submission_time=max_submission_time,
+                                    offset=offset, limit=limit)
         data = cls.request_iterate(params)
         if data["items"] is not None:
-            structures = []
-            for item in data["items"]:
-                structure = cls(formula=item["formula"],
-                                structure=Structure.from_dict(json.loads(item["structure"])),
-                                energy=item["energy"],
-                                submission_time=datetime.fromisoformat(item["submissionTime"]))
-                structures.append(structure)
-            data["items"] = structures
+            data["items"] = cls._parse_items(data["items"])
         return data
 
+    @classmethod
+    def iter_query(
+        cls,
+        formula: Optional[str] = None,
+        min_energy: Optional[float] = None,
+        max_energy: Optional[float] = None,
+        min_submission_time: Optional[datetime] = None,
+        max_submission_time: Optional[datetime] = None,
+        limit: int = 100,
+    ) -> Iterator["CrystalStructure"]:
+        """
+        Iterate over the matched structures page by page. The structure of each
+        item is only parsed when its `structure` attribute is first accessed.
+        """
+        store = get_local_store()
+        if store is not None:
+            yield from store.iter_query(formula=formula, min_energy=min_energy, max_energy=max_energy,
+                                        min_submission_time=min_submission_time, max_submission_time=max_submission_time)
+            return
+
+        # the next page is requested in the background while the current one is consumed
+        def fetch(offset):
+            return cls.request_iterate(cls._offset_params(
+                formula=formula, min_energy=min_energy, max_energy=max_energy,
+                min_submission_time=min_submission_time, max_submission_time=max_submission_time,
+                offset=offset, limit=limit))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch, 0)
+            while True:
+                data = future.result()
+                if data["items"] is None:
+                    break
+                if data["nextStartId"] != 0:
+                    future = executor.submit(fetch, data["nextStartId"])
+                yield from cls._parse_items(data["items"])
+                if data["nextStartId"] == 0:
+                    break
+
     @classmethod
     def query(
         cls,
@@ -135,16 +198,36 @@ class CrystalStructure:
         max_energy: Optional[float] = None,
         min_submission_time: Optional[datetime] = None,
         max_submission_time: Optional[datetime] = None,
+        limit: int = 100,
     ) -> List["CrystalStructure"]:
-        offset = 0
-        structures = []
-        while True:
-            data = cls.query_by_offset(formula=formula, min_energy=min_energy, max_energy=max_energy,
-                                       min_submission_time=min_submission_time, max_submission_time=max_submission_time, offset=offset)
-            if data["items"] is None:
-                break
-            structures += data["items"]
-            if data["nextStartId"] == 0:
-                break
-            offset = data["nextStartId"]
-        return structures
+        return list(cls.iter_query(formula=formula, min_energy=min_energy, max_energy=max_energy,
+                                   min_submission_time=min_submission_time, max_submission_time=max_submission_time,
+                                   limit=limit))
+
+    @classmethod
+    def query_many(
+        cls,
+        formulas: List[str],
+        max_workers: int = 8,
+        **kwargs,
+    ) -> Dict[str, List["CrystalStructure"]]:
+        """
+        Query several formulas concurrently
+
+        Parameters:
+        ----------
+        formulas: List[str]
+            Formulas to query.
+        max_workers: int
+            Max number of concurrent queries.
+        kwargs:
+            Other query conditions passed to `query`.
+
+        Returns:
+        ----------
+        A dict mapping each formula to its list of `CrystalStructure` objects.
+        """
+        formulas = list(dict.fromkeys(formulas))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda formula: cls.query(formula=formula, **kwargs), formulas)
+            return dict(zip(formulas, results))
@@ -0,0 +1,260 @@
+"""Duplicate detection with a fingerprint index in front of `StructureMatcher.fit`.
+
+Each structure is reduced (Niggli and primitive cell) once, and candidates
+are pruned by cheap invariants before the expensive `fit`:
+
+- the reduced formula,
+- the ratio of energies per atom,
+- the number of sites in the primitive cell, which must be equal for `fit`
+  to succeed without supercells,
+- the lengths of the reduced lattice vectors divided by the cube root of
+  the volume, which are invariant under the volume scaling of `fit` and
+  compared with a tolerance of a few times the `ltol` of the matcher.
+"""
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from pymatgen.analysis.structure_matcher import StructureMatcher
+from pymatgen.core import Structure
+
+from lam_optimize.db import CrystalStructure
+from lam_optimize.metrics import METRICS
+from lam_optimize.utils import MATCHER
+
+# the prefilter tolerance of the normalized reduced lattice lengths, relative
+# to `ltol`, as lattices matched by `fit` are compared before reduction
+LENGTH_TOL_FACTOR = 4
+
+
+class _Entry:
+    """A structure in the index, reduced and fingerprinted on first use"""
+    def __init__(self, structure, energy: float, label: Optional[str]):
+        # `structure` is a Structure or a lazily parsed CrystalStructure
+        self._structure = structure
+        self.energy = energy
+        self.label = label
+        self._reduced = None
+        self._fingerprint = None
+
+    @property
+    def structure(self) -> Structure:
+        if not isinstance(self._structure, Structure):
+            self._structure = self._structure.structure
+        return self._structure
+
+    def reduced(self, primitive_cell: bool) -> Structure:
+        # the Niggli reduction, of the primitive cell if the matcher uses it,
+        # done by `StructureMatcher.fit` unless skipped
+        if self._reduced is None:
+            structure = self.structure
+            with METRICS.timer("structure_reduction"):
+                reduced = structure.get_reduced_structure()
+                if primitive_cell:
+                    reduced = reduced.get_primitive_structure().get_reduced_structure()
+                self._reduced = reduced
+        return self._reduced
+
+    def fingerprint(self, primitive_cell: bool) -> np.ndarray:
+        if self._fingerprint is None:
+            reduced = self.reduced(primitive_cell)
+            lengths = np.sort(reduced.lattice.abc) / reduced.volume ** (1 / 3)
+            self._fingerprint = np.concatenate([[len(reduced)], lengths])
+        return self._fingerprint
+
+
+class StructureIndex:
+    """Index of structures grouped by reduced formula
+
+    Parameters:
+    ----------
+    matcher: StructureMatcher
+        Matcher deciding whether two structures are duplicates.
+    energy_tol: float
+        Max relative difference of energies per atom for two structures to be compared.
+    length_tol: float
+        Max relative difference of the normalized reduced lattice lengths for
+        two structures to be compared, `LENGTH_TOL_FACTOR` times the `ltol` of
+        `matcher` if not given.
+    """
+    def __init__(self, matcher: StructureMatcher = MATCHER, energy_tol: float = 0.05, length_tol: Optional[float] = None):
+        settings = matcher.as_dict()
+        self.matcher = matcher
+        self.primitive_cell = settings["primitive_cell"]
+        self.energy_tol = energy_tol
+        self.length_tol = length_tol if length_tol is not None else LENGTH_TOL_FACTOR * settings["ltol"]
+        self.entries: Dict[str, List[_Entry]] = defaultdict(list)
+        self.nfits = 0
+        self.npruned = 0
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.entries.values())
+
+    def has_formula(self, formula: str) -> bool:
+        return formula in self.entries
+
+    def add(self, formula: str, structure, energy: float, label: Optional[str] = None):
+        """
+        Add a structure with its energy per atom, either a `Structure` or a
+        `CrystalStructure` whose structure is only parsed if it survives the
+        energy filter
+        """
+        self.entries[formula].append(_Entry(structure, energy, label))
+
+    def add_formula(self, formula: str, items: Iterable, label: Optional[str] = None):
+        """Add all `CrystalStructure` items of a formula, e.g. from `CrystalStructure.iter_query`"""
+        entries = self.entries[formula]
+        for item in items:
+            entries.append(_Entry(item, item.energy / item.natoms, label))
+
+    def _energy_close(self, e1: float, e2: float) -> bool:
+        return abs(e1 - e2) / max(abs(e1), abs(e2)) <= self.energy_tol
+
+    def _fingerprint_close(self, fp1: np.ndarray, fp2: np.ndarray) -> bool:
+        return fp1[0] == fp2[0] and np.all(np.abs(fp1[1:] - fp2[1:]) <= self.length_tol * fp2[1:])
+
+    def find(self, structure: Structure, energy: float, formula: Optional[str] = None) -> Optional[_Entry]:
+        """
+        Find an indexed structure matching `structure`
+
+        Parameters:
+        ----------
+        structure: Structure
+            The structure to look up.
+        energy: float
+            Its energy per atom.
+        formula: str
+            Its reduced formula, computed if not given.
+
+        Returns:
+        ----------
+        The matching entry with `label`, `energy` and `structure`, or `None`.
+        """
+        if formula is None:
+            formula = structure.composition.reduced_formula
+        query = _Entry(structure, energy, None)
+        for entry in self.entries.get(formula, []):
+            if not self._energy_close(entry.energy, energy):
+                continue
+            if not self._fingerprint_close(entry.fingerprint(self.primitive_cell), query.fingerprint(self.primitive_cell)):
+                self.npruned += 1
+                continue
+            self.nfits += 1
+            reduced, query_reduced = entry.reduced(self.primitive_cell), query.reduced(self.primitive_cell)
+            with METRICS.timer("matcher_fit"):
+                matched = self.matcher.fit(reduced, query_reduced, skip_structure_reduction=True)
+            if matched:
+                return entry
+        return None
+
+
+class DuplicateFinder:
+    """Find duplicates of structures against the database and earlier structures of a run
+
+    Known structures of a formula are queried once, the first time the
+    formula is seen, and each unique structure is indexed so that later
+    structures of the run are compared against it.
+
+    Parameters:
+    ----------
+    query_known: Callable
+        Called as `query_known(formula=...)` to get the known structures of a
+        formula, `None` to only find duplicates within the run.
+    matcher: StructureMatcher
+        Matcher deciding whether two structures are duplicates.
+    """
+    def __init__(self, query_known: Optional[Callable] = CrystalStructure.iter_query, matcher: StructureMatcher = MATCHER):
+        self.query_known = query_known
+        # both indexes compare energies per atom, as cells of the same formula
+        # may differ in size
+        self.known = StructureIndex(matcher)
+        self.seen = StructureIndex(matcher)
+
+    def check(self, structure: Structure, energy: float, label: Optional[str] = None) -> Optional[str]:
+        """
+        Check a structure and index it if it is unique
+
+        Returns:
+        ----------
+        `None` if the structure is unique, `"database"` if it duplicates a known
+        structure, or the label of the earlier structure it duplicates.
+        """
+        formula = structure.composition.reduced_formula
+        energy_per_atom = energy / len(structure)
+        if self.query_known is not None:
+            if not self.known.has_formula(formula):
+                self.known.add_formula(formula, self.query_known(formula=formula), label="database")
+            entry = self.known.find(structure, energy_per_atom, formula)
+            if entry is not None:
+                return entry.label
+        entry = self.seen.find(structure, energy_per_atom, formula)
+        if entry is not None:
+            return entry.label
+        self.seen.add(formula, structure, energy_per_atom, label)
+        return None
+
+
+def _deduplicate_group(items: List[tuple], query_known: Optional[Callable], matcher: StructureMatcher) -> Dict[int, str]:
+    finder = DuplicateFinder(query_known, matcher)
+    duplicates = {}
+    for i, label, structure, energy in items:
+        duplicate_of = finder.check(structure, energy, label)
+        if duplicate_of is not None:
+            duplicates[i] = duplicate_of
+    return duplicates
+
+
+def deduplicate(
+    structures: List[Structure],
+    energies: List[float],
+    labels: Optional[List[str]] = None,
+    query_known: Optional[Callable] = CrystalStructure.iter_query,
+    workers: Optional[int] = None,
+    matcher: StructureMatcher = MATCHER,
+) -> List[Optional[str]]:
+    """
+    Find duplicates within a batch of structures and, optionally, against the
+    known structures of the database. Formulas are processed in parallel.
+
+    Parameters:
+    ----------
+    structures: List[Structure]
+        Structures to check.
+    energies: List[float]
+        Their total energies.
+    labels: List[str]
+        Their names, defaulting to their indices.
+    query_known: Callable
+        Called as `query_known(formula=...)` to get the known structures of a
+        formula, `None` to only find duplicates within the batch. Must be
+        picklable when `workers` is set.
+    workers: int
+        Number of worker processes, `None` to run in this process.
+    matcher: StructureMatcher
+        Matcher deciding whether two structures are duplicates.
+
+    Returns:
+    ----------
+    For each structure, `None` if it is unique, `"database"` if it duplicates a
+    known structure, or the label of the earlier structure it duplicates.
+    """
+    if labels is None:
+        labels = [str(i) for i in range(len(structures))]
+    groups = defaultdict(list)
+    for i, (label, structure, energy) in enumerate(zip(labels, structures, energies)):
+        groups[structure.composition.reduced_formula].append((i, label, structure, energy))
+
+    duplicates = {}
+    if workers is None:
+        for items in groups.values():
+            duplicates.update(_deduplicate_group(items, query_known, matcher))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_deduplicate_group, items, query_known, matcher)
+                       for items in groups.values()]
+            for future in futures:
+                duplicates.update(future.result())
+    logging.info(f"{len(duplicates)} duplicates in {len(structures)} structures")
+    return [duplicates.get(i) for i in range(len(structures))]
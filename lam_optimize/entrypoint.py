@@ -1,12 +1,13 @@
 import argparse
 import json
+import logging
+import os
 from pathlib import Path
 from typing import List, Optional
 
-from dflow import Workflow, download_artifact
-from lam_optimize.main import relax_run
-from lam_optimize.relaxer import Relaxer
-from lam_optimize.workflow import get_relax_workflow
+# subcommands import the modules they need when they run, so that parsing
+# the arguments does not import dflow, pandas, pymatgen, ASE or the models
+from lam_optimize.options import BENCH_CASES, CELL_FILTER_NAMES, OPTIMIZER_NAMES, PRECISIONS
 
 
 def main_parser():
@@ -44,6 +45,54 @@ def main_parser():
         default=None,
         help="model path",
     )
+    parser_relax.add_argument(
+        "--optimizer",
+        type=str,
+        choices=OPTIMIZER_NAMES + ["adaptive"],
+        default="BFGS",
+        help="optimizer, `adaptive` starts with FIRE, switches to BFGS (LBFGS for large cells) near convergence and stops stagnating relaxations",
+    )
+    parser_relax.add_argument(
+        "--precision",
+        type=str,
+        choices=PRECISIONS,
+        default="float64",
+        help="`mixed` relaxes with a float32 model down to `--coarse-fmax` and converges with the float64 model",
+    )
+    parser_relax.add_argument(
+        "--coarse-fmax",
+        type=float,
+        default=0.1,
+        help="force criteria in eV/A of the float32 stage of the mixed precision",
+    )
+    parser_relax.add_argument(
+        "--coarse-model",
+        type=str,
+        default=None,
+        help="float32 DP model path of the mixed precision",
+    )
+    parser_relax.add_argument(
+        "--cell-filter",
+        type=str,
+        choices=CELL_FILTER_NAMES,
+        default="ExpCellFilter",
+        help="cell filter of the cell relaxation",
+    )
+    parser_relax.add_argument(
+        "--symmetry",
+        action="store_true",
+        help="keep the space group of the input structures during relaxation",
+    )
+    parser_relax.add_argument(
+        "--primitive",
+        action="store_true",
+        help="reduce the input structures to their primitive cell before relaxation",
+    )
+    parser_relax.add_argument(
+        "--warmup",
+        action="store_true",
+        help="evaluate a small structure right after loading the model",
+    )
     parser_relax.add_argument(
         "--skip-check-convergence",
         action="store_true",
@@ -54,12 +103,140 @@ def main_parser():
         action="store_true",
         help="skip checking duplicate",
     )
+    parser_relax.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="relax this many structures together in one batched model call per step",
+    )
+    parser_relax.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="relax structures in this many worker processes",
+    )
+    parser_relax.add_argument(
+        "--pipeline",
+        type=int,
+        default=None,
+        help="parse inputs and check and write outputs in background threads, with at most this many structures waiting between the stages",
+    )
+    parser_relax.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="path of the run journal recording every finished structure",
+    )
+    parser_relax.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip structures already finished in the run journal `--journal` of a previous run",
+    )
+    parser_relax.add_argument(
+        "--e-above-hull",
+        action="store_true",
+        help="add the energy above hull of relaxed structures from the OpenLAM hulls",
+    )
+    parser_relax.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        help="collect per-stage and per-structure timings and save them to this JSON file, or a `.prom` file in the Prometheus text format",
+    )
+    parser_relax.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="sample the stack during the run and save the collapsed stacks to this file",
+    )
+    parser_relax.add_argument(
+        "--cost-model",
+        type=str,
+        default=None,
+        help="JSON cost model ordering the structures longest first with `--batch-size` or `-w`, see `lam_optimize.schedule.CostModel`",
+    )
+    parser_relax.add_argument(
+        "--result-cache",
+        type=str,
+        default=None,
+        help="reuse results of earlier runs of the same structures, model and settings from this SQLite file",
+    )
     parser_relax.add_argument(
         "-o",
         "--output",
         type=str,
         default="results.json",
-        help="output path",
+        help="output path, `.jsonl` or `.parquet` outputs are written while the run progresses",
+    )
+
+    parser_evaluate = subparsers.add_parser(
+        "evaluate",
+        help="Evaluate energies and forces of structures",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser_evaluate.add_argument(
+        "-i",
+        "--input",
+        type=str,
+        required=True,
+        help="input cif folder",
+    )
+    parser_evaluate.add_argument(
+        "-t",
+        "--type",
+        type=str,
+        choices=["DP", "mace"],
+        default="DP",
+        help="task type",
+    )
+    parser_evaluate.add_argument(
+        "-m",
+        "--model",
+        type=str,
+        default=None,
+        help="model path",
+    )
+    parser_evaluate.add_argument(
+        "--batch-size",
+        type=int,
+        default=64,
+        help="number of structures evaluated in one model call",
+    )
+    parser_evaluate.add_argument(
+        "--stress",
+        action="store_true",
+        help="also compute stresses and virials",
+    )
+    parser_evaluate.add_argument(
+        "--warmup",
+        action="store_true",
+        help="evaluate a small structure right after loading the model",
+    )
+    parser_evaluate.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        help="collect per-stage and per-structure timings and save them to this JSON file, or a `.prom` file in the Prometheus text format",
+    )
+    parser_evaluate.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="sample the stack during the run and save the collapsed stacks to this file",
+    )
+    parser_evaluate.add_argument(
+        "--result-cache",
+        type=str,
+        default=None,
+        help="reuse results of earlier runs of the same structures, model and settings from this SQLite file",
+    )
+    parser_evaluate.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="single_point.npz",
+        help="output path, `.npz` or `.parquet`",
     )
 
     parser_submit = subparsers.add_parser(
@@ -94,6 +271,24 @@ def main_parser():
         default=None,
         help="model path",
     )
+    parser_submit.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help="split the CIF files of all input folders into this many slices of balanced cost",
+    )
+    parser_submit.add_argument(
+        "--cost-model",
+        type=str,
+        default=None,
+        help="JSON cost model of the relaxation time, see `lam_optimize.schedule.CostModel`",
+    )
+    parser_submit.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="resume from a run journal, or a directory of the journals downloaded from an earlier workflow",
+    )
     parser_submit.add_argument(
         "--skip-check-convergence",
         action="store_true",
@@ -121,6 +316,119 @@ def main_parser():
         default=".",
         help="output path",
     )
+
+    parser_sync = subparsers.add_parser(
+        "sync",
+        help="Download the OpenLAM structure database into a local mirror",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser_sync.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=os.environ.get("OPENLAM_STRUCTURE_DB") or "openlam_structures.db",
+        help="path to the local SQLite mirror",
+    )
+    parser_sync.add_argument(
+        "--full",
+        action="store_true",
+        help="download the whole database instead of structures submitted since the last sync",
+    )
+    parser_sync.add_argument(
+        "--limit",
+        type=int,
+        default=1000,
+        help="page size of the requests",
+    )
+
+    parser_ingest = subparsers.add_parser(
+        "ingest",
+        help="Parse CIF files into a structure cache",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser_ingest.add_argument(
+        "-i",
+        "--input",
+        type=str,
+        required=True,
+        help="input cif folder",
+    )
+    parser_ingest.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=os.environ.get("OPENLAM_STRUCTURE_CACHE") or "openlam_cifs.db",
+        help="path to the structure cache",
+    )
+    parser_ingest.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="parse in this many worker processes",
+    )
+
+    parser_bench = subparsers.add_parser(
+        "bench",
+        help="Benchmark the throughput on synthetic structures",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser_bench.add_argument(
+        "-t",
+        "--type",
+        type=str,
+        nargs="+",
+        choices=["emt", "DP", "mace"],
+        default=["emt"],
+        help="models to benchmark, `emt` is a cheap built-in stand-in, unavailable models are skipped",
+    )
+    parser_bench.add_argument(
+        "-m",
+        "--model",
+        type=str,
+        default=None,
+        help="DP model path",
+    )
+    parser_bench.add_argument(
+        "--cases",
+        type=str,
+        nargs="+",
+        choices=BENCH_CASES,
+        default=None,
+        help="benchmark cases, all by default",
+    )
+    parser_bench.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[8, 32, 108],
+        help="approximate numbers of atoms per structure",
+    )
+    parser_bench.add_argument(
+        "-n",
+        "--structures",
+        type=int,
+        default=16,
+        help="number of structures per case and size",
+    )
+    parser_bench.add_argument(
+        "--steps",
+        type=int,
+        default=100,
+        help="max steps of the relaxations",
+    )
+    parser_bench.add_argument(
+        "--startup",
+        action="store_true",
+        help="also check that the startup of `lam-opt` imports no heavy module and time it",
+    )
+    parser_bench.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="bench.json",
+        help="output JSON path",
+    )
     return parser
 
 
@@ -137,31 +445,104 @@ def parse_args(args: Optional[List[str]] = None):
     parsed_args = parser.parse_args(args=args)
     if parsed_args.command is None:
         parser.print_help()
+    elif parsed_args.command == "relax" and parsed_args.resume and parsed_args.journal is None:
+        parser.error("--resume needs the run journal given by --journal")
     return parsed_args
 
 
 def main():
     args = parse_args()
 
+    if args.command in ["relax", "evaluate"] and args.metrics is not None:
+        from lam_optimize.metrics import METRICS
+        METRICS.enable()
+    if args.command in ["relax", "evaluate"] and args.profile is not None:
+        from lam_optimize.metrics import SamplingProfiler
+        profiler = SamplingProfiler(args.profile)
+        profiler.start()
+    else:
+        profiler = None
+
     if args.command == "relax":
+        from lam_optimize.main import relax_run
+        from lam_optimize.relaxer import Relaxer
+        from lam_optimize.schedule import CostModel
+        cost_model = CostModel.load(args.cost_model) if args.cost_model is not None else None
+        coarse_model = Path(args.coarse_model) if args.coarse_model is not None else None
+        options = dict(optimizer=args.optimizer, result_cache=args.result_cache, precision=args.precision,
+                       coarse_fmax=args.coarse_fmax, cell_filter=args.cell_filter, symmetry=args.symmetry,
+                       primitive=args.primitive, warmup=args.warmup, lazy=(args.workers is not None))
         if args.type == "DP":
-            relaxer = Relaxer(Path(args.model))
+            relaxer = Relaxer(Path(args.model), coarse_model=coarse_model, **options)
         elif args.type == "mace":
-            relaxer = Relaxer("mace")
+            relaxer = Relaxer("mace", **options)
+        stream = Path(args.output).suffix in [".jsonl", ".parquet"]
         res_df = relax_run(Path(args.input), relaxer, check_convergence=(not args.skip_check_convergence),
-                           check_duplicate=(not args.skip_check_duplicate))
-        res_df.to_json(args.output)
+                           check_duplicate=(not args.skip_check_duplicate), batch_size=args.batch_size,
+                           workers=args.workers, journal=(Path(args.journal) if args.journal is not None else None),
+                           resume=args.resume, cost_model=cost_model, compute_e_above_hull=args.e_above_hull,
+                           output=(Path(args.output) if stream else None), pipeline=args.pipeline)
+        if not stream:
+            res_df.to_json(args.output)
+    elif args.command == "evaluate":
+        from lam_optimize.main import single_point_batch
+        from lam_optimize.relaxer import Relaxer
+        if args.type == "DP":
+            relaxer = Relaxer(Path(args.model), result_cache=args.result_cache, warmup=args.warmup)
+        elif args.type == "mace":
+            relaxer = Relaxer("mace", result_cache=args.result_cache, warmup=args.warmup)
+        single_point_batch(Path(args.input), relaxer, batch_size=args.batch_size, compute_stress=args.stress,
+                           output=Path(args.output))
     elif args.command == "submit":
+        from lam_optimize.schedule import CostModel
+        from lam_optimize.workflow import get_relax_workflow
         with open(args.CONFIG, "r") as f:
             config = json.load(f)
-        wf = get_relax_workflow(config["relax"], args.input, args.type, args.model)
+        cost_model = CostModel.load(args.cost_model) if args.cost_model is not None else None
+        wf = get_relax_workflow(config["relax"], args.input, args.type, args.model,
+                                shards=args.shards, cost_model=cost_model,
+                                journal=Path(args.journal) if args.journal is not None else None)
         wf.submit()
     elif args.command == "download":
+        from dflow import Workflow, download_artifact
         wf = Workflow(id=args.ID)
         step = wf.query_step(name="relax", phase="Succeeded")[0]
         download_artifact(step.outputs.artifacts["res"], path=args.output)
         download_artifact(step.outputs.artifacts["relaxed_cifs"], path=args.output)
         download_artifact(step.outputs.artifacts["unconverged_cifs"], path=args.output)
+        download_artifact(step.outputs.artifacts["journal"], path=args.output)
+    elif args.command == "sync":
+        from lam_optimize.local_db import sync
+        sync(args.output, full=args.full, limit=args.limit)
+    elif args.command == "ingest":
+        from lam_optimize.ingest import ingest
+        ingest(Path(args.input), args.output, workers=args.workers)
+    elif args.command == "bench":
+        from lam_optimize.bench import check_startup, run_benchmarks, save_results
+        from lam_optimize.relaxer import Relaxer
+        results = []
+        if args.startup:
+            results += [{"case": "startup", **record} for record in check_startup()]
+        for model_type in args.type:
+            try:
+                if model_type == "DP":
+                    if args.model is None:
+                        raise ValueError("no DP model given by `-m`")
+                    relaxer = Relaxer(Path(args.model))
+                else:
+                    relaxer = Relaxer(model_type)
+            except Exception as e:
+                logging.warn(f"Skip benchmarking {model_type}: {e!r}")
+                continue
+            results += run_benchmarks(relaxer, cases=args.cases, sizes=args.sizes, n=args.structures, steps=args.steps)
+        save_results(results, args.output)
+        print(f"Saved to {args.output}.")
+
+    if profiler is not None:
+        profiler.stop()
+    if args.command in ["relax", "evaluate"] and args.metrics is not None:
+        from lam_optimize.metrics import METRICS
+        METRICS.save(args.metrics)
 
 
 if __name__ == "__main__":
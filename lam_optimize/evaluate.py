@@ -0,0 +1,198 @@
+"""Columnar results of single point evaluations.
+
+Energies are stored in a flat array and the forces of all structures in one
+concatenated array, with the forces of structure `i` in
+`forces[offsets[i]:offsets[i + 1]]`. Stresses (Voigt order, eV/A^3) and
+virials (3x3, eV) have one row per structure.
+"""
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Union
+
+import ase
+import numpy as np
+from ase.stress import voigt_6_to_full_3x3_stress
+
+from lam_optimize.batch import calculate_batch
+
+
+class SinglePointResults:
+    """Energies, forces and optionally stresses of many structures
+
+    Parameters:
+    ----------
+    names: List[str]
+        Names of the structures.
+    energies: np.ndarray
+        Energies in eV, of shape (n,).
+    forces: np.ndarray
+        Concatenated forces in eV/A, of shape (sum of natoms, 3).
+    offsets: np.ndarray
+        Start of the forces of each structure in `forces`, of shape (n + 1,).
+    stresses: np.ndarray
+        Stresses in Voigt order in eV/A^3, of shape (n, 6), or `None`.
+    volumes: np.ndarray
+        Cell volumes in A^3, of shape (n,), used for the virials.
+    """
+    def __init__(
+        self,
+        names: List[str],
+        energies: np.ndarray,
+        forces: np.ndarray,
+        offsets: np.ndarray,
+        stresses: Optional[np.ndarray] = None,
+        volumes: Optional[np.ndarray] = None,
+    ):
+        self.names = list(names)
+        self.energies = np.asarray(energies, dtype=float)
+        self.forces = np.asarray(forces, dtype=float).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.stresses = None if stresses is None else np.asarray(stresses, dtype=float).reshape(-1, 6)
+        self.volumes = None if volumes is None else np.asarray(volumes, dtype=float)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def natoms(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def virials(self) -> Optional[np.ndarray]:
+        """Virials of shape (n, 3, 3), `-stress * volume`"""
+        if self.stresses is None or self.volumes is None:
+            return None
+        return -voigt_6_to_full_3x3_stress(self.stresses) * self.volumes[:, None, None]
+
+    def get_forces(self, i: int) -> np.ndarray:
+        return self.forces[self.offsets[i]:self.offsets[i + 1]]
+
+    @classmethod
+    def concatenate(cls, results: List["SinglePointResults"]) -> "SinglePointResults":
+        results = [res for res in results if len(res) > 0]
+        if not results:
+            return cls([], np.zeros(0), np.zeros((0, 3)), np.zeros(1, dtype=np.int64))
+        offsets = [results[0].offsets]
+        for res in results[1:]:
+            offsets.append(res.offsets[1:] + offsets[-1][-1])
+        with_stress = all(res.stresses is not None for res in results)
+        return cls(
+            names=[name for res in results for name in res.names],
+            energies=np.concatenate([res.energies for res in results]),
+            forces=np.concatenate([res.forces for res in results]),
+            offsets=np.concatenate(offsets),
+            stresses=np.concatenate([res.stresses for res in results]) if with_stress else None,
+            volumes=np.concatenate([res.volumes for res in results]) if with_stress else None,
+        )
+
+    def save(self, path: Union[str, Path]):
+        """Save to a `.npz` or `.parquet` file according to the suffix of `path`"""
+        path = Path(path)
+        if path.parent != Path("."):
+            os.makedirs(path.parent, exist_ok=True)
+        if path.suffix == ".npz":
+            self.save_npz(path)
+        elif path.suffix == ".parquet":
+            self.save_parquet(path)
+        else:
+            raise ValueError(f"Unsupported output format {path.suffix}, only `.npz` and `.parquet` are supported")
+
+    def save_npz(self, path: Union[str, Path]):
+        arrays = {
+            "names": np.array(self.names),
+            "energies": self.energies,
+            "forces": self.forces,
+            "offsets": self.offsets,
+        }
+        if self.stresses is not None:
+            arrays["stresses"] = self.stresses
+            arrays["volumes"] = self.volumes
+            arrays["virials"] = self.virials
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load_npz(cls, path: Union[str, Path]) -> "SinglePointResults":
+        with np.load(path) as data:
+            return cls(
+                names=data["names"].tolist(),
+                energies=data["energies"],
+                forces=data["forces"],
+                offsets=data["offsets"],
+                stresses=data["stresses"] if "stresses" in data else None,
+                volumes=data["volumes"] if "volumes" in data else None,
+            )
+
+    def save_parquet(self, path: Union[str, Path]):
+        """One row per structure, with the flattened forces in a list column"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("pyarrow is needed to write Parquet output, please install it by `pip install pyarrow`")
+        columns = {
+            "name": pa.array(self.names, type=pa.string()),
+            "energy": pa.array(self.energies),
+            "natoms": pa.array(self.natoms),
+            "forces": pa.ListArray.from_arrays(pa.array(self.offsets * 3), pa.array(self.forces.reshape(-1))),
+        }
+        if self.stresses is not None:
+            columns["stress"] = pa.FixedSizeListArray.from_arrays(pa.array(self.stresses.reshape(-1)), 6)
+            columns["virial"] = pa.FixedSizeListArray.from_arrays(pa.array(self.virials.reshape(-1)), 9)
+        pq.write_table(pa.table(columns), str(path))
+
+    def to_dict(self) -> dict:
+        """Per-structure results keyed by name, in the format of `single_point`"""
+        return {
+            name: {"potential_e": float(self.energies[i]), "force": self.get_forces(i)}
+            for i, name in enumerate(self.names)
+        }
+
+    def __repr__(self):
+        return json.dumps({"structures": len(self), "atoms": int(self.offsets[-1]), "stress": self.stresses is not None})
+
+
+def evaluate_structures(
+    calculator,
+    atoms_list: List[ase.Atoms],
+    names: List[str],
+    compute_stress: bool = False,
+    batch_size: Optional[int] = None,
+) -> SinglePointResults:
+    """
+    Evaluate structures with `calculate_batch` into columnar results
+
+    Parameters:
+    ----------
+    calculator: ase.calculators.calculator.Calculator
+        DP or MACE calculator, other calculators are evaluated serially.
+    atoms_list: List[ase.Atoms]
+        Structures to evaluate.
+    names: List[str]
+        Names of the structures.
+    compute_stress: bool
+        Whether to compute stresses and virials.
+    batch_size: int
+        Max number of structures evaluated in one model call, `None` for all.
+    """
+    results = calculate_batch(calculator, atoms_list, compute_stress=compute_stress, batch_size=batch_size)
+    return to_single_point_results(atoms_list, names, results, compute_stress=compute_stress)
+
+
+def to_single_point_results(
+    atoms_list: List[ase.Atoms],
+    names: List[str],
+    results: List[dict],
+    compute_stress: bool = False,
+) -> SinglePointResults:
+    """Collect the results of `calculate_batch` on `atoms_list` into columnar results"""
+    natoms = np.array([len(atoms) for atoms in atoms_list], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(natoms)])
+    return SinglePointResults(
+        names=names,
+        energies=np.array([res["energy"] for res in results], dtype=float),
+        forces=np.concatenate([res["forces"] for res in results]) if results else np.zeros((0, 3)),
+        offsets=offsets,
+        stresses=np.array([res["stress"] for res in results], dtype=float) if compute_stress else None,
+        volumes=np.array([atoms.get_volume() for atoms in atoms_list]) if compute_stress else None,
+    )
@@ -0,0 +1,206 @@
+"""Cache of structures parsed from CIF files.
+
+Parsed structures are kept in a SQLite file keyed by the absolute path, the
+modification time and the size of each CIF file, so that an edited file is
+parsed again. Ordered structures of plain elements are stored as raw arrays
+of the lattice, atomic numbers and fractional coordinates with their site
+labels; other structures, e.g. with oxidation states, site properties or
+partial occupancies, as compressed JSON, so that a cached structure is the
+parsed one. Set the environmental variable `OPENLAM_STRUCTURE_CACHE` to the
+path of a cache to let `relax_run` and `single_point` read structures from
+it, and fill it in parallel by `lam-opt ingest`.
+"""
+import functools
+import json
+import logging
+import os
+import sqlite3
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from pymatgen.core import Element, Lattice, Structure
+from tqdm import tqdm
+
+# caches of another version are parsed again
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS structures (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    lattice BLOB,
+    numbers BLOB,
+    coords BLOB,
+    labels TEXT,
+    structure BLOB,
+    error TEXT
+);
+"""
+
+
+def _file_key(cif: Union[str, Path]) -> Tuple[str, int, int]:
+    path = os.path.abspath(cif)
+    st = os.stat(path)
+    return path, st.st_mtime_ns, st.st_size
+
+
+def _is_plain(structure: Structure) -> bool:
+    # fully kept by the raw arrays and the labels
+    return (structure.is_ordered and not structure.site_properties and not structure.properties
+            and structure.charge == 0 and all(type(site.specie) is Element for site in structure))
+
+
+def _encode(structure: Structure) -> tuple:
+    if _is_plain(structure):
+        labels = [site.label for site in structure]
+        return (
+            structure.lattice.matrix.astype(np.float64).tobytes(),
+            np.array(structure.atomic_numbers, dtype=np.int16).tobytes(),
+            structure.frac_coords.astype(np.float64).tobytes(),
+            # default labels are the symbols
+            None if labels == [site.species_string for site in structure] else json.dumps(labels),
+            None,
+        )
+    return None, None, None, None, zlib.compress(json.dumps(structure.as_dict()).encode())
+
+
+def _decode(lattice: bytes, numbers: bytes, coords: bytes, labels: Optional[str], blob: bytes) -> Structure:
+    if blob is not None:
+        return Structure.from_dict(json.loads(zlib.decompress(blob).decode()))
+    return Structure(
+        Lattice(np.frombuffer(lattice, dtype=np.float64).reshape(3, 3)),
+        np.frombuffer(numbers, dtype=np.int16).tolist(),
+        np.frombuffer(coords, dtype=np.float64).reshape(-1, 3),
+        labels=json.loads(labels) if labels is not None else None,
+    )
+
+
+def _parse_cif(key: Tuple[str, int, int]) -> tuple:
+    try:
+        return (*key, *_encode(Structure.from_file(key[0])), None)
+    except Exception as e:
+        return (*key, None, None, None, None, None, repr(e))
+
+
+class StructureCache:
+    """SQLite cache of structures parsed from CIF files
+
+    Parameters:
+    ----------
+    path: Union[str, Path]
+        Path to the SQLite file, created if it does not exist.
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        if self.path.parent != Path("."):
+            os.makedirs(self.path.parent, exist_ok=True)
+        with closing(self.connect()) as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                conn.executescript("DROP TABLE IF EXISTS structures;")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.executescript(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=60)
+
+    def _insert(self, rows: List[tuple]):
+        with closing(self.connect()) as conn:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO structures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _lookup(self, key: Tuple[str, int, int]) -> Optional[tuple]:
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                "SELECT lattice, numbers, coords, labels, structure, error FROM structures "
+                "WHERE path = ? AND mtime_ns = ? AND size = ?",
+                key,
+            ).fetchone()
+
+    def load(self, cif: Union[str, Path]) -> Structure:
+        """
+        Load the structure of a CIF file, parsing and caching it if it is not
+        cached or has changed. Raises `ValueError` for a file which failed to
+        parse.
+        """
+        key = _file_key(cif)
+        row = self._lookup(key)
+        if row is None:
+            row = _parse_cif(key)
+            self._insert([row])
+            row = row[3:]
+        *arrays, error = row
+        if error is not None:
+            raise ValueError(f"Invalid CIF file {cif}: {error}")
+        return _decode(*arrays)
+
+    def missing(self, cifs: Iterable[Union[str, Path]]) -> List[Tuple[str, int, int]]:
+        """Keys of the CIF files which are not cached or have changed"""
+        keys = [_file_key(cif) for cif in cifs]
+        with closing(self.connect()) as conn:
+            cached = set(conn.execute("SELECT path, mtime_ns, size FROM structures").fetchall())
+        return [key for key in keys if key not in cached]
+
+    def ingest(self, cifs: Iterable[Union[str, Path]], workers: Optional[int] = None, chunk_size: int = 256) -> int:
+        """
+        Parse the CIF files which are not cached, in `workers` processes
+
+        Returns:
+        ----------
+        The number of parsed files.
+        """
+        keys = self.missing(cifs)
+        rows = []
+        with tqdm(total=len(keys), desc="Ingesting") as pbar:
+            if workers is None:
+                results = map(_parse_cif, keys)
+                executor = None
+            else:
+                executor = ProcessPoolExecutor(max_workers=workers)
+                results = executor.map(_parse_cif, keys, chunksize=max(1, min(64, len(keys) // (4 * workers))))
+            try:
+                for row in results:
+                    rows.append(row)
+                    pbar.update(1)
+                    if len(rows) >= chunk_size:
+                        self._insert(rows)
+                        rows = []
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+        self._insert(rows)
+        with closing(self.connect()) as conn:
+            ninvalid = conn.execute("SELECT COUNT(*) FROM structures WHERE error IS NOT NULL").fetchone()[0]
+        if ninvalid > 0:
+            logging.warn(f"{ninvalid} invalid CIF files in {self.path}")
+        return len(keys)
+
+
+def ingest(fpth: Union[str, Path], path: Union[str, Path], workers: Optional[int] = None) -> int:
+    """
+    Parse all CIF files under `fpth` into the structure cache at `path`
+
+    Returns:
+    ----------
+    The number of newly parsed files.
+    """
+    cache = StructureCache(path)
+    n = cache.ingest(sorted(Path(fpth).rglob("*.cif")), workers=workers)
+    print(f"{n} CIF files parsed into {path}.")
+    return n
+
+
+def get_structure_cache() -> Optional[StructureCache]:
+    """Get the cache given by `OPENLAM_STRUCTURE_CACHE`, if any"""
+    path = os.environ.get("OPENLAM_STRUCTURE_CACHE")
+    if not path:
+        return None
+    return _open_cache(path)
+
+
+@functools.lru_cache(maxsize=None)
+def _open_cache(path: str) -> StructureCache:
+    return StructureCache(path)
@@ -0,0 +1,66 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Union
+
+from monty.json import MontyEncoder
+
+
+class RunJournal:
+    """Append-only record of the structures finished in a run
+
+    Each finished structure is written as one JSON line and flushed to disk
+    immediately, so that an interrupted run can be resumed from the journal.
+
+    Parameters:
+    ----------
+    path: Union[str, Path]
+        Path to the journal file.
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def load(self) -> Dict[str, dict]:
+        """
+        Load the finished records, keyed by structure name. A truncated last
+        line left by a killed run is ignored.
+        """
+        records = {}
+        if not self.path.is_file():
+            return records
+        with open(self.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warn(f"Skip corrupted line in journal {self.path}")
+                    continue
+                records[record["name"]] = record
+        return records
+
+    def rewrite(self, records: Dict[str, dict]):
+        """Replace the journal with `records`, dropping corrupted lines"""
+        os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            for record in records.values():
+                f.write(json.dumps(record, cls=MontyEncoder) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if self.path.is_file():
+            os.remove(self.path)
+
+    def append(self, name: str, record: dict):
+        record = {"name": name, **record}
+        os.makedirs(self.path.parent, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, cls=MontyEncoder) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
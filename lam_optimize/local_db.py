@@ -0,0 +1,204 @@
+"""Local mirror of the OpenLAM structure database.
+
+Structures are kept in a SQLite file, indexed by formula, energy and
+submission time, with each structure stored as a zlib-compressed JSON blob.
+Set the environmental variable `OPENLAM_STRUCTURE_DB` to the path of a
+mirror to let `CrystalStructure.query` answer from it instead of the API.
+"""
+import functools
+import logging
+import os
+import sqlite3
+import zlib
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional, Union
+
+from tqdm import tqdm
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS structures (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    formula TEXT NOT NULL,
+    energy REAL NOT NULL,
+    submission_time TEXT NOT NULL,
+    structure BLOB NOT NULL,
+    UNIQUE (formula, energy, submission_time)
+);
+CREATE INDEX IF NOT EXISTS idx_formula_energy ON structures (formula, energy);
+CREATE INDEX IF NOT EXISTS idx_submission_time ON structures (submission_time);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class LocalStructureStore:
+    """SQLite mirror of the OpenLAM structure database
+
+    Parameters:
+    ----------
+    path: Union[str, Path]
+        Path to the SQLite file, created if it does not exist.
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        if self.path.parent != Path("."):
+            os.makedirs(self.path.parent, exist_ok=True)
+        with closing(self.connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        # one connection per call, so that the store can be used from threads
+        return sqlite3.connect(str(self.path), timeout=60)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def latest_submission_time(self) -> Optional[datetime]:
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT MAX(submission_time) FROM structures").fetchone()
+        return datetime.fromisoformat(row[0]) if row[0] is not None else None
+
+    def count(self) -> int:
+        with closing(self.connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM structures").fetchone()[0]
+
+    def insert_items(self, items: List[dict], meta: Optional[dict] = None):
+        """
+        Insert raw items returned by the API, skipping the ones already stored,
+        and update `meta` in the same transaction
+        """
+        rows = [
+            (item["formula"], item["energy"], item["submissionTime"], zlib.compress(item["structure"].encode()))
+            for item in items
+        ]
+        with closing(self.connect()) as conn:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO structures (formula, energy, submission_time, structure) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                for key, value in (meta or {}).items():
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def iter_query(
+        self,
+        formula: Optional[str] = None,
+        min_energy: Optional[float] = None,
+        max_energy: Optional[float] = None,
+        min_submission_time: Optional[datetime] = None,
+        max_submission_time: Optional[datetime] = None,
+        chunk_size: int = 1000,
+    ) -> Iterator["CrystalStructure"]:
+        from lam_optimize.db import CrystalStructure
+
+        conditions, params = [], []
+        if formula is not None:
+            conditions.append("formula = ?")
+            params.append(formula)
+        if min_energy is not None:
+            conditions.append("energy >= ?")
+            params.append(min_energy)
+        if max_energy is not None:
+            conditions.append("energy <= ?")
+            params.append(max_energy)
+        if min_submission_time is not None:
+            conditions.append("submission_time >= ?")
+            params.append(min_submission_time.isoformat())
+        if max_submission_time is not None:
+            conditions.append("submission_time <= ?")
+            params.append(max_submission_time.isoformat())
+        sql = "SELECT formula, energy, submission_time, structure FROM structures"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from CrystalStructure._parse_items([
+                    {
+                        "formula": formula,
+                        "energy": energy,
+                        "submissionTime": submission_time,
+                        "structure": zlib.decompress(blob).decode(),
+                    }
+                    for formula, energy, submission_time, blob in rows
+                ])
+
+    def query(self, **kwargs) -> List["CrystalStructure"]:
+        return list(self.iter_query(**kwargs))
+
+
+def sync(path: Union[str, Path], full: bool = False, limit: int = 1000) -> int:
+    """
+    Download structures from the OpenLAM database into a local mirror
+
+    Only structures submitted since the latest one in the mirror are requested
+    unless `full` is set. An interrupted sync continues from its last page.
+
+    Parameters:
+    ----------
+    path: Union[str, Path]
+        Path to the SQLite mirror.
+    full: bool
+        Download the whole database instead of an incremental refresh.
+    limit: int
+        Page size of the requests.
+
+    Returns:
+    ----------
+    The number of structures in the mirror.
+    """
+    from lam_optimize.db import CrystalStructure
+
+    store = LocalStructureStore(path)
+    offset = int(store.get_meta("sync_offset") or 0)
+    if offset > 0:
+        # continue an interrupted sync with its original condition
+        min_time = store.get_meta("sync_min_time")
+        min_time = datetime.fromisoformat(min_time) if min_time else None
+        logging.info(f"Continue the interrupted sync from {offset}")
+    else:
+        min_time = None if full else store.latest_submission_time()
+    start_count = store.count()
+    with tqdm(desc="Syncing", unit=" structures") as pbar:
+        while True:
+            params = CrystalStructure._offset_params(min_submission_time=min_time, offset=offset, limit=limit)
+            data = CrystalStructure.request_iterate(params)
+            if data["items"] is None:
+                break
+            offset = data["nextStartId"]
+            store.insert_items(data["items"], meta={
+                "sync_offset": str(offset),
+                "sync_min_time": min_time.isoformat() if min_time is not None else "",
+            })
+            pbar.update(len(data["items"]))
+            if offset == 0:
+                break
+    store.insert_items([], meta={"sync_offset": "0", "last_sync": datetime.now().isoformat()})
+    count = store.count()
+    print(f"{count - start_count} new structures, {count} structures in {path}.")
+    return count
+
+
+def get_local_store() -> Optional[LocalStructureStore]:
+    """Get the mirror given by `OPENLAM_STRUCTURE_DB`, if any"""
+    path = os.environ.get("OPENLAM_STRUCTURE_DB")
+    if not path:
+        return None
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Local structure database {path} not found, create it by `lam-opt sync -o {path}`")
+    return _open_store(path)
+
+
+@functools.lru_cache(maxsize=None)
+def _open_store(path: str) -> LocalStructureStore:
+    return LocalStructureStore(path)
@@ -2,10 +2,25 @@
 
 from __future__ import annotations
 
+import ase
 import ase.io
-from lam_optimize.db import CrystalStructure
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from queue import Full, Queue
+from lam_optimize.dedup import DuplicateFinder
+from lam_optimize.evaluate import SinglePointResults, to_single_point_results
+from lam_optimize.ingest import get_structure_cache
+from lam_optimize.journal import RunJournal
+from lam_optimize.metrics import METRICS
+from lam_optimize.models import start_method
 from lam_optimize.relaxer import Relaxer
-from lam_optimize.utils import get_e_form_per_atom, validate_cif, MATCHER
+from lam_optimize.schedule import CostModel, sort_by_cost
+from lam_optimize.thermo import get_e_above_hull_batch, get_e_form_per_atom_batch
+from lam_optimize.utils import get_e_form_per_atom
+from lam_optimize.validation import get_validator
+from lam_optimize.writer import get_writer
 import logging
 import numpy as np
 import pandas as pd
@@ -13,16 +28,434 @@ from pathlib import Path
 from pymatgen.core import Structure
 from pymatgen.io.ase import AseAtomsAdaptor
 from tqdm import tqdm
+from typing import Iterator, List
 import os
 import signal
-import traceback
+import time
 
 
 def sigalrm_handler(signum, frame):
     raise TimeoutError("Timeout to relax")
 
 
-def relax_run(fpth: Path, relaxer: Relaxer, fmax: float=1e-4, steps: int=200, traj_file: Path=None, timeout: int=None, check_convergence: bool=True, check_duplicate: bool=False, validate: bool=True):
+# relaxer of a worker process, built once by `_init_worker`
+_WORKER_RELAXER = None
+
+
+def _init_worker(relaxer: Relaxer, metrics: bool):
+    global _WORKER_RELAXER
+    _WORKER_RELAXER = relaxer
+    # spawned workers collect timings only if the main process does
+    METRICS.enable(metrics)
+
+
+def _get_executor(relaxer: Relaxer, workers: int) -> ProcessPoolExecutor:
+    # on CPU, workers are forked after the models are loaded and share their
+    # weights; otherwise they are spawned so that they never inherit a CUDA
+    # context, the relaxer is pickled by its construction arguments and its
+    # calculator is loaded once per worker
+    method = start_method(relaxer.device)
+    if method == "fork":
+        relaxer.load()
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(method),
+        initializer=_init_worker,
+        initargs=(relaxer, METRICS.enabled),
+    )
+
+
+def _cif_name(cif: Path) -> str:
+    return str(cif).split("/")[-1].split(".")[0]
+
+
+def _read_cif(cif: Path):
+    fn = _cif_name(cif)
+    cache = get_structure_cache()
+    try:
+        with METRICS.timer("cif_parse"):
+            structure = cache.load(cif) if cache is not None else Structure.from_file(cif)
+    except Exception as e:
+        logging.warn(f"CIF error: {repr(e)}")
+        structure = None
+    return fn, structure
+
+
+# marks the end of the structures parsed by `_prefetch`
+_DONE = object()
+
+
+def _prefetch(cifs: List[Path], depth: int) -> Iterator[tuple]:
+    """Parse CIF files in a background thread, at most `depth` structures ahead of the consumer"""
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # blocks while the queue is full, until the consumer is gone
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for cif in cifs:
+                with METRICS.structure(_cif_name(cif)):
+                    item = _read_cif(cif)
+                if not put(item):
+                    return
+        except BaseException as exc:
+            put(exc)
+        put(_DONE)
+
+    thread = threading.Thread(target=produce, name="openlam-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _parse_cifs(cifs: List[Path], prefetch: int=None) -> Iterator[tuple]:
+    """Yield `(name, structure)` of CIF files in order, parsed in a background thread if `prefetch` is set"""
+    if prefetch is not None:
+        yield from _prefetch(cifs, prefetch)
+        return
+    for cif in cifs:
+        with METRICS.structure(_cif_name(cif)):
+            item = _read_cif(cif)
+        yield item
+
+
+def _traj_path(traj_file: Path, fn: str):
+    if traj_file is not None:
+        return str(os.path.join(str(traj_file), fn + ".traj"))
+    return None
+
+
+def _relaxed_record(structure: Structure, result: dict, relax_time: float) -> dict:
+    # keep the final energy and forces seen by the optimizer, so that the
+    # checks afterwards do not need to evaluate the model again
+    trajectory = result["trajectory"]
+    return {
+        "status": "relaxed",
+        "final_structure": result["final_structure"],
+        "final_energy": float(trajectory.energies[-1]),
+        "initial_structure": structure.as_dict(),
+        "relax_time": relax_time,
+        "max_force": float(np.max(abs(trajectory.forces[-1]))),
+        "optimizer_converged": result["converged"],
+        "steps": result["steps"],
+        "stagnated": result.get("stagnated", False),
+    }
+
+
+def _failed_record(exc: Exception, relax_time: float=None) -> dict:
+    return {
+        "status": "timeout" if isinstance(exc, TimeoutError) else "failed",
+        "error": repr(exc),
+        "relax_time": relax_time,
+    }
+
+
+def _traj_interval(traj_file: Path, traj_interval: int):
+    # without a trajectory file only the final frame is needed
+    return traj_interval if traj_file is not None else 0
+
+
+def _relax_batch(batch: list, relaxer: Relaxer, fmax: float, steps: int, traj_file: Path=None, traj_interval: int=1, timeout: int=None):
+    fns = [fn for fn, _ in batch]
+    structures = [structure for _, structure in batch]
+    start = time.time()
+    if timeout is not None:
+        signal.signal(signal.SIGALRM, sigalrm_handler)
+        signal.alarm(timeout)
+    try:
+        results = relaxer.relax_many(structures, fmax=fmax, steps=steps, traj_files=[_traj_path(traj_file, fn) for fn in fns],
+                                      traj_interval=_traj_interval(traj_file, traj_interval))
+    except Exception as exc:
+        logging.warn(f"Failed to relax {fns}: {exc!r}")
+        return {fn: _failed_record(exc, time.time() - start) for fn in fns}
+    finally:
+        if timeout is not None:
+            signal.alarm(0)
+    # structures of a batch are relaxed together, each gets the batch wall time
+    relax_time = time.time() - start
+    return {
+        fn: _relaxed_record(structure, result, relax_time)
+        for fn, structure, result in zip(fns, structures, results)
+    }
+
+
+def _relax_structure(fn: str, structure: Structure, relaxer: Relaxer, fmax: float, steps: int, traj_file: Path=None, traj_interval: int=1, timeout: int=None):
+    start = time.time()
+    if timeout is not None:
+        signal.signal(signal.SIGALRM, sigalrm_handler)
+        signal.alarm(timeout)
+    try:
+        result = relaxer.relax(structure, fmax=fmax, steps=steps, traj_file=_traj_path(traj_file, fn),
+                               traj_interval=_traj_interval(traj_file, traj_interval))
+        return _relaxed_record(structure, result, time.time() - start)
+    except Exception as exc:
+        logging.warn(f"Failed to relax {fn}: {exc!r}")
+        return _failed_record(exc, time.time() - start)
+    finally:
+        if timeout is not None:
+            signal.alarm(0)
+
+
+def _relax_task(cif: Path, fmax: float, steps: int, traj_file: Path=None, traj_interval: int=1, timeout: int=None):
+    # runs in the main thread of a worker process, so `signal.alarm` still works;
+    # the timings of the structure are sent back with its record
+    with METRICS.structure(_cif_name(cif)):
+        fn, structure = _read_cif(cif)
+        if structure is None:
+            record = {"status": "invalid_cif"}
+        else:
+            record = _relax_structure(fn, structure, _WORKER_RELAXER, fmax, steps, traj_file, traj_interval, timeout)
+    return fn, record, METRICS.pop_structure(fn)
+
+
+def _iter_relax(fpth: Path, relaxer: Relaxer, fmax: float, steps: int, traj_file: Path=None, traj_interval: int=1, timeout: int=None, batch_size: int=None, workers: int=None, journal: Path=None, resume: bool=False, pipeline: int=None, retry_failed: bool=True, cost_model: CostModel=None):
+    """Relax all CIFs under `fpth`, yielding `(name, record)` as each structure finishes"""
+    run_journal = RunJournal(journal) if journal is not None else None
+    cifs = list(fpth.rglob("*.cif"))
+    finished = {}
+    if run_journal is not None:
+        if resume:
+            # only records of the CIFs under `fpth` are reused, so that one
+            # journal can be shared by the slices of a workflow
+            names = {_cif_name(cif) for cif in cifs}
+            finished = {
+                fn: record for fn, record in run_journal.load().items()
+                if fn in names and not (retry_failed and record["status"] in ("failed", "timeout"))
+            }
+            run_journal.rewrite(finished)
+            print(f"Resume from {len(finished)} finished structures in {journal}.")
+        else:
+            run_journal.clear()
+    for fn, record in finished.items():
+        yield fn, record
+
+    def finish(fn: str, record: dict):
+        if run_journal is not None:
+            run_journal.append(fn, record)
+        return fn, record
+
+    cifs = [cif for cif in cifs if _cif_name(cif) not in finished]
+    if batch_size is not None or workers is not None:
+        # longest first, so that large cells do not keep one worker busy at the
+        # end of the run, and batches hold structures of similar sizes
+        cifs = sort_by_cost(cifs, cost_model)
+    if batch_size is not None:
+        batch = []
+        for i, (fn, structure) in enumerate(tqdm(_parse_cifs(cifs, pipeline), total=len(cifs), desc="Relaxing")):
+            if structure is not None:
+                batch.append((fn, structure))
+            else:
+                yield finish(fn, {"status": "invalid_cif"})
+            if len(batch) >= batch_size or (i == len(cifs) - 1 and len(batch) > 0):
+                for fn, record in _relax_batch(batch, relaxer, fmax, steps, traj_file, traj_interval, timeout).items():
+                    yield finish(fn, record)
+                batch = []
+    elif workers is not None:
+        with _get_executor(relaxer, workers) as executor:
+            futures = [executor.submit(_relax_task, cif, fmax, steps, traj_file, traj_interval, timeout) for cif in cifs]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Relaxing"):
+                fn, record, timings = future.result()
+                METRICS.add_structure(fn, timings)
+                yield finish(fn, record)
+    else:
+        for fn, structure in tqdm(_parse_cifs(cifs, pipeline), total=len(cifs), desc="Relaxing"):
+            with METRICS.structure(fn):
+                if structure is not None:
+                    record = _relax_structure(fn, structure, relaxer, fmax, steps, traj_file, traj_interval, timeout)
+                else:
+                    record = {"status": "invalid_cif"}
+            yield finish(fn, record)
+
+
+def _check_convergence(fn: str, atoms: ase.Atoms, record: dict, relaxer: Relaxer) -> bool:
+    with METRICS.timer("convergence_check"):
+        return _check_forces(fn, atoms, record, relaxer)
+
+
+def _check_forces(fn: str, atoms: ase.Atoms, record: dict, relaxer: Relaxer) -> bool:
+    energy = record["final_energy"]
+    max_force = record.get("max_force")
+    if max_force is None:
+        # records journaled without the final forces
+        atoms.calc = relaxer.calculator
+        energy = atoms.get_potential_energy()
+        max_force = np.max(abs(atoms.get_forces()))
+    if get_e_form_per_atom(atoms, energy) > 0:
+        logging.warn("%s: energy not relaxed" % atoms.symbols)
+    elif max_force > 0.05:
+        logging.warn("%s: forces not relaxed" % atoms.symbols)
+    else:
+        return True
+    atoms = AseAtomsAdaptor.get_atoms(Structure.from_dict(record["initial_structure"]))
+    ase.io.write(f"unconverged/initial-{atoms.symbols}-{fn}.cif", atoms, format='cif')
+    return False
+
+
+def _check_duplicate(structure: Structure, energy: float, finder: DuplicateFinder, name: str=None):
+    with METRICS.timer("duplicate_check"):
+        duplicate_of = finder.check(structure, energy, name)
+    if duplicate_of is not None:
+        logging.warn("%s: duplicate structure of %s" % (structure.formula, duplicate_of))
+    return duplicate_of
+
+
+def _to_optional(value: float):
+    return None if value is None or np.isnan(value) else float(value)
+
+
+def _write_relaxed(fn: str, atoms: ase.Atoms):
+    # named after the input CIF as well, so that structures of the same
+    # formula never overwrite, or on failed validation remove, each other
+    cif_file = f"relaxed/final-{atoms.symbols}-{fn}.cif"
+    with METRICS.timer("cif_write"):
+        ase.io.write(cif_file, atoms, format='cif')
+    return cif_file
+
+
+def _finish_validation(record: dict, future) -> dict:
+    # files are validated in worker processes, only the time waiting for them is spent here
+    with METRICS.timer("cif_validate"):
+        result = future.result()
+    if result["status"] != "pass":
+        logging.warn("%s: %s" % (result["path"], result["reason"]))
+        os.remove(result["path"])
+        record["relaxed_cif"] = None
+        record["validation_error"] = result["reason"]
+    return record
+
+
+def _postprocess(fn: str, record: dict, relaxer: Relaxer, finder: DuplicateFinder, check_convergence: bool, check_duplicate: bool, compute_e_above_hull: bool):
+    structure = Structure.from_dict(record["final_structure"])
+    atoms = AseAtomsAdaptor.get_atoms(structure)
+    if check_convergence:
+        record["converged"] = _check_convergence(fn, atoms, record, relaxer)
+    if check_duplicate and record["converged"] is not False:
+        record["duplicate_of"] = _check_duplicate(structure, record["final_energy"], finder, fn)
+        record["duplicate"] = record["duplicate_of"] is not None
+    if record["converged"] is not False and record["duplicate"] is not True:
+        record["relaxed_cif"] = _write_relaxed(fn, atoms)
+    with METRICS.timer("thermo"):
+        record["e_form_per_atom"] = _to_optional(get_e_form_per_atom_batch([structure], [record["final_energy"]])[0])
+        if compute_e_above_hull:
+            record["e_above_hull"] = _to_optional(
+                get_e_above_hull_batch([structure], [record["e_form_per_atom"]], on_error="ignore")[0]
+            )
+
+
+def _finish_record(fn: str, record: dict, relaxer: Relaxer, finder: DuplicateFinder, validator, check_convergence: bool, check_duplicate: bool, compute_e_above_hull: bool):
+    """Check and write a finished structure, returning its record and the future of its CIF validation if any"""
+    record = {key: record.get(key) for key in RECORD_FIELDS if key != "name"}
+    if record["status"] == "relaxed":
+        with METRICS.structure(fn):
+            _postprocess(fn, record, relaxer, finder, check_convergence, check_duplicate, compute_e_above_hull)
+    record = {"name": fn, **record}
+    if validator is not None and record["relaxed_cif"] is not None:
+        return record, validator.submit(record["relaxed_cif"])
+    return record, None
+
+
+def _is_ready(item) -> bool:
+    if isinstance(item, Future):
+        if not item.done():
+            return False
+        item = item.result()
+    validation = item[1]
+    return validation is None or validation.done()
+
+
+def _take_record(item) -> dict:
+    record, validation = item.result() if isinstance(item, Future) else item
+    return _finish_validation(record, validation) if validation is not None else record
+
+
+# fields of every record yielded by `iter_relax_run` and their types in
+# Parquet outputs, structures are stored as JSON strings
+RECORD_TYPES = {
+    "name": "string", "status": "string", "final_structure": "string", "final_energy": "double",
+    "initial_structure": "string", "relax_time": "double", "error": "string", "max_force": "double",
+    "optimizer_converged": "bool", "steps": "int64", "stagnated": "bool", "converged": "bool",
+    "duplicate": "bool", "duplicate_of": "string", "relaxed_cif": "string", "e_form_per_atom": "double",
+    "e_above_hull": "double", "validation_error": "string",
+}
+RECORD_FIELDS = list(RECORD_TYPES)
+
+
+def iter_relax_run(fpth: Path, relaxer: Relaxer, fmax: float=1e-4, steps: int=200, traj_file: Path=None, timeout: int=None, check_convergence: bool=True, check_duplicate: bool=False, validate: bool=True, batch_size: int=None, workers: int=None, journal: Path=None, resume: bool=False, traj_interval: int=1, compute_e_above_hull: bool=False, pipeline: int=None, retry_failed: bool=True, cost_model: CostModel=None):
+    """
+    Generator version of `relax_run`. Each structure is checked, written to
+    `relaxed/` or `unconverged/` as soon as it is relaxed, and its record is
+    yielded immediately, so that nothing accumulates in memory.
+
+    Parameters are the same as `relax_run`.
+
+    Yields:
+    ----------
+    A dict with the keys in `RECORD_FIELDS` for every CIF file. `status` is one
+    of `relaxed`, `failed`, `timeout` and `invalid_cif`; `max_force` is the
+    largest final force component seen by the optimizer and
+    `optimizer_converged`/`steps` its own convergence flag and step count,
+    `stagnated` whether the `adaptive` optimizer stopped it for lack of progress;
+    `converged` and `duplicate` are `None` when the corresponding check is skipped.
+    `duplicate_of` is `database` for a duplicate of a known structure, or the
+    name of the earlier structure of the run it duplicates. `e_above_hull` is
+    `None` unless `compute_e_above_hull` is set or its hull is not available.
+    `validation_error` is the reason a written CIF file failed validation, in
+    which case the file is removed and `relaxed_cif` is `None`.
+    """
+    if batch_size is not None and workers is not None:
+        raise ValueError("`batch_size` and `workers` cannot be used together")
+    os.makedirs("unconverged", exist_ok=True)
+    os.makedirs("relaxed", exist_ok=True)
+    # known structures of a formula are queried once, and unique structures of
+    # the run are indexed to find duplicates within the run as well
+    finder = DuplicateFinder()
+    # written CIF files are validated in a worker pool while relaxation goes
+    # on, and records are yielded in order once their validation is done
+    validator = get_validator() if validate else None
+    # with `pipeline`, finished structures are checked and written in order by
+    # one output thread while the next structures are relaxed, and the
+    # relaxation waits once `pipeline` records are pending
+    output = ThreadPoolExecutor(max_workers=1, thread_name_prefix="openlam-output") if pipeline is not None else None
+    args = (relaxer, finder, validator, check_convergence, check_duplicate, compute_e_above_hull)
+    pending = deque()
+    try:
+        for fn, record in _iter_relax(fpth, relaxer, fmax, steps, traj_file, traj_interval, timeout, batch_size, workers, journal, resume, pipeline, retry_failed, cost_model):
+            if output is not None and not (record["status"] == "relaxed" and record.get("max_force") is None):
+                pending.append(output.submit(_finish_record, fn, record, *args))
+            else:
+                # records journaled without the final forces are checked with the
+                # model, which is only used by this thread
+                for item in pending:
+                    if isinstance(item, Future):
+                        item.exception()
+                pending.append(_finish_record(fn, record, *args))
+            while pending and (_is_ready(pending[0]) or (pipeline is not None and len(pending) > pipeline)):
+                yield _take_record(pending.popleft())
+        for item in pending:
+            yield _take_record(item)
+    finally:
+        if output is not None:
+            output.shutdown(wait=True)
+
+
+def relax_run(fpth: Path, relaxer: Relaxer, fmax: float=1e-4, steps: int=200, traj_file: Path=None, timeout: int=None, check_convergence: bool=True, check_duplicate: bool=False, validate: bool=True, batch_size: int=None, workers: int=None, journal: Path=None, resume: bool=False, output: Path=None, traj_interval: int=1, compute_e_above_hull: bool=False, pipeline: int=None, retry_failed: bool=True, cost_model: CostModel=None):
     """
     This is the main relaxation function
 
@@ -37,104 +470,86 @@ def relax_run(fpth: Path, relaxer: Relaxer, fmax: float=1e-4, steps: int=200, tr
     steps: int
         Max steps allowed for relaxation.
     traj_file: Path
-        Path to store relaxation trajectory.
+        Folder to stream the ASE trajectory `<name>.traj` of each structure to.
+    batch_size: int
+        If set, relax this many structures together with `Relaxer.relax_many`,
+        `timeout` then applies to a whole batch.
+    workers: int
+        If set, relax structures in this many worker processes, each building
+        its own calculator once. Cannot be combined with `batch_size`.
+    cost_model: CostModel
+        Cost model ordering the structures longest first with `batch_size` or
+        `workers`, linear in the number of atoms if not given.
+    journal: Path
+        If set, path of the run journal recording every finished structure as
+        soon as it completes. Unless `resume` is set, it is cleared first.
+    resume: bool
+        Skip structures already recorded in `journal` and reuse their results.
+    retry_failed: bool
+        When resuming, relax again the structures recorded as `failed` or
+        `timeout` in `journal` instead of reusing their records.
+    output: Path
+        If set, stream the record of every structure to this `.jsonl` or
+        `.parquet` file while the run progresses instead of collecting a
+        DataFrame, and return `None`.
+    traj_interval: int
+        Record every `traj_interval`-th step in the trajectories, 0 to record
+        only the final frame.
+    compute_e_above_hull: bool
+        Add the energy above hull of every relaxed structure, with the phase
+        diagram of each chemical system loaded once. Structures whose hull is
+        not available get `None`.
+    pipeline: int
+        If set, CIF files are parsed in a background thread and relaxed
+        structures are checked, written and validated in another one while
+        the next structures are relaxed, with at most `pipeline` structures
+        waiting between the stages.
     """
     print("\nStart to relax structures.\n")
+    records = iter_relax_run(fpth, relaxer, fmax=fmax, steps=steps, traj_file=traj_file, traj_interval=traj_interval, timeout=timeout,
+                             check_convergence=check_convergence, check_duplicate=check_duplicate, validate=validate,
+                             batch_size=batch_size, workers=workers, journal=journal, resume=resume,
+                             retry_failed=retry_failed, cost_model=cost_model, compute_e_above_hull=compute_e_above_hull and output is not None, pipeline=pipeline)
+    if output is not None:
+        with get_writer(output, schema=RECORD_TYPES) as writer:
+            for record in records:
+                with METRICS.timer("output"):
+                    writer.write(record)
+        print(f"\nSaved to {output}.\n")
+        return None
+
     relax_results = {}
-    cifs = fpth.rglob("*.cif")
-    for cif in tqdm(cifs, desc="Relaxing"):
-        fn = str(cif).split("/")[-1].split(".")[0]
-        try:
-            structure = Structure.from_file(cif)
-        except Exception as e:
-            logging.warn(f"CIF error: {repr(e)}")
-            structure = None
-        if structure is not None:
-            if timeout is not None:
-                signal.signal(signal.SIGALRM, sigalrm_handler)
-                signal.alarm(timeout)
-            try:
-                if traj_file is not None:
-                    outpath = str(os.path.join(str(traj_file),fn ))
-                else:
-                    outpath = None
-                result = relaxer.relax(structure, fmax=fmax, steps=steps, traj_file=outpath)
-                relax_results[fn] = {
-                    f"final_structure": result["final_structure"],
-                    "final_energy": result["trajectory"].energies[-1],
-                    "initial_structure": structure.as_dict(),
-                }
-
-            except Exception as exc:
-                    logging.warn(f"Failed to relax {fn}: {exc!r}")
-            finally:
-                if timeout is not None:
-                    signal.alarm(0)
-        else:
-            pass
+    for record in records:
+        if record["status"] == "relaxed":
+            relax_results[record["name"]] = {
+                key: record[key] for key in ["final_structure", "final_energy", "initial_structure", "optimizer_converged", "steps", "e_form_per_atom"]
+            }
     df_out = pd.DataFrame(relax_results).T
+    if compute_e_above_hull:
+        # grouped over the whole run, so that each phase diagram is loaded once
+        structures = [Structure.from_dict(s) for s in df_out.get("final_structure", [])]
+        e_above_hull = get_e_above_hull_batch(structures, df_out.get("e_form_per_atom", []), on_error="ignore")
+        df_out["e_above_hull"] = [_to_optional(e) for e in e_above_hull]
     print("\nSaved to df.\n")
+    return df_out
 
-    atoms_list = []
-    for i in df_out.index:
-        atoms = AseAtomsAdaptor.get_atoms(Structure.from_dict(df_out.loc[i, "final_structure"]))
-        atoms_list.append(atoms)
+def _evaluate_structure(structure: Structure, relaxer: Relaxer):
+    atoms = relaxer.ase_adaptor.get_atoms(structure)
+    result = relaxer.evaluate([atoms])[0]
+    return {
+        "potential_e": result["energy"],
+        "force": result["forces"]
+    }
 
-    os.makedirs("unconverged", exist_ok=True)
-    if check_convergence:
-        new_atoms_list = []
-        unconverged = []
-        for i, atoms in enumerate(atoms_list):
-            atoms.calc = relaxer.calculator
-            if get_e_form_per_atom(atoms, atoms.get_potential_energy()) > 0:
-                logging.warn("%s: energy not relaxed" % atoms.symbols)
-                unconverged.append(Structure.from_dict(df_out.loc[df_out.index[i], "initial_structure"]))
-            elif np.max(abs(atoms.get_forces())) > 0.05:
-                logging.warn("%s: forces not relaxed" % atoms.symbols)
-                unconverged.append(Structure.from_dict(df_out.loc[df_out.index[i], "initial_structure"]))
-            else:
-                new_atoms_list.append(atoms)
-        atoms_list = new_atoms_list
-        for structure in unconverged:
-            atoms = AseAtomsAdaptor.get_atoms(structure)
-            ase.io.write(f"unconverged/initial-{atoms.symbols}.cif", atoms, format='cif')
-
-    if check_duplicate:
-        new_atoms_list = []
-        for atoms in atoms_list:
-            atoms.calc = relaxer.calculator
-            energy = atoms.get_potential_energy()
-            structure = AseAtomsAdaptor.get_structure(atoms)
-            formula = structure.reduced_formula
-            for known_structure in CrystalStructure.query(formula=formula):
-                if (
-                    abs(known_structure.energy - energy)
-                    / max(abs(known_structure.energy), abs(energy))
-                    > 0.05
-                ):
-                    continue
-                else:
-                    if MATCHER.fit(known_structure.structure, structure):
-                        logging.warn("%s: duplicate structure" % atoms.symbols)
-                        break
-            else:
-                new_atoms_list.append(atoms)
-        atoms_list = new_atoms_list
 
-    os.makedirs("relaxed", exist_ok=True)
-    for atoms in atoms_list:
-        cif_file = f"relaxed/final-{atoms.symbols}.cif"
-        ase.io.write(cif_file, atoms, format='cif')
-        if validate:
-            try:
-                validate_cif(cif_file)
-            except Exception:
-                traceback.print_exc()
-                os.remove(cif_file)
+def _evaluate_task(cif: Path):
+    with METRICS.structure(_cif_name(cif)):
+        fn, structure = _read_cif(cif)
+        result = _evaluate_structure(structure, _WORKER_RELAXER) if structure is not None else None
+    return fn, result, METRICS.pop_structure(fn)
 
-    return df_out
 
-def single_point(fpth:Path, relaxer: Relaxer):
+def single_point(fpth:Path, relaxer: Relaxer, workers: int=None):
     """
     This function performs single point evaluation
 
@@ -144,31 +559,77 @@ def single_point(fpth:Path, relaxer: Relaxer):
         The absolute file path to the folder containing `.cif` files.
     relaxer: Relaxer
         The relaxer for optimization
+    workers: int
+        If set, evaluate structures in this many worker processes.
+
+    Structures found in the result cache of `relaxer` are not evaluated again.
     """
     print("\nStart to evaluate structures.\n")
 
-    calculator = relaxer.calculator
-    adaptor = relaxer.ase_adaptor
     eval_results = {}
     cifs = fpth.rglob("*.cif")
-    for cif in tqdm(cifs, desc="Evaluating..."):
-        fn = str(cif).split("/")[-1].split(".")[0]
-        try:
-            structure = Structure.from_file(cif)
-        except Exception as e:
-            logging.info(f"CIF error: {repr(e)}")
-            structure = None
-        if structure is not None:
-            structure = adaptor.get_atoms(structure)
-            structure.set_calculator(calculator)
-            eval_results[fn] = {
-                "potential_e": structure.get_potential_energy(),
-                "force": structure.get_forces()
-            }
+    if workers is not None:
+        cifs = sort_by_cost(list(cifs))
+        with _get_executor(relaxer, workers) as executor:
+            futures = [executor.submit(_evaluate_task, cif) for cif in cifs]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Evaluating..."):
+                fn, result, timings = future.result()
+                METRICS.add_structure(fn, timings)
+                if result is not None:
+                    eval_results[fn] = result
+    else:
+        for cif in tqdm(cifs, desc="Evaluating..."):
+            fn, structure = _read_cif(cif)
+            if structure is not None:
+                eval_results[fn] = _evaluate_structure(structure, relaxer)
     df_out = pd.DataFrame(eval_results).T
     print("\nSaved to df.\n")
     return df_out
-    
+
+
+def single_point_batch(fpth: Path, relaxer: Relaxer, batch_size: int=64, compute_stress: bool=False, output: Path=None) -> SinglePointResults:
+    """
+    Batched single point evaluation with columnar results
+
+    Parameters:
+    ----------
+    fpth: Path
+        The absolute file path to the folder containing `.cif` files.
+    relaxer: Relaxer
+        The relaxer whose calculator is evaluated.
+    batch_size: int
+        Number of structures read and evaluated in one model call.
+    compute_stress: bool
+        Whether to compute stresses and virials.
+    output: Path
+        If set, save the results to this `.npz` or `.parquet` file.
+
+    Structures found in the result cache of `relaxer` are not evaluated again.
+
+    Returns:
+    ----------
+    `SinglePointResults` with flat energies and concatenated forces indexed
+    by offsets. Invalid CIF files are skipped.
+    """
+    print("\nStart to evaluate structures.\n")
+    cifs = list(fpth.rglob("*.cif"))
+    chunks = []
+    for i in tqdm(range(0, len(cifs), batch_size), desc="Evaluating..."):
+        names, atoms_list = [], []
+        for cif in cifs[i:i + batch_size]:
+            fn, structure = _read_cif(cif)
+            if structure is not None:
+                names.append(fn)
+                atoms_list.append(relaxer.ase_adaptor.get_atoms(structure))
+        results = relaxer.evaluate(atoms_list, compute_stress=compute_stress)
+        chunks.append(to_single_point_results(atoms_list, names, results, compute_stress=compute_stress))
+    results = SinglePointResults.concatenate(chunks)
+    if output is not None:
+        results.save(output)
+        print(f"\nSaved to {output}.\n")
+    return results
+
+
 if __name__ == "__main__":
     relaxer = Relaxer(Path("mp.pth"))
     fpath = Path("/test_data")
@@ -0,0 +1,248 @@
+"""Per-stage timings, counters and peak memory of a run.
+
+Collection is off until `METRICS.enable()`, e.g. by `--metrics`. Stages are
+timed with `METRICS.timer(stage)`. Timers nest, and the time of a stage
+excludes the time of the stages timed inside it, e.g. `relax` only keeps the
+time left after `model`, `optimizer` and `trajectory`, so that the stage
+times of a run add up to its wall time. Stages and counters inside
+`METRICS.structure(name)` are also aggregated per structure, as the number
+of structures, the sum and the max.
+
+Timings are exported to a JSON file or to the Prometheus text format by
+`METRICS.save`. `SamplingProfiler` samples the stack of a thread at a fixed
+interval and writes collapsed stacks for flame graph tools.
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Callable, Dict, Optional, Union
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is not reported
+    resource = None
+
+
+_NULL_CONTEXT = nullcontext()
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+class Metrics:
+    """Thread-safe registry of stage timings and counters
+
+    Nothing is collected until `enable` is called, e.g. by `--metrics`, and
+    all methods are no-ops until then.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.enabled = False
+        self.reset()
+
+    def enable(self, enabled: bool = True):
+        """Start, or stop with `enabled=False`, collecting timings and counters"""
+        self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            self.seconds = defaultdict(float)
+            self.calls = defaultdict(int)
+            self.counters = defaultdict(float)
+            # [structures, sum, max] of the per-structure values, so that
+            # memory does not grow with the number of structures
+            self.nstructures = 0
+            self.structure_seconds: Dict[str, list] = defaultdict(lambda: [0, 0.0, 0.0])
+            self.structure_counters: Dict[str, list] = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def _stack(self) -> list:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def timer(self, stage: str):
+        """Time a stage, excluding the stages timed inside it"""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._timer(stage)
+
+    @contextmanager
+    def _timer(self, stage: str):
+        stack = self._stack()
+        # [stage, time spent in nested timers]
+        frame = [stage, 0.0]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            self._add_time(stage, elapsed - frame[1])
+
+    def _add_time(self, stage: str, seconds: float):
+        # the entry of the current structure is only used by this thread
+        entry = getattr(self.local, "structure", None)
+        if entry is not None:
+            entry["seconds"][stage] += seconds
+        with self.lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += 1
+
+    def timed(self, stage: str, func: Callable) -> Callable:
+        """Wrap `func` to time each call as `stage`"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            with self._timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def count(self, name: str, n: float = 1):
+        if not self.enabled:
+            return
+        entry = getattr(self.local, "structure", None)
+        if entry is not None:
+            entry["counters"][name] += n
+        with self.lock:
+            self.counters[name] += n
+
+    def structure(self, name: str):
+        """Attribute the stages and counters of the current thread to a structure"""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._structure(name)
+
+    @contextmanager
+    def _structure(self, name: str):
+        previous = getattr(self.local, "structure", None)
+        entry = {"seconds": defaultdict(float), "counters": defaultdict(float)}
+        self.local.structure = entry
+        try:
+            yield
+        finally:
+            self.local.structure = previous
+            # kept until the next structure of the thread for `pop_structure`
+            self.local.finished = (name, entry)
+            with self.lock:
+                self._aggregate(entry)
+
+    def _aggregate(self, entry: dict):
+        self.nstructures += 1
+        for values, aggregates in [(entry["seconds"], self.structure_seconds),
+                                   (entry["counters"], self.structure_counters)]:
+            for key, value in values.items():
+                aggregate = aggregates[key]
+                aggregate[0] += 1
+                aggregate[1] += value
+                aggregate[2] = max(aggregate[2], value)
+
+    def pop_structure(self, name: str) -> Optional[dict]:
+        """Return the timings of the last structure of this thread, e.g. to send them from a worker process"""
+        finished = getattr(self.local, "finished", None)
+        if finished is None or finished[0] != name:
+            return None
+        self.local.finished = None
+        entry = finished[1]
+        return {"seconds": dict(entry["seconds"]), "counters": dict(entry["counters"])}
+
+    def add_structure(self, name: str, timings: Optional[dict]):
+        """Merge the timings of a structure measured in another process"""
+        if not self.enabled or timings is None:
+            return
+        with self.lock:
+            for stage, seconds in timings["seconds"].items():
+                self.seconds[stage] += seconds
+                self.calls[stage] += 1
+            for counter, n in timings["counters"].items():
+                self.counters[counter] += n
+            self._aggregate(timings)
+
+    def snapshot(self, structures: bool = True) -> dict:
+        with self.lock:
+            data = {
+                "wall_time": time.time() - self.start_time,
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": {stage: {"seconds": self.seconds[stage], "calls": self.calls[stage]} for stage in self.seconds},
+                "counters": dict(self.counters),
+            }
+            if structures:
+                data["structures"] = {
+                    "count": self.nstructures,
+                    "stages": {stage: {"structures": n, "seconds": total, "max_seconds": largest}
+                               for stage, (n, total, largest) in self.structure_seconds.items()},
+                    "counters": {counter: {"structures": n, "total": total, "max": largest}
+                                 for counter, (n, total, largest) in self.structure_counters.items()},
+                }
+        return data
+
+
+METRICS = Metrics()
+
+
+class SamplingProfiler:
+    """Sample the stack of a thread in a background thread
+
+    Parameters:
+    ----------
+    path: Union[str, Path]
+        File the collapsed stacks (`frame;frame;... count` per line) are
+        written to when stopped, for flame graph tools.
+    interval: float
+        Sampling interval in seconds.
+    thread_id: int
+        Ident of the sampled thread, the calling thread by default.
+    """
+    def __init__(self, path: Union[str, Path], interval: float = 0.01, thread_id: Optional[int] = None):
+        self.path = Path(path)
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        with open(self.path, "w") as f:
+            for stack, n in self.samples.most_common():
+                f.write(f"{stack} {n}\n")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
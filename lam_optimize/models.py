@@ -0,0 +1,177 @@
+"""Process-wide registry of loaded calculators.
+
+Loading a model is expensive: a DP model is read and initialized from its
+freezed file, and MACE weights are loaded, and downloaded the first time.
+`get_calculator` loads each model once per process, keyed by the model file
+(path, size and modification time) or name, the dtype and the device, and
+all relaxers of the same model share the loaded calculator.
+
+On CPU nodes, worker processes are forked after the model is loaded, so
+that they share its weights copy-on-write instead of loading it again,
+see `start_method`.
+"""
+import functools
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+import ase
+from ase.data import chemical_symbols
+
+from lam_optimize.cache import KeyedLock
+from lam_optimize.metrics import METRICS
+from lam_optimize.result_cache import file_hash
+
+_CALCULATORS = {}
+_HASHES = {}
+_lock = threading.Lock()
+_load_locks = KeyedLock()
+
+
+def _file_key(path: Path) -> tuple:
+    stat = os.stat(path)
+    return (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+def model_hash(path: Path) -> str:
+    """Hash of a model file, computed once per process until the file changes"""
+    key = _file_key(path)
+    with _lock:
+        digest = _HASHES.get(key)
+    if digest is None:
+        digest = file_hash(path)
+        with _lock:
+            _HASHES[key] = digest
+    return digest
+
+
+def model_id(model: Union[str, Path], dtype: str = "float64") -> str:
+    """Identity of a model, the hash of a DP model file or the name and dtype of a MACE model"""
+    if isinstance(model, Path):
+        return "dp-" + model_hash(model)
+    elif model == "emt":
+        return "emt"
+    return f"mace-mp-medium-{dtype}"
+
+
+def default_device(model: Union[str, Path]) -> str:
+    """`cuda` if a GPU is visible to torch, `cpu` otherwise"""
+    if model == "emt":
+        return "cpu"
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def start_method(device: str) -> str:
+    """
+    Start method of worker processes, `fork` on Linux CPU nodes so that
+    workers share the models loaded before, and `spawn` otherwise so that
+    workers never inherit a CUDA context. `OPENLAM_START_METHOD` overrides it.
+    """
+    method = os.environ.get("OPENLAM_START_METHOD")
+    if method is not None:
+        return method
+    if device == "cpu" and sys.platform.startswith("linux") and "fork" in multiprocessing.get_all_start_methods():
+        return "fork"
+    return "spawn"
+
+
+def _instrument_calculator(calculator):
+    """Count and time the model evaluations of an ASE calculator"""
+    calculate = calculator.calculate
+
+    @functools.wraps(calculate)
+    def wrapper(*args, **kwargs):
+        METRICS.count("force_calls")
+        with METRICS.timer("model"):
+            return calculate(*args, **kwargs)
+
+    calculator.calculate = wrapper
+    return calculator
+
+
+def _load_calculator(model: Union[str, Path], dtype: str, device: str):
+    if isinstance(model, Path):
+        # DP models run on the device chosen by deepmd
+        try:
+            from deepmd.calculator import DP as DPCalculator
+            return DPCalculator(model)
+        except Exception as e:
+            raise ValueError(f"DP calculator load failed: {e}")
+    elif model == "mace":
+        from mace.calculators import mace_mp
+        return mace_mp(model="medium", device=device, default_dtype=dtype)
+    elif model == "emt":
+        # cheap stand-in for benchmarks, only for Al, Cu, Ag, Au, Ni, Pd, Pt, H, C, N and O
+        from ase.calculators.emt import EMT
+        return EMT()
+    raise NotImplementedError("Only DP calculator, MACE calculator and the EMT stand-in are supported.")
+
+
+def _warm_up(calculator):
+    # one evaluation of a small cell, so that lazy initializations, e.g. of
+    # the TorchScript JIT or CUDA kernels, are not paid by the first structure
+    if hasattr(calculator, "type_dict"):
+        symbol = next(iter(calculator.type_dict))
+    elif hasattr(calculator, "z_table"):
+        symbol = chemical_symbols[int(calculator.z_table.zs[0])]
+    else:
+        symbol = "Cu"
+    atoms = ase.Atoms([symbol] * 2, positions=[[0, 0, 0], [1.5, 1.5, 1.5]], cell=[3, 3, 3], pbc=True)
+    atoms.calc = calculator
+    try:
+        atoms.get_potential_energy()
+        atoms.get_forces()
+        atoms.get_stress()
+    except Exception as e:
+        logging.warn(f"Warm-up of {type(calculator).__name__} failed: {e!r}")
+
+
+def get_calculator(model: Union[str, Path], dtype: str = "float64", device: Optional[str] = None, warmup: bool = False):
+    """
+    Get the calculator of a model, loaded once per process
+
+    Parameters:
+    ----------
+    model: Union[Path, str]
+        Path to a freezed DP model, `mace` or `emt`.
+    dtype: str
+        Dtype of MACE models, `float64` or `float32`.
+    device: str
+        Device of MACE models, the default of `default_device` if not given.
+    warmup: bool
+        Whether to evaluate a small structure right after loading the model.
+
+    Returns:
+    ----------
+    The calculator, whose model evaluations are counted as `force_calls` and timed as `model` in `METRICS`.
+    """
+    device = device if device is not None else default_device(model)
+    key = (_file_key(model) if isinstance(model, Path) else model, dtype, device)
+    calculator = _CALCULATORS.get(key)
+    if calculator is not None:
+        return calculator
+    # concurrent callers of the same model share one load
+    with _load_locks(key):
+        calculator = _CALCULATORS.get(key)
+        if calculator is None:
+            with METRICS.timer("model_load"):
+                calculator = _load_calculator(model, dtype, device)
+                if warmup:
+                    _warm_up(calculator)
+            calculator = _instrument_calculator(calculator)
+            _CALCULATORS[key] = calculator
+    return calculator
+
+
+def clear_calculators():
+    """Drop all loaded calculators, e.g. to free GPU memory"""
+    with _lock:
+        _CALCULATORS.clear()
@@ -0,0 +1,24 @@
+"""Names of the choices of the commandline tool.
+
+They are kept apart from the modules implementing them, which import ASE,
+pymatgen and the models, so that `lam-opt` parses its arguments without
+importing the scientific stack.
+"""
+from importlib.metadata import PackageNotFoundError, version
+
+
+def _ase_version() -> tuple:
+    # read from the package metadata, without importing ASE
+    try:
+        return tuple(int(part) for part in version("ase").split(".")[:2])
+    except (PackageNotFoundError, ValueError):
+        return (0, 0)
+
+
+# keys of `lam_optimize.relaxer.OPTIMIZERS`
+OPTIMIZER_NAMES = ["FIRE", "BFGS", "LBFGS", "LBFGSLineSearch", "MDMin", "BFGSLineSearch"]
+PRECISIONS = ["float64", "mixed"]
+# keys of `lam_optimize.relaxer.CELL_FILTERS`, `FrechetCellFilter` requires ASE >= 3.23
+CELL_FILTER_NAMES = ["ExpCellFilter"] + (["FrechetCellFilter"] if _ase_version() >= (3, 23) else [])
+# keys of `lam_optimize.bench.CASES`
+BENCH_CASES = ["relax", "relax_run", "single_point", "dedup", "thermo"]
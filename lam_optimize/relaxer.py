@@ -13,10 +13,20 @@ from ase.optimize import (
     BFGSLineSearch,
     MDMin,
     )
+from ase.calculators.singlepoint import SinglePointCalculator
 from ase.constraints import ExpCellFilter
-import pickle
+try:
+    from ase.constraints import FixSymmetry
+except ImportError:  # ase < 3.23
+    from ase.spacegroup.symmetrize import FixSymmetry
+from lam_optimize.batch import calculate_batch
+from lam_optimize.metrics import METRICS
+from lam_optimize.models import default_device, get_calculator, model_id
+from lam_optimize.options import PRECISIONS
+from lam_optimize.result_cache import ResultCache, canonical_order, canonicalize_structure, reorder_structure
+from lam_optimize.strategy import STAGNATED, SWITCH, AdaptiveStrategy
 from pathlib import Path
-from typing import Optional, Union
+from typing import List, Optional, Union
 
 OPTIMIZERS = {
     "FIRE": FIRE,
@@ -26,6 +36,17 @@ OPTIMIZERS = {
     "MDMin": MDMin,
     "BFGSLineSearch": BFGSLineSearch,
 }
+# line search optimizers evaluate trial positions inside a single step,
+# so they cannot be driven by one batched evaluation per step
+LINE_SEARCH_OPTIMIZERS = (LBFGSLineSearch, BFGSLineSearch)
+CELL_FILTERS = {
+    "ExpCellFilter": ExpCellFilter,
+}
+try:
+    from ase.filters import FrechetCellFilter
+    CELL_FILTERS["FrechetCellFilter"] = FrechetCellFilter
+except ImportError:  # ase < 3.23
+    pass
 
 
 class Relaxer:
@@ -35,81 +56,648 @@ class Relaxer:
     ----------
     model: Union[Path, str]
         Indicates which calculator to use during relaxation, `mace` will call default MACE-medium model,
-        for DP model, a path to the freezed model is needed.
+        for DP model, a path to the freezed model is needed. `emt` uses the ASE EMT calculator as a cheap
+        stand-in for benchmarks.
     optimizer: str
-        The optimizer from ASE, supports `FIRE`, `BFGS`, `LBFGS`, `LBFGSLineSearch`, `MDMin`, `BFGSLineSearch`.
+        The optimizer from ASE, supports `FIRE`, `BFGS`, `LBFGS`, `LBFGSLineSearch`, `MDMin`, `BFGSLineSearch`,
+        or `adaptive` to switch optimizers during the relaxation following `strategy`.
     relax_cell: bool
-        Whether to relax cell with `ExpCellFilter`.
+        Whether to relax cell with `cell_filter`.
+    result_cache: Union[str, Path, ResultCache]
+        If set, results of `relax`, `relax_many` and `evaluate` are looked up in
+        and stored to this cache, keyed by the structure, the model and the settings.
+    strategy: AdaptiveStrategy
+        Settings of the `adaptive` optimizer, the defaults of `AdaptiveStrategy` if not given.
+    precision: str
+        `float64`, or `mixed` to relax with a float32 model until the max force drops
+        below `coarse_fmax` and converge with the float64 model from there. Final
+        energies and forces always come from the float64 model.
+    coarse_fmax: float
+        Force criteria in eV/A of the float32 stage of the `mixed` precision.
+    coarse_model: Path
+        Freezed float32 DP model of the float32 stage, required for the `mixed` precision
+        of a DP model, as the precision of a freezed DP model is fixed. MACE models are
+        loaded in float32, the EMT stand-in has no float32 variant and is used for both stages.
+    cell_filter: str
+        The cell filter from ASE, `ExpCellFilter` or, with ASE >= 3.23, `FrechetCellFilter`.
+    symmetry: bool
+        Whether to keep the space group of the input, detected with a tolerance of `symprec`,
+        with the ASE `FixSymmetry` constraint.
+    symprec: float
+        Symmetry tolerance in A.
+    primitive: bool
+        Whether to reduce periodic inputs to their primitive cell before relaxation,
+        the final structure and energy are then those of the primitive cell.
+    device: str
+        Device of MACE models, `cuda` if available by default.
+    lazy: bool
+        Whether to load the models on first use instead of on construction.
+    warmup: bool
+        Whether to evaluate a small structure right after loading the models.
+
+    Calculators are taken from the process-wide registry of `lam_optimize.models`,
+    so relaxers of the same model share one loaded calculator.
     """
-    def __init__(self, model: Union[str, Path], optimizer: Optional[str] = "BFGS" , relax_cell: Optional[bool] = True):
-        if isinstance(model, Path):
-            try:
-                from deepmd.calculator import DP as DPCalculator
-                self.calculator = DPCalculator(model)
-            except Exception as e:
-                raise ValueError(f"DP calculator load failed: {e}")
-        elif model == "mace":
-            import torch
-            from mace.calculators import mace_mp
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            MACE_CALC = mace_mp(model="medium", device=device, default_dtype="float64")
-            self.calculator=MACE_CALC
-        else:
-            raise NotImplementedError("Only DP calculator and MACE calculator are supported.")
-        
-        self.optimizer = OPTIMIZERS[optimizer]
+    def __init__(self, model: Union[str, Path], optimizer: Optional[str] = "BFGS" , relax_cell: Optional[bool] = True,
+                 result_cache: Optional[Union[str, Path, ResultCache]] = None, strategy: Optional[AdaptiveStrategy] = None,
+                 precision: Optional[str] = "float64", coarse_fmax: Optional[float] = 0.1, coarse_model: Optional[Path] = None,
+                 cell_filter: Optional[str] = "ExpCellFilter", symmetry: Optional[bool] = False, symprec: Optional[float] = 0.01,
+                 primitive: Optional[bool] = False, device: Optional[str] = None, lazy: Optional[bool] = False,
+                 warmup: Optional[bool] = False):
+        self.model = model
+        self.optimizer_name = optimizer
+        if optimizer == "adaptive":
+            strategy = strategy if strategy is not None else AdaptiveStrategy()
+            for name in strategy.optimizers:
+                if name not in OPTIMIZERS:
+                    raise ValueError(f"Unsupported optimizer {name} in the strategy, should be one of {list(OPTIMIZERS)}")
+        self.strategy = strategy if optimizer == "adaptive" else None
+        if isinstance(result_cache, (str, Path)):
+            result_cache = ResultCache(result_cache)
+        self.result_cache = result_cache
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision {precision}, should be one of {PRECISIONS}")
+        if cell_filter not in CELL_FILTERS:
+            raise ValueError(f"Unsupported cell filter {cell_filter} with ASE {ase.__version__}, should be one of {list(CELL_FILTERS)}")
+        self.cell_filter = cell_filter
+        self.symmetry = symmetry
+        self.symprec = symprec
+        self.primitive = primitive
+        self.precision = precision
+        self.coarse_fmax = coarse_fmax
+        self.coarse_model = coarse_model
+        if precision == "mixed" and isinstance(model, Path) and coarse_model is None:
+            raise ValueError("The mixed precision of a DP model needs a float32 DP model `coarse_model`")
+        self._device = device
+        self.lazy = lazy
+        self.warmup = warmup
+        self._calculator = None
+        self._coarse_calculator = None
+        self.optimizer = OPTIMIZERS[optimizer] if self.strategy is None else None
         self.relax_cell = relax_cell
         self.ase_adaptor = AseAtomsAdaptor()
-  
-    def relax(self, atoms, fmax: float, steps: int, traj_file: str = None):
+        if not lazy:
+            self.load()
+
+    def load(self) -> "Relaxer":
+        """Load the models unless already loaded"""
+        # both calculators of the `mixed` precision are loaded once and kept for all relaxations
+        if self._calculator is None:
+            self._calculator = get_calculator(self.model, "float64", self.device, self.warmup)
+        if self.precision == "mixed" and self._coarse_calculator is None:
+            self._coarse_calculator = get_calculator(self._coarse_source, "float32", self.device, self.warmup)
+        return self
+
+    @property
+    def calculator(self):
+        if self._calculator is None:
+            self.load()
+        return self._calculator
+
+    @property
+    def coarse_calculator(self):
+        """The float32 calculator of the `mixed` precision, `None` otherwise"""
+        if self.precision != "mixed":
+            return None
+        if self._coarse_calculator is None:
+            self.load()
+        return self._coarse_calculator
+
+    @property
+    def device(self) -> str:
+        if self._device is None:
+            self._device = default_device(self.model)
+        return self._device
+
+    @property
+    def _coarse_source(self) -> Union[str, Path]:
+        return Path(self.coarse_model) if isinstance(self.model, Path) else self.model
+
+    def __reduce__(self):
+        # calculators are not picklable, a relaxer sent to a worker process
+        # is rebuilt there from its construction arguments
+        return (self.__class__, (self.model, self.optimizer_name, self.relax_cell, self.result_cache, self.strategy,
+                                 self.precision, self.coarse_fmax, self.coarse_model, self.cell_filter, self.symmetry,
+                                 self.symprec, self.primitive, self._device, self.lazy, self.warmup))
+
+    @property
+    def model_id(self) -> str:
+        """Identity of the model, the hash of a DP model file or the name and dtype of a MACE model"""
+        return model_id(self.model, "float64")
 
+    @property
+    def coarse_model_id(self) -> Optional[str]:
+        """Identity of the float32 model of the `mixed` precision"""
+        if self.precision != "mixed":
+            return None
+        return model_id(self._coarse_source, "float32")
+
+    def _cache_key(self, atoms: ase.Atoms, settings: dict):
+        structure_hash, order = canonical_order(atoms)
+        return self.result_cache.make_key(structure_hash, self.model_id, settings), order
+
+    def _relax_settings(self, fmax: float, steps: int) -> dict:
+        settings = {"task": "relax", "optimizer": self.optimizer_name, "relax_cell": self.relax_cell, "fmax": fmax, "steps": steps}
+        if self.strategy is not None:
+            settings["strategy"] = self.strategy.as_dict()
+        if self.precision == "mixed":
+            settings["precision"] = {"coarse_model": self.coarse_model_id, "coarse_fmax": self.coarse_fmax}
+        if self.cell_filter != "ExpCellFilter":
+            settings["cell_filter"] = self.cell_filter
+        if self.symmetry:
+            settings["symprec"] = self.symprec
+        if self.primitive:
+            settings["primitive"] = True
+        return settings
+
+    def _prepare(self, atoms) -> ase.Atoms:
+        """Convert to `ase.Atoms`, reduced to the primitive cell if `primitive` is set"""
+        if self.primitive and isinstance(atoms, ase.Atoms) and atoms.pbc.all():
+            atoms = self.ase_adaptor.get_structure(atoms)
+        if isinstance(atoms, Structure) and self.primitive:
+            atoms = atoms.get_primitive_structure()
         if isinstance(atoms, (Structure, Molecule)):
             atoms = self.ase_adaptor.get_atoms(atoms)
-        atoms.set_calculator(self.calculator)
-        obs = TrajectoryObserver(atoms)
-        if self.relax_cell:
-            atoms = ExpCellFilter(atoms)
-        opt = self.optimizer(atoms)
-        opt.attach(obs)
-        opt.run(fmax=fmax, steps=steps)
-        obs()
-        if traj_file is not None:
-            obs.save(traj_file)
-        if isinstance(atoms, ExpCellFilter):
-            atoms = atoms.atoms
+        return atoms
+
+    def _filter(self, atoms: ase.Atoms):
+        """The object optimized, `atoms` or its cell filter"""
+        return CELL_FILTERS[self.cell_filter](atoms) if self.relax_cell else atoms
+
+    def _final_structure(self, atoms: ase.Atoms) -> dict:
+        # AseAtomsAdaptor only keeps FixAtoms and FixCartesian constraints
+        atoms.set_constraint([c for c in atoms.constraints if not isinstance(c, FixSymmetry)])
+        return self.ase_adaptor.get_structure(atoms).as_dict()
+
+    def _load_relaxation(self, key: str, order: np.ndarray, traj_file: Optional[str]):
+        cached = self.result_cache.get(key, order)
+        if cached is None:
+            return None
+        METRICS.count("result_cache_hits")
+        meta, arrays = cached
+        final_structure = reorder_structure(meta["final_structure"], order)
+        atoms = self.ase_adaptor.get_atoms(Structure.from_dict(final_structure))
+        atoms.calc = SinglePointCalculator(atoms, energy=float(arrays["energy"]), forces=arrays["forces"],
+                                           stress=arrays.get("stress"))
+        # only the final frame is known for a cached relaxation
+        obs = TrajectoryObserver(atoms, interval=0, compute_stress="stress" in arrays, traj_file=traj_file, max_frames=1)
+        obs.finalize()
+        return {
+            "final_structure": final_structure,
+            "trajectory": obs,
+            "converged": meta["converged"],
+            "steps": meta["steps"],
+            "stagnated": meta.get("stagnated", False),
+            "cached": True,
+        }
+
+    def _store_relaxation(self, key: str, order: np.ndarray, result: dict):
+        obs = result["trajectory"]
+        arrays = {"energy": obs.energies[-1], "forces": obs.forces[-1]}
+        if obs.stresses is not None:
+            arrays["stress"] = obs.stresses[-1]
+        meta = {
+            "final_structure": canonicalize_structure(result["final_structure"], order),
+            "converged": result["converged"],
+            "steps": result["steps"],
+            "stagnated": result["stagnated"],
+        }
+        self.result_cache.put(key, order, meta, arrays)
+
+    def relax(self, atoms, fmax: float, steps: int, traj_file: str = None, traj_interval: int = 1):
+        """
+        Relax a structure
+
+        Parameters:
+        ----------
+        atoms: Union[ase.Atoms, Structure, Molecule]
+            The structure to relax.
+        fmax: float
+            Force convergence criteria, in eV/A.
+        steps: int
+            Max steps allowed for relaxation.
+        traj_file: str
+            Path of the ASE trajectory file the frames are streamed to.
+        traj_interval: int
+            Record every `traj_interval`-th step, 0 to record only the final frame.
+            A result from the result cache only has its final frame.
+
+        Returns:
+        ----------
+        A dict with the keys `final_structure`, `trajectory`, `converged`,
+        `steps` and `stagnated`, whether the `adaptive` optimizer stopped the
+        relaxation early for lack of progress.
+        """
+        atoms = self._prepare(atoms)
+        if self.result_cache is None:
+            return self._relax(atoms, fmax, steps, traj_file, traj_interval)
+        key, order = self._cache_key(atoms, self._relax_settings(fmax, steps))
+        result = self._load_relaxation(key, order, traj_file)
+        if result is None:
+            result = self._relax(atoms, fmax, steps, traj_file, traj_interval)
+            self._store_relaxation(key, order, result)
+        return result
+
+    def _stages(self, fmax: float) -> list:
+        """The calculator and force criteria of each stage of a relaxation"""
+        if self.coarse_calculator is None:
+            return [(self.calculator, fmax)]
+        return [(self.coarse_calculator, max(self.coarse_fmax, fmax)), (self.calculator, fmax)]
+
+    def _relax(self, atoms: ase.Atoms, fmax: float, steps: int, traj_file: Optional[str], traj_interval: int):
+        with METRICS.timer("relax"):
+            if self.symmetry:
+                atoms.set_constraint(FixSymmetry(atoms, symprec=self.symprec))
+            obs = self._get_observer(atoms, steps, traj_file, traj_interval)
+            # each stage starts from the geometry of the previous one and
+            # gets the steps left by it
+            nsteps = 0
+            for i, (calculator, stage_fmax) in enumerate(self._stages(fmax)):
+                atoms.calc = calculator
+                if i > 0:
+                    obs.restage()
+                converged, stage_steps, stagnated = self._relax_stage(atoms, stage_fmax, steps - nsteps, obs)
+                if i > 0 and steps - nsteps <= 0:
+                    # the previous stage used all steps, the structure is only evaluated
+                    converged = False
+                nsteps += stage_steps
+            obs.finalize()
         return {
-            "final_structure": self.ase_adaptor.get_structure(atoms).as_dict(),
+            "final_structure": self._final_structure(atoms),
             "trajectory": obs,
+            "converged": converged,
+            "steps": nsteps,
+            "stagnated": stagnated,
         }
 
+    def _relax_stage(self, atoms: ase.Atoms, fmax: float, steps: int, obs: "TrajectoryObserver"):
+        # ASE optimizers take `steps=0` as no limit, a stage without steps
+        # left only evaluates the structure
+        if self.strategy is not None or steps <= 0:
+            relaxation = _Relaxation(self, atoms, fmax, steps, obs)
+            while relaxation.advance():
+                pass
+            return relaxation.converged, relaxation.nsteps, relaxation.stagnated
+        opt = self.optimizer(self._filter(atoms))
+        # model evaluations inside a step, e.g. of line searches, are timed as `model`
+        opt.step = METRICS.timed("optimizer", opt.step)
+        opt.attach(obs)
+        converged = opt.run(fmax=fmax, steps=steps)
+        METRICS.count("optimizer_steps", opt.nsteps)
+        return bool(converged), opt.nsteps, False
+
+    def _get_observer(self, atoms: ase.Atoms, steps: int, traj_file: Optional[str], traj_interval: int):
+        # stresses are only recorded when the cell is relaxed, otherwise they
+        # would cost an extra model evaluation per step
+        max_frames = steps // traj_interval + 2 if traj_interval > 0 else 1
+        return TrajectoryObserver(atoms, interval=traj_interval, compute_stress=self.relax_cell,
+                                  traj_file=traj_file, max_frames=max_frames)
+
+    def relax_many(
+        self,
+        structures: List[Union[ase.Atoms, Structure, Molecule]],
+        fmax: float,
+        steps: int,
+        traj_files: Optional[List[Optional[str]]] = None,
+        batch_size: Optional[int] = None,
+        traj_interval: int = 1,
+    ):
+        """
+        Relax several structures together, evaluating all unconverged structures
+        with one batched model call per optimization step. A structure is retired
+        from the batch as soon as it converges, reaches `steps` or, with the
+        `adaptive` optimizer, stagnates.
+
+        Parameters:
+        ----------
+        structures: List[Union[ase.Atoms, Structure, Molecule]]
+            Structures to relax.
+        fmax: float
+            Force convergence criteria, in eV/A.
+        steps: int
+            Max steps allowed for relaxation.
+        traj_files: List[Optional[str]]
+            Paths of the ASE trajectory files the frames of each structure are streamed to.
+        batch_size: int
+            Max number of structures evaluated in one model call, `None` for all.
+        traj_interval: int
+            Record every `traj_interval`-th step, 0 to record only the final frame.
+
+        Returns:
+        ----------
+        A list of results in the same format as `relax`, in input order.
+        """
+        if traj_files is None:
+            traj_files = [None] * len(structures)
+        structures = [self._prepare(atoms) for atoms in structures]
+        if self.result_cache is None:
+            return self._relax_many(structures, fmax, steps, traj_files, batch_size, traj_interval)
+
+        # only the structures missing in the cache are relaxed
+        keys = [self._cache_key(atoms, self._relax_settings(fmax, steps)) for atoms in structures]
+        results = [self._load_relaxation(key, order, traj_file) for (key, order), traj_file in zip(keys, traj_files)]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            relaxed = self._relax_many([structures[i] for i in missing], fmax, steps, [traj_files[i] for i in missing],
+                                       batch_size, traj_interval)
+            for i, result in zip(missing, relaxed):
+                self._store_relaxation(*keys[i], result)
+                results[i] = result
+        return results
+
+    def _relax_many(self, structures: List[ase.Atoms], fmax: float, steps: int, traj_files: List[Optional[str]],
+                    batch_size: Optional[int], traj_interval: int):
+        with METRICS.timer("relax"):
+            return self._relax_batched(structures, fmax, steps, traj_files, batch_size, traj_interval)
+
+    def _relax_batched(self, structures: List[ase.Atoms], fmax: float, steps: int, traj_files: List[Optional[str]],
+                       batch_size: Optional[int], traj_interval: int):
+        optimizers = [self.optimizer] if self.strategy is None else [OPTIMIZERS[name] for name in self.strategy.optimizers]
+        if any(optimizer in LINE_SEARCH_OPTIMIZERS for optimizer in optimizers):
+            return [self._relax(atoms, fmax, steps, traj_file, traj_interval)
+                    for atoms, traj_file in zip(structures, traj_files)]
+
+        if self.symmetry:
+            for atoms in structures:
+                atoms.set_constraint(FixSymmetry(atoms, symprec=self.symprec))
+        observers = [self._get_observer(atoms, steps, traj_file, traj_interval)
+                     for atoms, traj_file in zip(structures, traj_files)]
+        nsteps = [0] * len(structures)
+        for i, (calculator, stage_fmax) in enumerate(self._stages(fmax)):
+            if i > 0:
+                for obs in observers:
+                    obs.restage()
+            tasks = [
+                _Relaxation(self, atoms, stage_fmax, steps - n, obs)
+                for atoms, obs, n in zip(structures, observers, nsteps)
+            ]
+            active = tasks
+            while len(active) > 0:
+                self._calculate_batch([task.atoms for task in active], calculator, batch_size=batch_size)
+                active = [task for task in active if task.advance()]
+            if i > 0:
+                for task, n in zip(tasks, nsteps):
+                    if steps - n <= 0:
+                        task.converged = False
+            nsteps = [n + task.nsteps for n, task in zip(nsteps, tasks)]
+        results = []
+        for task, obs, n in zip(tasks, observers, nsteps):
+            obs.finalize()
+            results.append({
+                "final_structure": self._final_structure(task.atoms),
+                "trajectory": obs,
+                "converged": task.converged,
+                "steps": n,
+                "stagnated": task.stagnated,
+            })
+        return results
+
+    def evaluate(self, atoms_list: List[ase.Atoms], compute_stress: bool = False, batch_size: Optional[int] = None) -> List[dict]:
+        """
+        Evaluate energies, forces and optionally stresses of structures with
+        `calculate_batch`, taking the results in the result cache from there
+
+        Returns:
+        ----------
+        A list of dicts with keys `energy`, `forces` and `stress`, in input order.
+        """
+        if self.result_cache is None:
+            return calculate_batch(self.calculator, atoms_list, compute_stress=compute_stress, batch_size=batch_size)
+        settings = {"task": "single_point", "compute_stress": compute_stress}
+        keys = [self._cache_key(atoms, settings) for atoms in atoms_list]
+        results = []
+        for key, order in keys:
+            cached = self.result_cache.get(key, order)
+            results.append(None if cached is None else {name: value for name, value in cached[1].items()})
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            evaluated = calculate_batch(self.calculator, [atoms_list[i] for i in missing],
+                                        compute_stress=compute_stress, batch_size=batch_size)
+            for i, result in zip(missing, evaluated):
+                self.result_cache.put(*keys[i], meta={}, arrays=result)
+                results[i] = result
+        for result in results:
+            result["energy"] = float(result["energy"])
+        return results
+
+    def _calculate_batch(self, atoms_list: List[ase.Atoms], calculator=None, batch_size: Optional[int] = None):
+        """Evaluate all structures at once and attach the results as single point calculators"""
+        calculator = calculator if calculator is not None else self.calculator
+        results = calculate_batch(calculator, atoms_list, compute_stress=self.relax_cell, batch_size=batch_size)
+        for atoms, res in zip(atoms_list, results):
+            atoms.calc = SinglePointCalculator(
+                atoms,
+                energy=res["energy"],
+                free_energy=res["energy"],
+                forces=res["forces"],
+                stress=res.get("stress"),
+            )
+
+class _Relaxation:
+    """
+    A structure relaxed one step at a time, given the energy and forces of
+    its current positions, with the optimizer chosen by the strategy of the
+    relaxer if any
+    """
+    def __init__(self, relaxer: Relaxer, atoms: ase.Atoms, fmax: float, steps: int, obs: "TrajectoryObserver"):
+        self.relaxer = relaxer
+        self.atoms = atoms
+        self.target = relaxer._filter(atoms)
+        self.fmax = fmax
+        self.steps = steps
+        self.obs = obs
+        self.state = relaxer.strategy.start(len(atoms)) if relaxer.strategy is not None else None
+        # built before the first step, once the batched evaluation has attached
+        # a calculator, as e.g. FIRE and LBFGS evaluate the energy on creation
+        self.opt = None
+        self.nsteps = 0
+        self.converged = False
+        self.stagnated = False
+
+    def advance(self) -> bool:
+        """Take one step, returning whether the relaxation goes on"""
+        self.obs()
+        forces = self.target.get_forces()
+        fmax = np.sqrt((forces ** 2).sum(axis=1).max())
+        if fmax < self.fmax:
+            self.converged = True
+        elif self.nsteps < self.steps and self.state is not None:
+            action = self.state.update(self.atoms.get_potential_energy() / len(self.atoms), fmax)
+            if action == STAGNATED:
+                self.stagnated = True
+            elif action == SWITCH:
+                self.opt = OPTIMIZERS[self.state.optimizer](self.target)
+                METRICS.count("optimizer_switches")
+        if self.converged or self.stagnated or self.nsteps >= self.steps:
+            return False
+        if self.opt is None:
+            optimizer = self.relaxer.optimizer if self.state is None else OPTIMIZERS[self.state.optimizer]
+            self.opt = optimizer(self.target)
+        with METRICS.timer("optimizer"):
+            self.opt.step(forces)
+        self.nsteps += 1
+        METRICS.count("optimizer_steps")
+        return True
+
+
 class TrajectoryObserver:
     """
     Trajectory observer is a hook in the relaxation process that saves the
     intermediate structures
     """
 
-    def __init__(self, atoms: ase.Atoms):
+    def __init__(
+        self,
+        atoms: ase.Atoms,
+        interval: int = 1,
+        compute_stress: bool = True,
+        traj_file: Optional[str] = None,
+        max_frames: Optional[int] = None,
+        chunk_size: int = 64,
+    ):
         """
         Args:
             atoms (Atoms): the structure to observe
+            interval (int): record every `interval`-th observation, 0 to record
+                only the final frame given by `finalize`
+            compute_stress (bool): whether to record stresses, this costs an
+                extra model evaluation when the cell is not relaxed
+            traj_file (str): if set, recorded frames are streamed to this ASE
+                trajectory file as they come and only the energies and the last
+                frame are kept in memory
+            max_frames (int): number of frames to preallocate, e.g. `steps + 1`
+            chunk_size (int): number of frames the buffers grow by when full
         """
         self.atoms = atoms
-        self.energies: list[float] = []
-        self.forces: list[np.ndarray] = []
-        self.stresses: list[np.ndarray] = []
-        self.atom_positions: list[np.ndarray] = []
-        self.cells: list[np.ndarray] = []
+        self.interval = interval
+        self.compute_stress = compute_stress
+        self.chunk_size = chunk_size
+        self.ncalls = 0
+        self.nframes = 0
+        self._last_call = None
+        self._restage = False
+        # frame streamed on the next record, so that it can still be replaced
+        self._pending = None
+        natoms = len(atoms)
+        # streamed trajectories only keep the last frame of the per-atom arrays
+        capacity = max_frames if max_frames is not None else chunk_size
+        frame_capacity = 1 if traj_file is not None else capacity
+        self._energies = np.zeros(capacity)
+        self._forces = np.zeros((frame_capacity, natoms, 3))
+        self._stresses = np.zeros((frame_capacity, 6)) if compute_stress else None
+        self._atom_positions = np.zeros((frame_capacity, natoms, 3))
+        self._cells = np.zeros((frame_capacity, 3, 3))
+        self.streamed = traj_file is not None
+        self.writer = None
+        if traj_file is not None:
+            from ase.io.trajectory import Trajectory
+            self.writer = Trajectory(traj_file, "w")
 
     def __call__(self):
         """
         The logic for saving the properties of an Atoms during the relaxation
         Returns:
         """
-        self.energies.append(self.compute_energy())
-        self.forces.append(self.atoms.get_forces())
-        self.stresses.append(self.atoms.get_stress())
-        self.atom_positions.append(self.atoms.get_positions())
-        self.cells.append(self.atoms.get_cell()[:])
+        if self._restage:
+            self._restage = False
+            if self._last_call == self.ncalls:
+                # same geometry as the last frame, evaluated by the next stage
+                self.nframes -= 1
+                self._pending = None
+                self.record()
+                return
+        self.ncalls += 1
+        if self.interval > 0 and (self.ncalls - 1) % self.interval == 0:
+            self.record()
+
+    def restage(self):
+        """
+        Start another stage of the relaxation from the last observed geometry,
+        whose first observation replaces the last frame if it is recorded
+        """
+        self._restage = True
+
+    def record(self):
+        """Record the current frame"""
+        with METRICS.timer("trajectory"):
+            self._record()
+
+    def _record(self):
+        self._last_call = self.ncalls
+        energy = self.compute_energy()
+        forces = self.atoms.get_forces()
+        stress = self.atoms.get_stress() if self.compute_stress else None
+        positions = self.atoms.get_positions()
+        cell = self.atoms.get_cell()[:]
+
+        if self.nframes == len(self._energies):
+            self._energies = np.concatenate([self._energies, np.zeros(self.chunk_size)])
+        self._energies[self.nframes] = energy
+        if self.streamed:
+            i = 0
+            atoms = self.atoms.copy()
+            atoms.calc = SinglePointCalculator(atoms, energy=energy, forces=forces, stress=stress)
+            if self._pending is not None:
+                self.writer.write(self._pending)
+            self._pending = atoms
+        else:
+            i = self.nframes
+            if i == len(self._forces):
+                self._grow()
+        self._forces[i] = forces
+        if self.compute_stress:
+            self._stresses[i] = stress
+        self._atom_positions[i] = positions
+        self._cells[i] = cell
+        self.nframes += 1
+
+    def _grow(self):
+        def grow(array):
+            return np.concatenate([array, np.zeros((self.chunk_size,) + array.shape[1:])])
+        self._forces = grow(self._forces)
+        if self._stresses is not None:
+            self._stresses = grow(self._stresses)
+        self._atom_positions = grow(self._atom_positions)
+        self._cells = grow(self._cells)
+
+    def finalize(self):
+        """Record the final frame unless it is already recorded, and close the stream"""
+        if self._last_call != self.ncalls:
+            self.record()
+        if self.writer is not None:
+            if self._pending is not None:
+                self.writer.write(self._pending)
+                self._pending = None
+            self.writer.close()
+            self.writer = None
+
+    def _frames(self, array: np.ndarray) -> np.ndarray:
+        if array is None:
+            return None
+        if self.streamed:
+            # only the last frame is kept in memory
+            return array[:min(self.nframes, 1)]
+        return array[:self.nframes]
+
+    @property
+    def energies(self) -> np.ndarray:
+        return self._energies[:self.nframes]
+
+    @property
+    def forces(self) -> np.ndarray:
+        return self._frames(self._forces)
+
+    @property
+    def stresses(self) -> np.ndarray:
+        return self._frames(self._stresses)
+
+    @property
+    def atom_positions(self) -> np.ndarray:
+        return self._frames(self._atom_positions)
+
+    @property
+    def cells(self) -> np.ndarray:
+        return self._frames(self._cells)
 
     def compute_energy(self) -> float:
         """
@@ -121,21 +709,19 @@ class TrajectoryObserver:
 
     def save(self, filename: str):
         """
-        Save the trajectory to file
+        Save the recorded trajectory to a numpy `.npz` file
         Args:
             filename (str): filename to save the trajectory
         Returns:
         """
+        arrays = {
+            "energy": self.energies,
+            "forces": self.forces,
+            "atom_positions": self.atom_positions,
+            "cell": self.cells,
+            "atomic_number": self.atoms.get_atomic_numbers(),
+        }
+        if self.compute_stress:
+            arrays["stresses"] = self.stresses
         with open(filename, "wb") as f:
-            pickle.dump(
-                {
-                    "energy": self.energies,
-                    "forces": self.forces,
-                    "stresses": self.stresses,
-                    "atom_positions": self.atom_positions,
-                    "cell": self.cells,
-                    "atomic_number": self.atoms.get_atomic_numbers(),
-                },
-                f,
-            )
-
+            np.savez(f, **arrays)
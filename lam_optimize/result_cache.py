@@ -0,0 +1,167 @@
+"""Content-addressed cache of relaxation and single point results.
+
+Results are keyed by a canonical hash of the input structure, invariant to
+the order of atoms and to wrapping positions into the cell, combined with
+the identity of the model and the settings of the calculation. Per-atom
+arrays are stored in the canonical atom order and mapped back to the order
+of the structure looked up. Results are kept in a SQLite file, evicting the
+least recently used ones beyond a total size.
+"""
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import ase
+import numpy as np
+from pymatgen.core import Structure
+
+from lam_optimize.cache import DEFAULT_CACHE_DIR
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    meta TEXT NOT NULL,
+    arrays BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_accessed ON results (accessed);
+"""
+
+
+def canonical_order(atoms: ase.Atoms, decimals: int = 6) -> Tuple[str, np.ndarray]:
+    """
+    Hash a structure independently of the order of its atoms
+
+    Returns:
+    ----------
+    The hash, and the permutation sorting the atoms into the canonical order.
+    """
+    numbers = atoms.get_atomic_numbers()
+    cell = np.round(atoms.get_cell()[:], decimals) + 0.0
+    if atoms.pbc.any():
+        # wrapped after rounding, so that values rounded up to 1 become 0
+        coords = np.round(atoms.get_scaled_positions(wrap=True), decimals) % 1.0
+    else:
+        coords = np.round(atoms.get_positions(), decimals)
+    # adding 0.0 turns -0.0 into 0.0, which hashes differently
+    coords = coords + 0.0
+    order = np.lexsort((coords[:, 2], coords[:, 1], coords[:, 0], numbers))
+    h = hashlib.sha256()
+    h.update(numbers[order].astype(np.int64).tobytes())
+    h.update(coords[order].tobytes())
+    h.update(cell.tobytes())
+    h.update(np.asarray(atoms.pbc, dtype=bool).tobytes())
+    return h.hexdigest(), order
+
+
+def file_hash(path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """SQLite cache of results keyed by structure, model and settings
+
+    Parameters:
+    ----------
+    path: Union[str, Path]
+        Path to the SQLite file, created if it does not exist.
+    max_size: int
+        Max total size of the cached results in bytes.
+    """
+    def __init__(self, path: Union[str, Path] = DEFAULT_CACHE_DIR / "results.db", max_size: int = 1 << 30):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if self.path.parent != Path("."):
+            os.makedirs(self.path.parent, exist_ok=True)
+        with closing(self.connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def __reduce__(self):
+        return (self.__class__, (self.path, self.max_size))
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=60)
+
+    @staticmethod
+    def make_key(structure_hash: str, model_id: str, settings: dict) -> str:
+        return hashlib.sha256(
+            json.dumps([structure_hash, model_id, settings], sort_keys=True).encode()
+        ).hexdigest()
+
+    def get(self, key: str, order: np.ndarray) -> Optional[Tuple[dict, Dict[str, np.ndarray]]]:
+        """
+        Get the metadata and arrays of a result, with per-atom arrays (first
+        dimension of the number of atoms) mapped to the order given by the
+        canonical permutation `order` of the structure looked up
+        """
+        with closing(self.connect()) as conn:
+            with conn:
+                row = conn.execute("SELECT meta, arrays FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+        meta = json.loads(row[0])
+        with np.load(io.BytesIO(row[1]), allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        for name in meta.get("per_atom", []):
+            arrays[name] = arrays[name][inverse]
+        return meta, arrays
+
+    def put(self, key: str, order: np.ndarray, meta: dict, arrays: Dict[str, np.ndarray], per_atom=("forces",)):
+        """Store a result, with the per-atom arrays given in the order of the structure"""
+        arrays = {name: np.asarray(value)[order] if name in per_atom else np.asarray(value) for name, value in arrays.items()}
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        meta = {**meta, "per_atom": [name for name in per_atom if name in arrays]}
+        meta_str = json.dumps(meta)
+        blob = buffer.getvalue()
+        size = len(blob) + len(meta_str)
+        with self.lock, closing(self.connect()) as conn:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, meta, arrays, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, meta_str, blob, size, time.time()),
+                )
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_size:
+            return
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY accessed").fetchall():
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_size:
+                break
+
+    def __len__(self):
+        with closing(self.connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+def reorder_structure(structure: dict, order: np.ndarray) -> dict:
+    """Map the sites of a structure dict stored in canonical order back to the order given by `order`"""
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    s = Structure.from_dict(structure)
+    return Structure.from_sites([s[int(i)] for i in inverse]).as_dict()
+
+
+def canonicalize_structure(structure: dict, order: np.ndarray) -> dict:
+    s = Structure.from_dict(structure)
+    return Structure.from_sites([s[int(i)] for i in order]).as_dict()
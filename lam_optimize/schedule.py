@@ -0,0 +1,214 @@
+"""Cost estimation, ordering and sharding of relaxation tasks.
+
+The cost of relaxing a structure is estimated from its number of atoms,
+counted by a cheap scan of the CIF file without building a structure, with
+a power law `prefactor * natoms ** exponent`. The power law can be
+calibrated for a model from the run journal of a previous run.
+"""
+import heapq
+import json
+import os
+import shlex
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from pymatgen.core import Structure
+from pymatgen.core.operations import SymmOp
+
+_SYMOP_TAGS = ("_symmetry_equiv_pos_as_xyz", "_space_group_symop_operation_xyz")
+_FRACT_TAGS = ("_atom_site_fract_x", "_atom_site_fract_y", "_atom_site_fract_z")
+
+
+def _read_loops(cif: Union[str, Path]) -> List[Dict[str, List[str]]]:
+    """Read the loops of a CIF file as dicts of columns, ignoring everything else"""
+    loops = []
+    tags, values, in_header = [], [], False
+
+    def close_loop():
+        if tags:
+            n = len(values) // len(tags)
+            loops.append({tag: values[i:n * len(tags):len(tags)] for i, tag in enumerate(tags)})
+
+    with open(cif, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("loop_"):
+                close_loop()
+                tags, values, in_header = [], [], True
+            elif line.startswith("_") and in_header:
+                tags.append(line.split()[0].lower())
+            elif line.startswith("_") or line.startswith("data_"):
+                # a tag-value pair or a new block ends the loop
+                close_loop()
+                tags, values, in_header = [], [], False
+            elif tags:
+                in_header = False
+                try:
+                    values.extend(shlex.split(line))
+                except ValueError:
+                    values.extend(line.split())
+    close_loop()
+    return loops
+
+
+def _to_float(value: str) -> float:
+    # strip standard uncertainties like 0.1234(5)
+    return float(value.split("(")[0])
+
+
+def count_atoms(cif: Union[str, Path], tol: float = 1e-3) -> int:
+    """
+    Count the atoms in the cell of a CIF file without building a structure, by
+    applying its symmetry operations to the sites of its `_atom_site_` loop
+    """
+    loops = _read_loops(cif)
+    sites = next((loop for loop in loops if all(tag in loop for tag in _FRACT_TAGS)), None)
+    if sites is None:
+        # cartesian coordinates, assumed to be a P1 cell
+        sites = next((loop for loop in loops if "_atom_site_cartn_x" in loop), {})
+        return len(next(iter(sites.values()), []))
+    coords = np.array([[_to_float(v) for v in sites[tag]] for tag in _FRACT_TAGS]).T
+    symops = next((loop[tag] for loop in loops for tag in _SYMOP_TAGS if tag in loop), None)
+    if not symops or len(symops) == 1:
+        return len(coords)
+    ops = [SymmOp.from_xyz_str(op) for op in symops]
+    natoms = 0
+    for coord in coords:
+        images = np.array([op.operate(coord) for op in ops]) % 1.0
+        # positions are equal when their difference is close to an integer
+        unique = []
+        for image in images:
+            if not any(np.all(np.abs((image - u + 0.5) % 1.0 - 0.5) < tol) for u in unique):
+                unique.append(image)
+        natoms += len(unique)
+    return natoms
+
+
+class CostModel:
+    """Relaxation cost in seconds estimated as `prefactor * natoms ** exponent`
+
+    Parameters:
+    ----------
+    prefactor: float
+        Cost of a one-atom structure.
+    exponent: float
+        Scaling with the number of atoms.
+    """
+    def __init__(self, prefactor: float = 1.0, exponent: float = 1.0):
+        self.prefactor = prefactor
+        self.exponent = exponent
+
+    def __call__(self, natoms: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+        return self.prefactor * np.asarray(natoms, dtype=float) ** self.exponent
+
+    @classmethod
+    def fit(cls, natoms: Sequence[int], seconds: Sequence[float]) -> "CostModel":
+        """Fit the power law to measured relaxation times by least squares in log space"""
+        natoms = np.asarray(natoms, dtype=float)
+        seconds = np.asarray(seconds, dtype=float)
+        mask = (natoms > 0) & (seconds > 0)
+        if len(np.unique(natoms[mask])) < 2:
+            raise ValueError("At least two different structure sizes are needed to fit the cost model")
+        exponent, log_prefactor = np.polyfit(np.log(natoms[mask]), np.log(seconds[mask]), 1)
+        return cls(float(np.exp(log_prefactor)), float(exponent))
+
+    @classmethod
+    def from_journal(cls, journal: Union[str, Path]) -> "CostModel":
+        """Fit the power law to the relaxation times recorded in a run journal"""
+        from lam_optimize.journal import RunJournal
+
+        natoms, seconds = [], []
+        for record in RunJournal(journal).load().values():
+            if record.get("status") == "relaxed" and record.get("relax_time"):
+                natoms.append(len(Structure.from_dict(record["initial_structure"])))
+                seconds.append(record["relax_time"])
+        return cls.fit(natoms, seconds)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "CostModel":
+        with open(path, "r") as f:
+            return cls(**json.load(f))
+
+    def save(self, path: Union[str, Path]):
+        with open(path, "w") as f:
+            json.dump({"prefactor": self.prefactor, "exponent": self.exponent}, f, indent=4)
+
+
+def estimate_costs(cifs: Sequence[Path], cost_model: Optional[CostModel] = None) -> np.ndarray:
+    """Estimate the relaxation cost of each CIF file, unreadable files cost 0"""
+    cost_model = cost_model or CostModel()
+    natoms = []
+    for cif in cifs:
+        try:
+            natoms.append(count_atoms(cif))
+        except (OSError, ValueError, IndexError):
+            natoms.append(0)
+    return cost_model(np.array(natoms))
+
+
+def sort_by_cost(cifs: Sequence[Path], cost_model: Optional[CostModel] = None) -> List[Path]:
+    """Order CIF files longest first, so that long tasks do not finish last"""
+    costs = estimate_costs(cifs, cost_model)
+    # stable, so that files of equal cost keep their order
+    return [cifs[i] for i in np.argsort(-costs, kind="stable")]
+
+
+def shard(cifs: Sequence[Path], n: int, cost_model: Optional[CostModel] = None) -> List[List[Path]]:
+    """
+    Split CIF files into `n` shards of balanced total cost, assigning files
+    longest first to the currently cheapest shard
+    """
+    if n <= 0:
+        raise ValueError(f"The number of shards should be positive, got {n}")
+    costs = estimate_costs(cifs, cost_model)
+    shards = [[] for _ in range(n)]
+    heap = [(0.0, i) for i in range(n)]
+    for j in np.argsort(-costs, kind="stable"):
+        total, i = heapq.heappop(heap)
+        shards[i].append(cifs[j])
+        heapq.heappush(heap, (total + costs[j], i))
+    return shards
+
+
+def write_shards(
+    fpths: Sequence[Path],
+    n: int,
+    output: Path,
+    cost_model: Optional[CostModel] = None,
+) -> List[Path]:
+    """
+    Split the CIF files under `fpths` into `n` balanced shard folders
+    `output/shard<i>`, hard linking the files when possible
+
+    Returns:
+    ----------
+    The shard folders, skipping empty ones.
+    """
+    if n <= 0:
+        raise ValueError(f"The number of shards should be positive, got {n}")
+    cifs = [cif for fpth in fpths for cif in sorted(Path(fpth).rglob("*.cif"))]
+    names: Dict[str, Path] = {}
+    for cif in cifs:
+        if cif.name in names:
+            raise ValueError(f"Duplicate CIF file name {cif.name} in {names[cif.name]} and {cif}")
+        names[cif.name] = cif
+    folders = []
+    for i, files in enumerate(shard(cifs, n, cost_model)):
+        if not files:
+            continue
+        folder = Path(output) / f"shard{i}"
+        os.makedirs(folder, exist_ok=True)
+        for cif in files:
+            target = folder / cif.name
+            if target.exists():
+                os.remove(target)
+            try:
+                os.link(cif, target)
+            except OSError:
+                shutil.copy(cif, target)
+        folders.append(folder)
+    return folders
@@ -0,0 +1,137 @@
+"""Adaptive choice of the optimizer during a relaxation.
+
+A relaxation starts with a robust optimizer (FIRE), which copes with the
+large forces of a far-from-relaxed structure, and switches to a
+quasi-Newton optimizer once the max force drops below `switch_fmax`. Dense
+BFGS keeps a (3N x 3N) Hessian, so structures of more than `large_natoms`
+atoms use LBFGS instead. A relaxation whose energy and max force stop
+improving over `window` steps is stopped early and reported unconverged.
+"""
+from collections import deque
+
+# actions returned by `StrategyState.update`
+CONTINUE = "continue"
+SWITCH = "switch"
+STAGNATED = "stagnated"
+
+
+class StagnationMonitor:
+    """Detect relaxations that stopped making progress
+
+    Parameters:
+    ----------
+    window: int
+        Number of steps the progress is measured over.
+    energy_tol: float
+        Min decrease of the energy per atom over the window, in eV/atom.
+    fmax_tol: float
+        Min relative decrease of the max force over the window.
+    """
+    def __init__(self, window: int = 20, energy_tol: float = 1e-5, fmax_tol: float = 0.05):
+        self.window = window
+        self.energy_tol = energy_tol
+        self.fmax_tol = fmax_tol
+        self.energies = deque(maxlen=window + 1)
+        self.fmaxs = deque(maxlen=window + 1)
+
+    def reset(self):
+        self.energies.clear()
+        self.fmaxs.clear()
+
+    def update(self, energy_per_atom: float, fmax: float) -> bool:
+        """Add a step, returning whether the relaxation has stagnated"""
+        self.energies.append(energy_per_atom)
+        self.fmaxs.append(fmax)
+        if len(self.energies) <= self.window:
+            return False
+        energies, fmaxs = list(self.energies), list(self.fmaxs)
+        energy_drop = energies[0] - min(energies[1:])
+        fmax_drop = 1 - min(fmaxs[1:]) / fmaxs[0] if fmaxs[0] > 0 else 0.0
+        return energy_drop < self.energy_tol and fmax_drop < self.fmax_tol
+
+
+class AdaptiveStrategy:
+    """Settings of the adaptive optimizer, selected by `Relaxer(optimizer="adaptive")`
+
+    Parameters:
+    ----------
+    coarse: str
+        Optimizer far from the minimum.
+    fine: str
+        Optimizer near the minimum, e.g. `BFGS` or `BFGSLineSearch`.
+    large_fine: str
+        Optimizer near the minimum for structures of more than `large_natoms` atoms.
+    large_natoms: int
+        Number of atoms above which `large_fine` is used.
+    switch_fmax: float
+        Max force in eV/A below which the optimizer is switched to `fine`.
+    window: int
+        Number of steps of `StagnationMonitor`, 0 to never stop early.
+    energy_tol: float
+        Min decrease of the energy per atom over `window` steps, in eV/atom.
+    fmax_tol: float
+        Min relative decrease of the max force over `window` steps.
+    """
+    def __init__(
+        self,
+        coarse: str = "FIRE",
+        fine: str = "BFGS",
+        large_fine: str = "LBFGS",
+        large_natoms: int = 200,
+        switch_fmax: float = 0.2,
+        window: int = 20,
+        energy_tol: float = 1e-5,
+        fmax_tol: float = 0.05,
+    ):
+        self.coarse = coarse
+        self.fine = fine
+        self.large_fine = large_fine
+        self.large_natoms = large_natoms
+        self.switch_fmax = switch_fmax
+        self.window = window
+        self.energy_tol = energy_tol
+        self.fmax_tol = fmax_tol
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+    @property
+    def optimizers(self):
+        return [self.coarse, self.fine, self.large_fine]
+
+    def start(self, natoms: int) -> "StrategyState":
+        """Start the relaxation of a structure of `natoms` atoms"""
+        return StrategyState(self, natoms)
+
+
+class StrategyState:
+    """Optimizer and progress of one relaxation following an `AdaptiveStrategy`"""
+    def __init__(self, strategy: AdaptiveStrategy, natoms: int):
+        self.strategy = strategy
+        self.optimizer = strategy.coarse
+        self.fine = strategy.large_fine if natoms > strategy.large_natoms else strategy.fine
+        self.switched = False
+        self.monitor = StagnationMonitor(strategy.window, strategy.energy_tol, strategy.fmax_tol) if strategy.window > 0 else None
+
+    def update(self, energy_per_atom: float, fmax: float) -> str:
+        """
+        Update with the current step before it is taken
+
+        Returns:
+        ----------
+        `SWITCH` if the optimizer is switched to `self.optimizer`, `STAGNATED`
+        if the relaxation should stop, `CONTINUE` otherwise.
+        """
+        action = CONTINUE
+        if not self.switched and fmax < self.strategy.switch_fmax:
+            self.switched = True
+            if self.fine != self.optimizer:
+                action = SWITCH
+            self.optimizer = self.fine
+            # the new optimizer starts from scratch, e.g. with a fresh Hessian,
+            # and gets a whole window to make progress
+            if self.monitor is not None:
+                self.monitor.reset()
+        if self.monitor is not None and self.monitor.update(energy_per_atom, fmax):
+            return STAGNATED
+        return action
@@ -0,0 +1,147 @@
+"""Formation energies and energies above hull for many structures at once.
+
+Formation energies are computed from an array of elemental reference energies
+indexed by atomic number. Energies above hull are grouped by chemical system,
+so that each phase diagram is loaded once, and by composition, so that each
+hull energy is computed once.
+"""
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+from ase import Atoms
+from pymatgen.analysis.phase_diagram import PhaseDiagram
+from pymatgen.core import Composition, Element, Structure
+
+from lam_optimize.utils import ENERGY_REF, query_hull_by_composition
+
+CompositionLike = Union[Composition, Structure, Atoms, str]
+
+
+def get_ref_array(ref: Dict[str, float] = ENERGY_REF) -> np.ndarray:
+    """Elemental reference energies indexed by atomic number, NaN for missing elements"""
+    ref_array = np.full(119, np.nan)
+    for symbol, energy in ref.items():
+        ref_array[Element(symbol).Z] = energy
+    return ref_array
+
+
+REF_ARRAY = get_ref_array()
+
+
+def _composition(composition: CompositionLike) -> Composition:
+    if isinstance(composition, Composition):
+        return composition
+    if isinstance(composition, Structure):
+        return composition.composition
+    if isinstance(composition, Atoms):
+        return Composition(composition.get_chemical_formula())
+    return Composition(composition)
+
+
+def _element_counts(compositions: List[Composition]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Flatten compositions into (row index, atomic number, amount) arrays"""
+    rows, numbers, amounts = [], [], []
+    for i, comp in enumerate(compositions):
+        for el, amt in comp.items():
+            rows.append(i)
+            numbers.append(el.Z)
+            amounts.append(amt)
+    return np.array(rows, dtype=int), np.array(numbers, dtype=int), np.array(amounts, dtype=float)
+
+
+def get_e_form_per_atom_batch(
+    compositions: Sequence[CompositionLike],
+    energies: Sequence[float],
+    ref: Union[Dict[str, float], np.ndarray] = REF_ARRAY,
+) -> np.ndarray:
+    """
+    Vectorized version of `utils.get_e_form_per_atom`
+
+    Parameters:
+    ----------
+    compositions: Sequence
+        Compositions of the structures, as `Composition`, `Structure`, `Atoms`
+        or formula strings.
+    energies: Sequence[float]
+        Total energies of the structures.
+    ref: Union[Dict[str, float], np.ndarray]
+        Elemental reference energies, as a dict or an array from `get_ref_array`.
+
+    Returns:
+    ----------
+    Formation energies per atom, NaN for structures with elements missing in `ref`.
+    """
+    if isinstance(ref, dict):
+        ref = get_ref_array(ref)
+    compositions = [_composition(comp) for comp in compositions]
+    rows, numbers, amounts = _element_counts(compositions)
+    n = len(compositions)
+    e_ref = np.bincount(rows, weights=amounts * ref[numbers], minlength=n)
+    natoms = np.bincount(rows, weights=amounts, minlength=n)
+    missing = np.isnan(e_ref)
+    if missing.any():
+        logging.warn(f"No reference energy for the elements of {missing.sum()} structures")
+    return (np.asarray(energies, dtype=float) - e_ref) / natoms
+
+
+def get_e_above_hull_batch(
+    compositions: Sequence[CompositionLike],
+    e_form_per_atom: Sequence[float],
+    query_hull: Callable[[List[str]], PhaseDiagram] = query_hull_by_composition,
+    on_error: str = "raise",
+) -> np.ndarray:
+    """
+    Batch version of `utils.get_e_above_hull`, loading the phase diagram of
+    each chemical system once
+
+    Parameters:
+    ----------
+    compositions: Sequence
+        Compositions of the structures, as `Composition`, `Structure`, `Atoms`
+        or formula strings.
+    e_form_per_atom: Sequence[float]
+        Formation energies per atom, e.g. from `get_e_form_per_atom_batch`.
+    query_hull: Callable
+        Get the phase diagram of a list of elements.
+    on_error: str
+        `raise` to raise errors of querying a phase diagram or decomposing a
+        composition, `ignore` to return NaN for the affected structures.
+
+    Returns:
+    ----------
+    Energies above hull per atom. Structures below the hull get 0 like in
+    `utils.get_e_above_hull`.
+    """
+    if on_error not in ("raise", "ignore"):
+        raise ValueError(f"Unsupported on_error {on_error}, should be `raise` or `ignore`")
+    compositions = [_composition(comp) for comp in compositions]
+    e_form_per_atom = np.asarray(e_form_per_atom, dtype=float)
+    e_above_hull = np.full(len(compositions), np.nan)
+
+    groups = defaultdict(lambda: defaultdict(list))
+    for i, comp in enumerate(compositions):
+        chemsys = tuple(sorted(el.symbol for el in comp.elements))
+        groups[chemsys][comp.reduced_composition].append(i)
+
+    for chemsys, members in groups.items():
+        try:
+            hull = query_hull(list(chemsys))
+        except Exception as e:
+            if on_error == "raise":
+                raise
+            logging.warn(f"Failed to get the hull of {'-'.join(chemsys)}: {e}")
+            continue
+        for comp, indices in members.items():
+            try:
+                hull_energy = hull.get_hull_energy_per_atom(comp)
+            except Exception as e:
+                if on_error == "raise":
+                    raise RuntimeError("Error in getting energy above hull") from e
+                logging.warn(f"Failed to decompose {comp.reduced_formula}: {e}")
+                continue
+            e = e_form_per_atom[indices] - hull_energy
+            # below the hull within the numerical tolerance or not at all
+            e_above_hull[indices] = np.where(e >= -PhaseDiagram.numerical_tol, e, 0.0)
+    return e_above_hull
@@ -1,15 +1,17 @@
+import functools
 import gzip
-import json
 import os
 import pickle
-import requests
 import shutil
 from ase import Atoms
+from lam_optimize.cache import DEFAULT_CACHE_DIR, DiskCache, KeyedLock, LRUCache
+from lam_optimize.client import DEFAULT_TIMEOUT, get_session, request_json
+from lam_optimize.metrics import METRICS
 from pymatgen.analysis.phase_diagram import PDEntry, PhaseDiagram
 from pymatgen.analysis.structure_matcher import StructureMatcher
 from pymatgen.core import Composition, Element, Structure
 from pymatgen.io.cif import CifParser
-from multiprocessing import Process
+from pathlib import Path
 from typing import Dict, List
 
 MATCHER = StructureMatcher(ltol=0.05, stol=0.1, angle_tol=5)
@@ -126,30 +128,21 @@ def read_file(fpth: str):
 
 
 def validate_cif(fpth: str, timeout: int=3):
-    p = Process(target=read_file, args=(fpth,))
-    p.start()
-    p.join(timeout)
-    if p.exitcode is None:
-        p.kill()
+    # parsed in the persistent worker pool of `lam_optimize.validation`
+    from lam_optimize.validation import get_validator
+
+    with METRICS.timer("cif_validate"):
+        result = get_validator().validate([fpth], timeout=timeout)[0]
+    if result["status"] == "timeout":
         raise TimeoutError("Timeout to validate CIF file")
-    elif p.exitcode != 0:
-        raise ValueError("CIF file %s is not valid" % fpth)
+    elif result["status"] != "pass":
+        raise ValueError("CIF file %s is not valid: %s" % (fpth, result["reason"]))
 
 
 def query_hull_url_by_composition(composition: str) -> str:
-    access_key = os.environ.get("BOHRIUM_ACCESS_KEY")
     query_url = os.environ.get("OPENLAM_HULL_QUERY_URL", "http://openapi.dp.tech/openapi/v1/structures/query_hull_by_composition")
     query_url += "/" + composition
-    headers = {
-        "Content-type": "application/json",
-    }
-    params = {
-        "accessKey": access_key,
-    }
-    rsp = requests.get(query_url, headers=headers, params=params)
-    if rsp.status_code != 200:
-        raise RuntimeError("Response code %s: %s" % (rsp.status_code, rsp.text))
-    res = json.loads(rsp.text)
+    res = request_json(query_url)
     if res["code"] == 148888:
         raise RuntimeError("Hull of composition '%s' not found" % composition)
     elif res["code"] != 0:
@@ -158,18 +151,43 @@ def query_hull_url_by_composition(composition: str) -> str:
     return data["hull"]
 
 
-def query_hull_by_composition(elements: List[str]) -> PhaseDiagram:
-    composition = "".join(map(str, sorted(map(Element, elements))))
+HULL_CACHE = DiskCache(
+    DEFAULT_CACHE_DIR / "hulls",
+    max_size=int(float(os.environ.get("OPENLAM_HULL_CACHE_SIZE", 2048)) * 1024 ** 2),
+    max_age=float(os.environ.get("OPENLAM_HULL_MAX_AGE", 7 * 24 * 3600)),
+)
+HULL_MEMORY_CACHE = LRUCache(maxsize=int(os.environ.get("OPENLAM_HULL_MEMORY_CACHE", 32)))
+_hull_locks = KeyedLock()
+
+
+def _download_hull(composition: str, file_path: Path):
     hull_url = query_hull_url_by_composition(composition)
-    file_path = hull_url.split("?")[0].split("%2F")[-1]
-    sess = requests.session()
-    with sess.get(hull_url, stream=True, verify=False) as req:
+    sess = get_session()
+    with sess.get(hull_url, stream=True, verify=False, timeout=DEFAULT_TIMEOUT) as req:
         req.raise_for_status()
-        with open(file_path, 'w') as f:
-            shutil.copyfileobj(req.raw, f.buffer)
-    with gzip.open(file_path, "rb") as zip_file:
-        pd_hull = pickle.load(zip_file)
-    os.remove(file_path)
+        with open(file_path, "wb") as f:
+            shutil.copyfileobj(req.raw, f)
+
+
+def query_hull_by_composition(elements: List[str]) -> PhaseDiagram:
+    """
+    Get the phase diagram of a chemical system. Phase diagrams are kept in an
+    in-memory LRU cache and the downloaded files in `OPENLAM_CACHE_DIR`, which
+    are refreshed after `OPENLAM_HULL_MAX_AGE` seconds (default 7 days) and
+    evicted beyond `OPENLAM_HULL_CACHE_SIZE` MB (default 2048).
+    """
+    composition = "".join(map(str, sorted(map(Element, elements))))
+    pd_hull = HULL_MEMORY_CACHE.get(composition)
+    if pd_hull is not None:
+        return pd_hull
+    # concurrent callers of the same chemical system share one download
+    with _hull_locks(composition), METRICS.timer("hull_query"):
+        pd_hull = HULL_MEMORY_CACHE.get(composition)
+        if pd_hull is None:
+            file_path = HULL_CACHE.get(f"{composition}.pkl.gz", functools.partial(_download_hull, composition))
+            with gzip.open(file_path, "rb") as zip_file:
+                pd_hull = pickle.load(zip_file)
+            HULL_MEMORY_CACHE.put(composition, pd_hull)
     return pd_hull
 
 
@@ -0,0 +1,180 @@
+"""Validation of CIF files in a pool of persistent worker processes.
+
+Parsing a broken CIF file may hang, so each file is parsed in a worker
+process under a timeout. Workers are started once and reused; a worker
+exceeding the timeout of its task is killed and replaced.
+"""
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import List, Optional, Union
+
+from lam_optimize.utils import read_file
+
+
+def _worker_loop(conn):
+    while True:
+        try:
+            path = conn.recv()
+        except EOFError:
+            break
+        if path is None:
+            break
+        try:
+            read_file(path)
+            conn.send(("pass", None))
+        except Exception as e:
+            conn.send(("fail", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_loop, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.deadline = None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class CIFValidator:
+    """Validate CIF files in a pool of persistent worker processes
+
+    Each result is a dict with the keys `path`, `status` (`pass`, `fail` or
+    `timeout`) and `reason` (`None` if passed).
+
+    Parameters:
+    ----------
+    workers: int
+        Number of worker processes.
+    timeout: float
+        Default timeout in seconds to parse one file.
+    """
+    def __init__(self, workers: Optional[int] = None, timeout: float = 3):
+        self.nworkers = workers or min(4, os.cpu_count() or 1)
+        self.timeout = timeout
+        self.tasks = queue.Queue()
+        self.workers: List[_Worker] = []
+        self.closed = False
+        self.dispatcher = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The validator is closed")
+            if self.dispatcher is None:
+                self.workers = [_Worker() for _ in range(self.nworkers)]
+                self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+                self.dispatcher.start()
+
+    def submit(self, path: Union[str, Path], timeout: Optional[float] = None) -> Future:
+        """Submit a file, returning a future of its result"""
+        self._start()
+        future = Future()
+        self.tasks.put((str(path), timeout or self.timeout, future))
+        return future
+
+    def validate(self, paths: List[Union[str, Path]], timeout: Optional[float] = None) -> List[dict]:
+        """Validate files in parallel, returning their results in the same order"""
+        futures = [self.submit(path, timeout) for path in paths]
+        return [future.result() for future in futures]
+
+    def _finish(self, worker: _Worker, status: str, reason: Optional[str]):
+        path, _, future = worker.task
+        worker.task = None
+        worker.deadline = None
+        future.set_result({"path": path, "status": status, "reason": reason})
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        new_worker = _Worker()
+        self.workers[self.workers.index(worker)] = new_worker
+        return new_worker
+
+    def _dispatch(self):
+        while True:
+            # assign queued tasks to idle workers
+            for worker in self.workers:
+                if worker.task is not None:
+                    continue
+                try:
+                    task = self.tasks.get_nowait() if any(w.task for w in self.workers) else self.tasks.get()
+                except queue.Empty:
+                    break
+                if task is None:
+                    return
+                worker.task = task
+                worker.deadline = time.monotonic() + task[1]
+                worker.conn.send(task[0])
+            busy = [worker for worker in self.workers if worker.task is not None]
+            if not busy:
+                continue
+            now = time.monotonic()
+            # also wake up regularly to pick up new tasks for idle workers
+            wait_time = max(0, min(min(w.deadline for w in busy) - now, 0.05))
+            ready = wait([w.conn for w in busy], timeout=wait_time)
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        status, reason = worker.conn.recv()
+                    except (EOFError, OSError):
+                        worker.process.join()
+                        self._finish(worker, "fail", f"Worker exited with code {worker.process.exitcode}")
+                        self._replace(worker)
+                        continue
+                    self._finish(worker, status, reason)
+                elif time.monotonic() > worker.deadline:
+                    self._finish(worker, "timeout", "Timeout to validate CIF file")
+                    self._replace(worker)
+
+    def close(self):
+        """Stop the workers, cancelling the pending tasks"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        if self.dispatcher is not None:
+            while True:
+                try:
+                    task = self.tasks.get_nowait()
+                except queue.Empty:
+                    break
+                task[2].cancel()
+            self.tasks.put(None)
+            self.dispatcher.join()
+        for worker in self.workers:
+            if worker.task is not None:
+                worker.task[2].cancel()
+            worker.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_validator() -> CIFValidator:
+    """Get the validator shared in the current process, started on first use"""
+    global _validator
+    with _validator_lock:
+        if _validator is None or _validator.closed:
+            _validator = CIFValidator()
+            atexit.register(_validator.close)
+        return _validator
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from typing import List, Literal, Optional
 
@@ -8,6 +9,19 @@ from dflow.plugins.dispatcher import DispatcherExecutor
 from dflow.python import OP, Artifact, Parameter, PythonOPTemplate, Slices
 from lam_optimize.main import relax_run
 from lam_optimize.relaxer import Relaxer
+from lam_optimize.schedule import CostModel, write_shards
+
+
+JOURNAL = "relax_journal.jsonl"
+
+
+def _collect_journal(journal: Path, output: Path):
+    # a journal file, or the journals of the slices of an earlier workflow
+    files = sorted(journal.rglob("*.jsonl")) if journal.is_dir() else [journal]
+    with open(output, "w") as f:
+        for file in files:
+            text = file.read_text()
+            f.write(text if text.endswith("\n") or not text else text + "\n")
 
 
 @OP.function
@@ -15,22 +29,29 @@ def relax(
         cif_folder: Artifact(Path),
         type: str,
         model: Artifact(Path, optional=True),
+        journal: Artifact(Path, optional=True),
         config: Parameter(dict, default={}),
+        resume: Parameter(bool, default=False),
 ) -> {
     "res": Artifact(Path),
     "relaxed_cifs": Artifact(Path),
     "unconverged_cifs": Artifact(Path),
+    "journal": Artifact(Path),
 }:
     if type == "DP":
         relaxer = Relaxer(model)
     elif type == "mace":
         relaxer = Relaxer("mace")
+    if resume and journal is not None:
+        _collect_journal(journal, Path(JOURNAL))
+    config = {**config, "journal": Path(JOURNAL), "resume": resume}
     res_df = relax_run(cif_folder, relaxer, **config)
     res_df.to_json("results.json")
     return {
         "res": Path("results.json"),
         "relaxed_cifs": Path("relaxed"),
         "unconverged_cifs": Path("unconverged"),
+        "journal": Path(JOURNAL),
     }
 
 
@@ -39,9 +60,25 @@ def get_relax_workflow(
         cif_folders: List[Path],
         type: Literal["DP", "mace"],
         model: Optional[Path] = None,
+        shards: Optional[int] = None,
+        cost_model: Optional[CostModel] = None,
+        journal: Optional[Path] = None,
 ) -> Workflow:
-    cif_art = upload_artifact(cif_folders)
+    """
+    Build a workflow relaxing each CIF folder in a parallel slice. If `shards`
+    is set, the CIF files of all folders are first split into this many
+    folders of balanced estimated cost, see `lam_optimize.schedule.shard`.
+    If `journal` is set, a run journal or a directory of the journals of an
+    earlier workflow, every slice resumes from the records of its structures.
+    """
+    if shards is not None:
+        with tempfile.TemporaryDirectory() as tmp:
+            cif_folders = write_shards(cif_folders, shards, Path(tmp), cost_model)
+            cif_art = upload_artifact(cif_folders)
+    else:
+        cif_art = upload_artifact(cif_folders)
     model_art = upload_artifact(model) if model is not None else None
+    journal_art = upload_artifact(journal) if journal is not None else None
     executor = config.get("executor")
     if executor is not None:
         executor = DispatcherExecutor(**executor)
@@ -58,7 +95,7 @@ def get_relax_workflow(
             python_packages=lam_optimize.__path__,
             slices=Slices(
                 input_artifact=["cif_folder"],
-                output_artifact=["res", "relaxed_cifs", "unconverged_cifs"],
+                output_artifact=["res", "relaxed_cifs", "unconverged_cifs", "journal"],
                 create_dir=True,
                 **config.get("slices_config", {}),
             ),
@@ -68,10 +105,12 @@ def get_relax_workflow(
         parameters={
             "type": type,
             "config": config.get("inputs", {}),
+            "resume": journal is not None,
         },
         artifacts={
             "cif_folder": cif_art,
             "model": model_art,
+            "journal": journal_art,
         },
         executor=executor,
         with_param=range(len(cif_folders)),
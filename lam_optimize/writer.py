@@ -0,0 +1,159 @@
+"""Writers appending per-structure records to a file while a run progresses."""
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from monty.json import MontyEncoder
+
+
+class JsonlWriter:
+    """Write each record as one JSON line, flushed as soon as it is written
+
+    Parameters:
+    ----------
+    path: Union[str, Path]
+        Path to the output `.jsonl` file.
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        os.makedirs(self.path.parent, exist_ok=True)
+        self.file = open(self.path, "w")
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record, cls=MontyEncoder) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ParquetWriter:
+    """Write records to a Parquet file in row groups of `chunk_size` records
+
+    Nested values such as structure dicts are stored as JSON strings.
+
+    Parameters:
+    ----------
+    path: Union[str, Path]
+        Path to the output `.parquet` file.
+    chunk_size: int
+        Number of records buffered in memory before a row group is written.
+    schema: Dict[str, str]
+        Column names and pyarrow type aliases, e.g. `double` or `string`, of
+        the records. If not given, the column types are inferred from the
+        first row group, and columns without any value in it are strings.
+    """
+    def __init__(self, path: Union[str, Path], chunk_size: int = 100, schema: Optional[Dict[str, str]] = None):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("pyarrow is needed to write Parquet output, please install it by `pip install pyarrow`")
+        self.path = Path(path)
+        os.makedirs(self.path.parent, exist_ok=True)
+        self.chunk_size = chunk_size
+        self.buffer: List[dict] = []
+        self.schema = self._make_schema(schema) if schema is not None else None
+        self.writer = None
+
+    @staticmethod
+    def _flatten(record: dict) -> dict:
+        return {
+            key: value if value is None or isinstance(value, (bool, int, float, str))
+            else json.dumps(value, cls=MontyEncoder)
+            for key, value in record.items()
+        }
+
+    @staticmethod
+    def _make_schema(schema: Dict[str, str]):
+        import pyarrow as pa
+
+        return pa.schema([(key, pa.type_for_alias(alias)) for key, alias in schema.items()])
+
+    def _infer_schema(self, rows: List[dict]):
+        import pyarrow as pa
+
+        fields = {}
+        for row in rows:
+            for key, value in row.items():
+                if key in fields and fields[key] != pa.null():
+                    continue
+                if value is None:
+                    fields[key] = pa.null()
+                elif isinstance(value, bool):
+                    fields[key] = pa.bool_()
+                elif isinstance(value, (int, float)):
+                    fields[key] = pa.float64()
+                else:
+                    fields[key] = pa.string()
+        # columns without any value in the first row group are kept as strings
+        return pa.schema([(key, pa.string() if t == pa.null() else t) for key, t in fields.items()])
+
+    @staticmethod
+    def _coerce(value, dtype):
+        import pyarrow as pa
+
+        if value is None:
+            return None
+        if dtype == pa.string():
+            return value if isinstance(value, str) else json.dumps(value)
+        if dtype == pa.float64():
+            return float(value) if isinstance(value, (int, float)) else None
+        if pa.types.is_integer(dtype):
+            return int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+        return value if isinstance(value, bool) else None
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if len(self.buffer) == 0:
+            return
+        if self.schema is None:
+            self.schema = self._infer_schema(self.buffer)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(str(self.path), self.schema)
+        rows = [
+            {field.name: self._coerce(row.get(field.name), field.type) for field in self.schema}
+            for row in self.buffer
+        ]
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+        self.buffer = []
+
+    def write(self, record: dict):
+        self.buffer.append(self._flatten(record))
+        if len(self.buffer) >= self.chunk_size:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        if self.writer is None and self.schema is not None:
+            # no record at all, still written with the columns of the schema
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(str(self.path), self.schema)
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_writer(path: Union[str, Path], schema: Optional[Dict[str, str]] = None):
+    """Get a record writer according to the suffix of `path`, `.jsonl` or `.parquet` written with `schema` if given"""
+    suffix = Path(path).suffix
+    if suffix == ".jsonl":
+        return JsonlWriter(path)
+    elif suffix == ".parquet":
+        return ParquetWriter(path, schema=schema)
+    else:
+        raise ValueError(f"Unsupported output format {suffix}, only `.jsonl` and `.parquet` are supported")
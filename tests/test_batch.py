@@ -0,0 +1,52 @@
+import numpy as np
+from ase import Atoms
+
+from lam_optimize.batch import calculate_batch
+
+
+class _DeepPot:
+    def __init__(self):
+        self.calls = 0
+
+    def eval(self, coords, cells, atom_types):
+        # forces depend on the type of each atom, so that a wrong mapping of
+        # the sorted atoms back to the input order is caught
+        self.calls += 1
+        nframes = coords.shape[0]
+        coords = coords.reshape(nframes, -1, 3)
+        scale = np.array(atom_types, dtype=float)[None, :, None] + 1
+        forces = -coords * scale
+        energy = (0.5 * scale * coords**2).sum(axis=(1, 2)).reshape(nframes, 1)
+        virial = np.zeros((nframes, 9))
+        return energy, forces.reshape(nframes, -1), virial
+
+
+class _DPCalculator:
+    def __init__(self):
+        self.dp = _DeepPot()
+        self.type_dict = {"Cu": 0, "Au": 1}
+
+
+# recognized as a DP calculator
+_DPCalculator.__module__ = "deepmd.calculator"
+
+
+def _expected_forces(atoms: Atoms, type_dict: dict) -> np.ndarray:
+    scale = np.array([type_dict[k] for k in atoms.get_chemical_symbols()], dtype=float)[:, None] + 1
+    return -atoms.get_positions() * scale
+
+
+def test_dp_batch_of_heterogeneous_atom_orders():
+    calculator = _DPCalculator()
+    cell = [4.0, 4.0, 4.0]
+    atoms_list = [
+        Atoms("CuAuCu", positions=[[0, 0, 0], [1, 1, 1], [2, 0, 1]], cell=cell, pbc=True),
+        Atoms("AuCuCu", positions=[[0, 1, 0], [1, 2, 1], [3, 0, 1]], cell=cell, pbc=True),
+        Atoms("CuCuAu", positions=[[1, 0, 0], [0, 1, 2], [2, 2, 1]], cell=cell, pbc=True),
+        Atoms("AuAu", positions=[[0, 0, 0], [2, 2, 2]], cell=cell, pbc=True),
+    ]
+    results = calculate_batch(calculator, atoms_list, compute_stress=False)
+    # one model call per composition, whatever the order of the atoms
+    assert calculator.dp.calls == 2
+    for atoms, res in zip(atoms_list, results):
+        np.testing.assert_allclose(res["forces"], _expected_forces(atoms, calculator.type_dict))
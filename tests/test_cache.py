@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+import pytest
+
+from lam_optimize.cache import DiskCache, KeyedLock, LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    cache.clear()
+    assert cache.get("a", "missing") == "missing"
+
+
+def test_keyed_lock():
+    locks = KeyedLock()
+    assert locks("a") is locks("a")
+    assert locks("a") is not locks("b")
+    # another key is not blocked
+    with locks("a"):
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(locks("b").acquire(timeout=1)))
+        thread.start()
+        thread.join()
+        assert acquired == [True]
+        assert not locks("a").acquire(blocking=False)
+
+
+def _writer(content: bytes, calls: list):
+    def fetch(path):
+        calls.append(path)
+        path.write_bytes(content)
+    return fetch
+
+
+def test_disk_cache_fetches_once(tmp_path):
+    cache = DiskCache(tmp_path)
+    calls = []
+    path = cache.get("model.pb", _writer(b"v1", calls))
+    assert path == tmp_path / "model.pb"
+    assert path.read_bytes() == b"v1"
+    assert cache.get("model.pb", _writer(b"v2", calls)).read_bytes() == b"v1"
+    assert len(calls) == 1
+    # no temporary files are left
+    assert sorted(p.name for p in tmp_path.iterdir() if not p.name.endswith(".lock")) == ["model.pb"]
+
+
+def test_disk_cache_refreshes_stale_files(tmp_path):
+    cache = DiskCache(tmp_path, max_age=60)
+    calls = []
+    path = cache.get("data.json", _writer(b"old", calls))
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert cache.get("data.json", _writer(b"new", calls)).read_bytes() == b"new"
+    assert len(calls) == 2
+
+
+def test_disk_cache_falls_back_to_stale_file(tmp_path):
+    cache = DiskCache(tmp_path, max_age=60)
+    path = cache.get("data.json", _writer(b"old", []))
+    old = time.time() - 120
+    os.utime(path, (old, old))
+
+    def fail(tmp):
+        tmp.write_bytes(b"partial")
+        raise ConnectionError("offline")
+
+    assert cache.get("data.json", fail).read_bytes() == b"old"
+    with pytest.raises(ConnectionError):
+        cache.get("missing.json", fail)
+    assert not (tmp_path / "missing.json").exists()
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(tmp_path, max_size=10)
+    a = cache.get("a", _writer(b"aaaa", []))
+    b = cache.get("b", _writer(b"bbbb", []))
+    now = time.time()
+    os.utime(a, (now - 10, now))
+    os.utime(b, (now - 20, now))
+    cache.get("c", _writer(b"cccc", []))
+    assert a.is_file()
+    assert not b.is_file()
+    assert (tmp_path / "c").is_file()
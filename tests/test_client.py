@@ -0,0 +1,62 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from lam_optimize import client
+
+
+class Handler(BaseHTTPRequestHandler):
+    # status codes returned in turn, then 200
+    statuses = []
+    paths = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = json.dumps({"code": 0, "data": {}} if status == 200 else {"error": status}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    Handler.statuses, Handler.paths = [], []
+    yield f"http://127.0.0.1:{httpd.server_port}/query"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_request_json_retries_transient_errors(server, monkeypatch):
+    monkeypatch.setenv("BOHRIUM_ACCESS_KEY", "key")
+    Handler.statuses = [503, 503]
+    assert client.request_json(server, {"formula": "Cu"}) == {"code": 0, "data": {}}
+    assert len(Handler.paths) == 3
+    assert "formula=Cu" in Handler.paths[-1]
+    assert "accessKey=key" in Handler.paths[-1]
+
+
+def test_request_json_raises_on_client_errors(server):
+    Handler.statuses = [404]
+    with pytest.raises(RuntimeError, match="404"):
+        client.request_json(server)
+    # not retried
+    assert len(Handler.paths) == 1
+
+
+def test_session_is_pooled_per_process(monkeypatch):
+    session = client.get_session()
+    assert client.get_session() is session
+    # as in a forked child
+    monkeypatch.setattr(client, "_session_pid", -1)
+    assert client.get_session() is not session
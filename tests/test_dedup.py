@@ -0,0 +1,48 @@
+import json
+from datetime import datetime
+
+from pymatgen.core import Lattice, Structure
+
+from lam_optimize.db import CrystalStructure
+from lam_optimize.dedup import DuplicateFinder, deduplicate
+
+# energy per atom
+ENERGY = -3.7
+
+
+def _cu() -> Structure:
+    return Structure.from_spacegroup("Fm-3m", Lattice.cubic(3.61), ["Cu"], [[0, 0, 0]])
+
+
+def _known(structure: Structure, energy: float) -> CrystalStructure:
+    return CrystalStructure("Cu", None, energy, datetime(2024, 1, 1), raw_structure=json.dumps(structure.as_dict()))
+
+
+def test_known_structures_compared_per_atom():
+    known = [_known(_cu(), ENERGY * 4)]
+    finder = DuplicateFinder(query_known=lambda formula: known)
+    supercell = _cu() * (2, 1, 1)
+    assert finder.check(supercell, ENERGY * len(supercell), "a") == "database"
+
+
+def test_energy_prefilter_skips_parsing():
+    known = [_known(_cu(), ENERGY * 4)]
+    finder = DuplicateFinder(query_known=lambda formula: known)
+    # the same total energy in a twice larger cell is another energy per atom
+    supercell = _cu() * (2, 1, 1)
+    assert finder.check(supercell, ENERGY * 4, "a") is None
+    assert known[0]._structure is None
+
+
+def test_seen_structures_compared_per_atom():
+    finder = DuplicateFinder(query_known=None)
+    assert finder.check(_cu(), ENERGY * 4, "a") is None
+    supercell = _cu() * (2, 2, 1)
+    assert finder.check(supercell, ENERGY * len(supercell), "b") == "a"
+    assert finder.check(supercell, 2 * ENERGY * len(supercell), "c") is None
+
+
+def test_deduplicate():
+    structures = [_cu(), _cu() * (2, 1, 1), Structure(Lattice.cubic(4.09), ["Ag"] * 4, _cu().frac_coords)]
+    energies = [ENERGY * 4, ENERGY * 8, -2.8 * 4]
+    assert deduplicate(structures, energies, labels=["a", "b", "c"], query_known=None) == [None, "a", None]
@@ -0,0 +1,44 @@
+import pytest
+from pymatgen.core import Lattice, Structure
+
+from lam_optimize.ingest import StructureCache, _decode, _encode
+
+
+def _plain():
+    return Structure(Lattice.cubic(4.0), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]], labels=["Na1", "Cl1"])
+
+
+def _decorated():
+    structures = {}
+    structure = _plain()
+    structure.add_oxidation_state_by_element({"Na": 1, "Cl": -1})
+    structures["oxidation_states"] = structure
+    structure = _plain()
+    structure.add_site_property("magmom", [0.5, -0.5])
+    structures["site_properties"] = structure
+    structures["partial_occupancy"] = Structure(Lattice.cubic(4.0), [{"Na": 0.5, "K": 0.5}, "Cl"],
+                                                [[0, 0, 0], [0.5, 0.5, 0.5]])
+    structure = _plain()
+    structure.properties["source"] = "test"
+    structures["properties"] = structure
+    return structures
+
+
+@pytest.mark.parametrize("name", ["plain", "oxidation_states", "site_properties", "partial_occupancy", "properties"])
+def test_round_trip(name):
+    structure = _plain() if name == "plain" else _decorated()[name]
+    decoded = _decode(*_encode(structure))
+    assert decoded.as_dict() == structure.as_dict()
+
+
+def test_cache_hit_matches_parsed(tmp_path):
+    structures = {"plain": _plain(), **_decorated()}
+    cache = StructureCache(tmp_path / "cifs.db")
+    for name, structure in structures.items():
+        cif = tmp_path / f"{name}.cif"
+        structure.to(filename=str(cif))
+        parsed = Structure.from_file(cif).as_dict()
+        # parsed on the miss, read from the cache on the hit
+        assert cache.load(cif).as_dict() == parsed
+        assert cache.load(cif).as_dict() == parsed
+    assert cache.missing(tmp_path.glob("*.cif")) == []
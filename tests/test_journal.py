@@ -0,0 +1,99 @@
+import ase.io
+import pytest
+from ase.build import bulk
+
+from lam_optimize import main
+from lam_optimize.journal import RunJournal
+from lam_optimize.main import iter_relax_run
+from lam_optimize.relaxer import Relaxer
+
+
+def test_journal_round_trip(tmp_path):
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    journal.append("a", {"status": "relaxed", "final_energy": -1.5})
+    journal.append("b", {"status": "failed", "error": "boom"})
+    records = journal.load()
+    assert records == {
+        "a": {"name": "a", "status": "relaxed", "final_energy": -1.5},
+        "b": {"name": "b", "status": "failed", "error": "boom"},
+    }
+    journal.rewrite({"a": records["a"]})
+    assert list(journal.load()) == ["a"]
+    journal.clear()
+    assert journal.load() == {}
+
+
+def test_journal_skips_truncated_line(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = RunJournal(path)
+    journal.append("a", {"status": "relaxed"})
+    # left by a run killed while writing
+    with open(path, "a") as f:
+        f.write('{"name": "b", "sta')
+    assert list(journal.load()) == ["a"]
+    journal.rewrite(journal.load())
+    assert path.read_text().count("\n") == 1
+
+
+@pytest.fixture
+def cifs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / "cifs"
+    folder.mkdir()
+    for i, a in enumerate([3.6, 3.7]):
+        atoms = bulk("Cu", "fcc", a=a, cubic=True)
+        atoms.rattle(0.05, seed=i)
+        ase.io.write(folder / f"cu{i}.cif", atoms, format="cif")
+    return folder
+
+
+def _count_relaxations(monkeypatch):
+    relaxed = []
+    relax_structure = main._relax_structure
+
+    def wrapper(fn, *args, **kwargs):
+        relaxed.append(fn)
+        return relax_structure(fn, *args, **kwargs)
+
+    monkeypatch.setattr(main, "_relax_structure", wrapper)
+    return relaxed
+
+
+def _run(cifs, journal, **kwargs):
+    records = iter_relax_run(cifs, Relaxer("emt"), fmax=0.05, steps=50, check_convergence=False, validate=False,
+                             journal=journal, **kwargs)
+    return {record["name"]: record for record in records}
+
+
+def test_resume_after_truncated_journal(cifs, tmp_path, monkeypatch):
+    journal = tmp_path / "journal.jsonl"
+    first = _run(cifs, journal)
+    assert sorted(first) == ["cu0", "cu1"]
+    # the run was killed while the second record was written
+    lines = journal.read_text().splitlines()
+    journal.write_text(lines[0] + "\n" + lines[1][:20])
+    finished = lines[0].split('"name": "')[1].split('"')[0]
+
+    relaxed = _count_relaxations(monkeypatch)
+    resumed = _run(cifs, journal, resume=True)
+    assert sorted(resumed) == ["cu0", "cu1"]
+    assert relaxed == [name for name in ["cu0", "cu1"] if name != finished]
+    assert resumed[finished]["final_energy"] == pytest.approx(first[finished]["final_energy"])
+    assert sorted(RunJournal(journal).load()) == ["cu0", "cu1"]
+
+
+@pytest.mark.parametrize("retry_failed", [True, False])
+def test_resume_retries_failed(cifs, tmp_path, monkeypatch, retry_failed):
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    journal.append("cu0", {"status": "failed", "error": "boom"})
+    relaxed = _count_relaxations(monkeypatch)
+    records = _run(cifs, journal.path, resume=True, retry_failed=retry_failed)
+    assert sorted(relaxed) == (["cu0", "cu1"] if retry_failed else ["cu1"])
+    assert records["cu0"]["status"] == ("relaxed" if retry_failed else "failed")
+
+
+def test_journal_cleared_without_resume(cifs, tmp_path):
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    journal.append("other", {"status": "relaxed"})
+    _run(cifs, journal.path)
+    assert sorted(journal.load()) == ["cu0", "cu1"]
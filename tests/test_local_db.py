@@ -0,0 +1,98 @@
+import json
+from datetime import datetime
+
+import pytest
+from pymatgen.core import Lattice, Structure
+
+from lam_optimize.db import CrystalStructure
+from lam_optimize.local_db import LocalStructureStore, sync
+
+
+def _item(i: int, formula: str = "Cu", natoms: int = 1) -> dict:
+    structure = Structure(Lattice.cubic(2.5 * natoms), ["Cu"] * natoms, [[j / natoms, 0, 0] for j in range(natoms)])
+    return {
+        "formula": formula,
+        "energy": -3.0 - i,
+        "submissionTime": datetime(2024, 1, 1 + i).isoformat(),
+        "structure": json.dumps(structure.as_dict()),
+    }
+
+
+class FakeAPI:
+    """`CrystalStructure.request_iterate` over a list of items, ordered by id"""
+    def __init__(self, items, fail_at=None):
+        self.items = items
+        self.fail_at = fail_at
+        self.requests = []
+
+    def __call__(self, params: dict) -> dict:
+        self.requests.append(params)
+        if self.fail_at is not None and len(self.requests) == self.fail_at:
+            raise RuntimeError("connection lost")
+        items = self.items
+        if "minSubmissionTime" in params:
+            items = [item for item in items if item["submissionTime"] >= params["minSubmissionTime"]]
+        start, limit = params["startId"], params["limit"]
+        page = items[start:start + limit]
+        if not page:
+            return {"items": None, "nextStartId": 0}
+        end = start + limit
+        return {"items": page, "nextStartId": end if end < len(items) else 0}
+
+
+@pytest.fixture
+def api(monkeypatch):
+    def install(items, fail_at=None):
+        fake = FakeAPI(items, fail_at)
+        monkeypatch.setattr(CrystalStructure, "request_iterate", staticmethod(fake))
+        return fake
+    return install
+
+
+def test_insert_and_query(tmp_path):
+    store = LocalStructureStore(tmp_path / "structures.db")
+    items = [_item(0), _item(1, "Cu", 2), _item(2, "Ag")]
+    store.insert_items(items, meta={"last_sync": "now"})
+    # stored once
+    store.insert_items(items[:1])
+    assert store.count() == 3
+    assert store.get_meta("last_sync") == "now"
+    assert store.latest_submission_time() == datetime(2024, 1, 3)
+    results = store.query(formula="Cu", max_energy=-3.5)
+    assert [item.energy for item in results] == [-4.0]
+    # counted without parsing the structure
+    assert results[0].natoms == 2
+    assert results[0]._structure is None
+    assert len(results[0].structure) == 2
+
+
+def test_sync_is_incremental(tmp_path, api):
+    path = tmp_path / "structures.db"
+    items = [_item(i) for i in range(5)]
+    fake = api(items[:3])
+    assert sync(path, limit=2) == 3
+    assert "minSubmissionTime" not in fake.requests[0]
+    fake = api(items)
+    assert sync(path, limit=2) == 5
+    # only structures submitted since the latest one are requested
+    assert fake.requests[0]["minSubmissionTime"] == items[2]["submissionTime"]
+
+
+def test_interrupted_sync_continues(tmp_path, api):
+    path = tmp_path / "structures.db"
+    items = [_item(i) for i in range(5)]
+    api(items, fail_at=2)
+    with pytest.raises(RuntimeError):
+        sync(path, limit=2)
+    assert LocalStructureStore(path).count() == 2
+    fake = api(items)
+    assert sync(path, limit=2) == 5
+    assert fake.requests[0]["startId"] == 2
+    assert LocalStructureStore(path).get_meta("sync_offset") == "0"
+
+
+def test_crystal_structure_query_uses_mirror(tmp_path, monkeypatch):
+    path = tmp_path / "structures.db"
+    LocalStructureStore(path).insert_items([_item(0), _item(1, "Ag")])
+    monkeypatch.setenv("OPENLAM_STRUCTURE_DB", str(path))
+    assert [item.formula for item in CrystalStructure.iter_query(formula="Ag")] == ["Ag"]
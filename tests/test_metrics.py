@@ -0,0 +1,48 @@
+import json
+
+from lam_optimize.metrics import Metrics
+
+
+def test_disabled_metrics_collect_nothing():
+    metrics = Metrics()
+    with metrics.structure("a"):
+        with metrics.timer("model"):
+            metrics.count("force_calls")
+    assert metrics.pop_structure("a") is None
+    data = metrics.snapshot()
+    assert data["stages"] == {}
+    assert data["counters"] == {}
+    assert data["structures"]["count"] == 0
+
+
+def test_structures_are_aggregated():
+    metrics = Metrics()
+    metrics.enable()
+    for name, calls in [("a", 1), ("b", 3)]:
+        with metrics.structure(name):
+            with metrics.timer("relax"):
+                with metrics.timer("model"):
+                    metrics.count("force_calls", calls)
+    data = metrics.snapshot()
+    assert data["counters"] == {"force_calls": 4}
+    assert data["stages"]["model"]["calls"] == 2
+    assert data["structures"]["count"] == 2
+    assert data["structures"]["counters"]["force_calls"] == {"structures": 2, "total": 4, "max": 3}
+    assert data["structures"]["stages"]["relax"]["structures"] == 2
+    json.dumps(data)
+
+
+def test_structure_from_worker():
+    worker, main = Metrics(), Metrics()
+    worker.enable()
+    main.enable()
+    with worker.structure("a"):
+        worker.count("optimizer_steps", 5)
+    timings = worker.pop_structure("a")
+    assert timings == {"seconds": {}, "counters": {"optimizer_steps": 5}}
+    # popped once only
+    assert worker.pop_structure("a") is None
+    main.add_structure("a", timings)
+    data = main.snapshot()
+    assert data["counters"] == {"optimizer_steps": 5}
+    assert data["structures"]["counters"]["optimizer_steps"]["max"] == 5
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from ase.build import bulk
+from pymatgen.core import Structure
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+from lam_optimize.options import OPTIMIZER_NAMES
+from lam_optimize.relaxer import Relaxer
+
+
+def test_relax_with_symmetry():
+    atoms = bulk("Cu", "fcc", a=3.7, cubic=True)
+    relaxer = Relaxer("emt", symmetry=True)
+    result = relaxer.relax(atoms, fmax=0.05, steps=100)
+    assert result["converged"]
+    final = Structure.from_dict(result["final_structure"])
+    assert SpacegroupAnalyzer(final).get_space_group_number() == 225
+    # the symmetry constraint is not left on the relaxed atoms
+    assert atoms.constraints == []
+
+
+def _rattled_cu():
+    atoms = bulk("Cu", "fcc", a=3.7, cubic=True).repeat(2)
+    atoms.rattle(0.1, seed=0)
+    return atoms
+
+
+def test_mixed_precision_respects_steps():
+    relaxer = Relaxer("emt", precision="mixed", coarse_fmax=1e-3)
+    result = relaxer.relax(_rattled_cu(), fmax=1e-4, steps=3)
+    assert result["steps"] <= 3
+    assert not result["converged"]
+    # the frame at the stage boundary is not recorded twice
+    assert len(result["trajectory"].energies) == result["steps"] + 1
+
+
+def test_mixed_precision_batched():
+    relaxer = Relaxer("emt", precision="mixed", coarse_fmax=0.2)
+    results = relaxer.relax_many([_rattled_cu(), _rattled_cu()], fmax=0.05, steps=200)
+    serial = relaxer.relax(_rattled_cu(), fmax=0.05, steps=200)
+    for result in results + [serial]:
+        assert result["converged"]
+        assert result["steps"] <= 200
+        assert len(result["trajectory"].energies) == result["steps"] + 1
+
+
+@pytest.mark.parametrize("optimizer", OPTIMIZER_NAMES)
+def test_relax_many_matches_relax(optimizer):
+    relaxer = Relaxer("emt", optimizer=optimizer)
+    batched = relaxer.relax_many([_rattled_cu(), _rattled_cu()], fmax=0.05, steps=30)
+    serial = relaxer.relax(_rattled_cu(), fmax=0.05, steps=30)
+    for result in batched:
+        assert result["converged"] == serial["converged"]
+        assert result["steps"] == serial["steps"]
+        np.testing.assert_allclose(result["trajectory"].energies, serial["trajectory"].energies, atol=1e-8)
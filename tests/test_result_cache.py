@@ -0,0 +1,79 @@
+import time
+
+import numpy as np
+from ase.build import bulk
+
+from lam_optimize.result_cache import ResultCache, canonical_order, canonicalize_structure, reorder_structure
+from pymatgen.io.ase import AseAtomsAdaptor
+
+
+def _atoms():
+    atoms = bulk("NaCl", "rocksalt", a=5.64).repeat(2)
+    atoms.rattle(0.05, seed=0)
+    return atoms
+
+
+def test_canonical_order_is_invariant():
+    atoms = _atoms()
+    h, order = canonical_order(atoms)
+    perm = np.random.default_rng(0).permutation(len(atoms))
+    moved = atoms[perm]
+    # one atom moved by a lattice vector
+    moved.positions[0] += moved.cell[0]
+    h2, order2 = canonical_order(moved)
+    assert h2 == h
+    np.testing.assert_array_equal(atoms.numbers[order], moved.numbers[order2])
+    moved.positions[0] += 0.01
+    assert canonical_order(moved)[0] != h
+
+
+def test_make_key():
+    key = ResultCache.make_key("h", "model", {"fmax": 0.05, "steps": 100})
+    assert key == ResultCache.make_key("h", "model", {"steps": 100, "fmax": 0.05})
+    assert key != ResultCache.make_key("h", "model", {"fmax": 0.05, "steps": 200})
+    assert key != ResultCache.make_key("h", "other", {"fmax": 0.05, "steps": 100})
+
+
+def test_per_atom_arrays_follow_the_structure(tmp_path):
+    cache = ResultCache(tmp_path / "results.db")
+    atoms = _atoms()
+    forces = np.random.default_rng(1).normal(size=(len(atoms), 3))
+    h, order = canonical_order(atoms)
+    key = ResultCache.make_key(h, "model", {})
+    assert cache.get(key, order) is None
+    cache.put(key, order, {"energy": -1.0}, {"forces": forces, "stress": np.arange(6.0)})
+
+    perm = np.random.default_rng(2).permutation(len(atoms))
+    h2, order2 = canonical_order(atoms[perm])
+    meta, arrays = cache.get(ResultCache.make_key(h2, "model", {}), order2)
+    assert meta["energy"] == -1.0
+    np.testing.assert_array_equal(arrays["forces"], forces[perm])
+    np.testing.assert_array_equal(arrays["stress"], np.arange(6.0))
+
+
+def test_structures_round_trip():
+    atoms = _atoms()
+    structure = AseAtomsAdaptor.get_structure(atoms).as_dict()
+    _, order = canonical_order(atoms)
+    restored = reorder_structure(canonicalize_structure(structure, order), order)
+    np.testing.assert_allclose(
+        [site["abc"] for site in restored["sites"]], [site["abc"] for site in structure["sites"]])
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path / "results.db")
+    arrays = {"forces": np.zeros((4, 3))}
+    order = np.arange(4)
+    cache.put("a", order, {}, arrays)
+    with cache.connect() as conn:
+        size = conn.execute("SELECT size FROM results").fetchone()[0]
+    cache.max_size = int(2.5 * size)
+    time.sleep(0.01)
+    cache.put("b", order, {}, arrays)
+    time.sleep(0.01)
+    assert cache.get("a", order) is not None
+    time.sleep(0.01)
+    cache.put("c", order, {}, arrays)
+    assert len(cache) == 2
+    assert cache.get("b", order) is None
+    assert cache.get("a", order) is not None
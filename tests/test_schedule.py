@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+
+from lam_optimize.journal import RunJournal
+from lam_optimize.schedule import CostModel, count_atoms, estimate_costs, shard, sort_by_cost, write_shards
+
+
+def _cu(natoms: int) -> Structure:
+    coords = [[i / natoms, 0, 0] for i in range(natoms)]
+    return Structure(Lattice.orthorhombic(2.5 * natoms, 4, 4), ["Cu"] * natoms, coords)
+
+
+@pytest.fixture
+def cifs(tmp_path):
+    folder = tmp_path / "cifs"
+    folder.mkdir()
+    paths = []
+    for i, natoms in enumerate([1, 2, 3, 5, 8, 13, 4, 6]):
+        path = folder / f"s{i}.cif"
+        _cu(natoms).to(filename=str(path))
+        paths.append(path)
+    return paths
+
+
+def test_fit_recovers_power_law():
+    natoms = np.array([4, 8, 16, 32, 64])
+    model = CostModel.fit(natoms, 0.01 * natoms ** 1.5)
+    assert model.prefactor == pytest.approx(0.01)
+    assert model.exponent == pytest.approx(1.5)
+    with pytest.raises(ValueError):
+        CostModel.fit([8, 8], [1.0, 2.0])
+
+
+def test_from_journal(tmp_path):
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    for natoms in [2, 4, 8]:
+        journal.append(f"cu{natoms}", {"status": "relaxed", "initial_structure": _cu(natoms).as_dict(),
+                                        "relax_time": 0.5 * natoms ** 2})
+    # not relaxed, ignored
+    journal.append("failed", {"status": "failed", "relax_time": 100.0})
+    model = CostModel.from_journal(journal.path)
+    assert model.prefactor == pytest.approx(0.5)
+    assert model.exponent == pytest.approx(2.0)
+
+
+def test_count_atoms(cifs):
+    assert [count_atoms(cif) for cif in cifs] == [1, 2, 3, 5, 8, 13, 4, 6]
+
+
+def test_sort_by_cost(cifs):
+    ordered = sort_by_cost(cifs)
+    assert [count_atoms(cif) for cif in ordered] == [13, 8, 6, 5, 4, 3, 2, 1]
+
+
+def test_shards_are_balanced(cifs, tmp_path):
+    costs = dict(zip(cifs, estimate_costs(cifs)))
+    shards = shard(cifs, 3)
+    assert sorted(cif for files in shards for cif in files) == sorted(cifs)
+    totals = [sum(costs[cif] for cif in files) for files in shards]
+    # 42 atoms in 3 shards of 14
+    assert totals == [14, 14, 14]
+    folders = write_shards([cifs[0].parent], 3, tmp_path / "shards")
+    assert sorted(len(list(folder.glob("*.cif"))) for folder in folders) == sorted(len(files) for files in shards)
+
+
+@pytest.mark.parametrize("n", [0, -1])
+def test_shards_need_positive_n(cifs, tmp_path, n):
+    with pytest.raises(ValueError):
+        shard(cifs, n)
+    with pytest.raises(ValueError):
+        write_shards([cifs[0].parent], n, tmp_path / "shards")
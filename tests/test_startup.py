@@ -0,0 +1,38 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# not imported by the startup of `lam-opt`, see `lam_optimize.bench.HEAVY_MODULES`
+HEAVY_MODULES = {"ase", "deepmd", "dflow", "mace", "pandas", "pymatgen", "torch", "tqdm"}
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _imported_modules(*args: str) -> set:
+    # `-X importtime` reports every imported module on stderr, also when the
+    # parser exits after printing the help
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-m", "lam_optimize.entrypoint", *args],
+                          capture_output=True, text=True, cwd=ROOT)
+    assert proc.returncode == 0, proc.stderr
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return modules
+
+
+@pytest.mark.parametrize("args", [["--help"], ["relax", "--help"], ["submit", "--help"], ["bench", "--help"]])
+def test_startup_imports_no_heavy_modules(args):
+    modules = _imported_modules(*args)
+    assert "lam_optimize" in modules
+    assert modules & HEAVY_MODULES == set()
+
+
+def test_check_startup():
+    from lam_optimize.bench import HEAVY_MODULES as BENCH_HEAVY_MODULES
+    from lam_optimize.bench import check_startup
+
+    assert set(BENCH_HEAVY_MODULES) == HEAVY_MODULES
+    records = check_startup(repeat=1)
+    assert all(record["heavy_modules"] == [] for record in records)
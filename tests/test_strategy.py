@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from ase.build import bulk
+
+from lam_optimize.relaxer import Relaxer
+from lam_optimize.strategy import CONTINUE, STAGNATED, SWITCH, AdaptiveStrategy, StagnationMonitor
+
+
+def _rattled_cu():
+    atoms = bulk("Cu", "fcc", a=3.7, cubic=True).repeat(2)
+    atoms.rattle(0.1, seed=0)
+    return atoms
+
+
+def _relax(relaxer: Relaxer, batched: bool, steps: int = 30):
+    if batched:
+        return relaxer.relax_many([_rattled_cu()], fmax=0.05, steps=steps)[0]
+    return relaxer.relax(_rattled_cu(), fmax=0.05, steps=steps)
+
+
+def test_switch_threshold():
+    strategy = AdaptiveStrategy(switch_fmax=0.2, window=0)
+    state = strategy.start(natoms=8)
+    assert state.optimizer == "FIRE"
+    assert state.update(-1.0, 0.3) == CONTINUE
+    assert state.update(-1.1, 0.19) == SWITCH
+    assert state.optimizer == "BFGS"
+    # switched once only
+    assert state.update(-1.2, 0.1) == CONTINUE
+    assert strategy.start(natoms=201).fine == "LBFGS"
+
+
+def test_stagnation_monitor():
+    monitor = StagnationMonitor(window=3, energy_tol=1e-3, fmax_tol=0.05)
+    assert not any(monitor.update(-1.0, 0.5) for _ in range(3))
+    # no progress over the window
+    assert monitor.update(-1.0, 0.5)
+    monitor.reset()
+    energies = [-1.0, -1.1, -1.2, -1.3]
+    assert not any(monitor.update(energy, 0.5) for energy in energies)
+
+
+@pytest.mark.parametrize("batched", [False, True])
+@pytest.mark.parametrize("switch_fmax, large_natoms, optimizer", [
+    (0.0, 200, "FIRE"),
+    (1e3, 200, "BFGS"),
+    (1e3, 1, "LBFGS"),
+])
+def test_adaptive_follows_switch(batched, switch_fmax, large_natoms, optimizer):
+    # never switching keeps FIRE, switching before the first step relaxes
+    # with the fine optimizer all along
+    strategy = AdaptiveStrategy(switch_fmax=switch_fmax, large_natoms=large_natoms, window=0)
+    adaptive = _relax(Relaxer("emt", optimizer="adaptive", strategy=strategy), batched)
+    reference = _relax(Relaxer("emt", optimizer=optimizer), batched=False)
+    assert adaptive["steps"] == reference["steps"]
+    np.testing.assert_allclose(adaptive["trajectory"].energies, reference["trajectory"].energies, atol=1e-8)
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_adaptive_stops_stagnated(batched):
+    # any progress is too little
+    strategy = AdaptiveStrategy(switch_fmax=0.0, window=5, energy_tol=1e3, fmax_tol=10.0)
+    result = _relax(Relaxer("emt", optimizer="adaptive", strategy=strategy), batched)
+    assert result["stagnated"]
+    assert not result["converged"]
+    assert result["steps"] == 5
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from lam_optimize.writer import JsonlWriter, ParquetWriter, get_writer
+
+SCHEMA = {"name": "string", "final_energy": "double", "steps": "int64", "converged": "bool", "error": "string"}
+
+
+def test_jsonl_writer(tmp_path):
+    path = tmp_path / "out" / "results.jsonl"
+    with get_writer(path) as writer:
+        assert isinstance(writer, JsonlWriter)
+        writer.write({"name": "a", "final_energy": -1.5, "structure": {"sites": []}})
+        # flushed as soon as written
+        assert json.loads(path.read_text()) == {"name": "a", "final_energy": -1.5, "structure": {"sites": []}}
+        writer.write({"name": "b", "final_energy": None})
+    assert [json.loads(line)["name"] for line in path.read_text().splitlines()] == ["a", "b"]
+
+
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError):
+        get_writer(tmp_path / "results.csv")
+
+
+def test_parquet_writer_follows_schema(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "results.parquet"
+    with ParquetWriter(path, chunk_size=2, schema=SCHEMA) as writer:
+        # the first row group has no value for most columns
+        writer.write({"name": "a", "final_energy": None, "steps": None, "converged": None, "error": None})
+        writer.write({"name": "b", "final_energy": None, "steps": None, "converged": None, "error": None})
+        writer.write({"name": "c", "final_energy": -2, "steps": 12.0, "converged": True, "error": {"msg": "x"}})
+    table = pq.read_table(path)
+    assert {field.name: str(field.type) for field in table.schema} == {
+        "name": "string", "final_energy": "double", "steps": "int64", "converged": "bool", "error": "string",
+    }
+    assert pq.ParquetFile(path).num_row_groups == 2
+    rows = table.to_pylist()
+    assert rows[2] == {"name": "c", "final_energy": -2.0, "steps": 12, "converged": True, "error": '{"msg": "x"}'}
+
+
+def test_parquet_writer_without_records(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "results.parquet"
+    get_writer(path, schema=SCHEMA).close()
+    table = pq.read_table(path)
+    assert table.num_rows == 0
+    assert table.schema.names == list(SCHEMA)
+
+
+def test_parquet_writer_infers_schema(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "results.parquet"
+    with ParquetWriter(path) as writer:
+        writer.write({"name": "a", "final_energy": -1.0, "structure": {"sites": []}, "error": None})
+    table = pq.read_table(path)
+    assert str(table.schema.field("final_energy").type) == "double"
+    assert str(table.schema.field("error").type) == "string"
+    assert json.loads(table.to_pylist()[0]["structure"]) == {"sites": []}